@@ -2,6 +2,7 @@ import argparse
 import duckdb
 
 from tpch.queries import *
+from ingestion import load_tables
 
 
 def main():
@@ -48,11 +49,8 @@ def main():
 
     tpch_table_names = ["part", "supplier", "partsupp", "customer", "orders", "lineitem", "nation", "region"]
 
-    # Create or Update TPC-H Datasets
-    for t in tpch_table_names:
-        if update_table:
-            db_conn.execute(f"DROP TABLE IF EXISTS {t};")
-        db_conn.execute(f"CREATE TABLE IF NOT EXISTS {t} AS SELECT * FROM read_parquet('{data_folder}/{t}.parquet');")
+    # Create or Update TPC-H Datasets, only the tables whose parquet files changed are reloaded
+    load_tables(db_conn, data_folder, tpch_table_names, update_table)
 
     if explain_mode == "default":
         result = db_conn.sql(exec_query).explain()
@@ -0,0 +1,237 @@
+import glob
+import os
+import re
+import resource
+import shutil
+import time
+import pyarrow.parquet as pq
+
+from concurrent.futures import ThreadPoolExecutor
+
+# dbgen and dsdgen write pipe-delimited files without a header
+SOURCE_DELIMITER = "|"
+
+# The bits of a Z-value, shared evenly by the clustering keys
+ZORDER_BITS = 64
+LAYOUTS = ["none", "sort", "zorder"]
+
+
+def source_files(data_folder, table, extension):
+    # One {table}.<ext>, or the chunks of a parallel generation: dbgen -C <n> -S <i> writes {table}.tbl.<i>,
+    # dsdgen -PARALLEL <n> -CHILD <i> writes {table}_<i>_<n>.dat
+    single_file = f"{data_folder}/{table}.{extension}"
+    if os.path.exists(single_file):
+        return [single_file]
+
+    chunk_patterns = [re.compile(rf"{re.escape(table)}\.{extension}\.(\d+)$"),
+                      re.compile(rf"{re.escape(table)}_(\d+)_\d+\.{extension}$")]
+    chunks = list()
+    for f in glob.glob(f"{data_folder}/{table}*{extension}*"):
+        for pattern in chunk_patterns:
+            match = pattern.match(os.path.basename(f))
+            if match is not None:
+                chunks.append((int(match.group(1)), f))
+    if len(chunks) == 0:
+        raise ValueError(f"Cannot find {table}.{extension} or its chunks in {data_folder}")
+    return [f for _, f in sorted(chunks)]
+
+
+def table_columns(db_conn, table, table_schema):
+    # The (name, type) of every column of a schema such as "(A INTEGER, B VARCHAR)", from an empty table
+    schema_table = f"{table}_columns"
+    db_conn.execute(f"CREATE TEMP TABLE {schema_table} {table_schema};")
+    columns = [(c[0], c[1]) for c in db_conn.execute(f"DESCRIBE {schema_table};").fetchall()]
+    db_conn.execute(f"DROP TABLE {schema_table};")
+    return columns
+
+
+def csv_source(source_files, columns):
+    # The lines end with the delimiter as well, read_csv takes the empty field after it as the end of
+    # the line once the columns are given explicitly
+    column_spec = ", ".join(f"'{name}': '{dtype}'" for name, dtype in columns)
+    return f"read_csv({source_files}, delim='{SOURCE_DELIMITER}', header=false, columns={{{column_spec}}})"
+
+
+def clustering_keys(default_keys, key_specs=None):
+    # Override the default keys with specs such as "lineitem:L_SHIPDATE,L_ORDERKEY"
+    keys = dict(default_keys)
+    for spec in key_specs or []:
+        table, columns = spec.split(":")
+        keys[table] = [c for c in columns.split(",") if c != ""]
+    return keys
+
+
+def zorder_value(keys):
+    # The ranks of every key are scaled to the same number of bits and interleaved, so rows that are
+    # close on all keys get close Z-values
+    bits = ZORDER_BITS // len(keys)
+    return " + ".join(f"(((__rank_{i} >> {b}) & 1) << {b * len(keys) + i})"
+                      for b in range(bits) for i in range(len(keys)))
+
+
+def layout_order(source, keys, layout):
+    # The source with the helper columns the order of the layout needs, the ORDER BY expression,
+    # and the helper columns, which are not written
+    if layout == "sort" or len(keys) == 1:
+        return source, ", ".join(keys), []
+
+    bits = ZORDER_BITS // len(keys)
+    ranks = ", ".join(f"CAST(percent_rank() OVER (ORDER BY {k}) * {2 ** bits - 1} AS UBIGINT) AS __rank_{i}"
+                      for i, k in enumerate(keys))
+    return f"(SELECT *, {ranks} FROM {source})", zorder_value(keys), [f"__rank_{i}" for i in range(len(keys))]
+
+
+def clustered_query(source, keys=None, layout="none"):
+    # A SELECT over the source (a table or read_csv(...)) that returns the rows in the order of the layout
+    if layout == "none" or not keys:
+        return f"SELECT * FROM {source}"
+    ordered_source, order, helper_columns = layout_order(source, keys, layout)
+    exclude = f" EXCLUDE ({', '.join(helper_columns)})" if len(helper_columns) > 0 else ""
+    return f"SELECT *{exclude} FROM {ordered_source} ORDER BY {order}"
+
+
+def configure_memory(db_conn, memory_limit=None, tmp_folder=None):
+    # DuckDB spills to the temp directory instead of failing once the limit is reached
+    if memory_limit is not None:
+        db_conn.execute(f"SET memory_limit='{memory_limit}';")
+    if tmp_folder is not None:
+        db_conn.execute(f"SET temp_directory='{tmp_folder}';")
+
+
+def copy_options(output_format, row_group_size=None):
+    if output_format == "parquet":
+        return f"(FORMAT 'parquet', ROW_GROUP_SIZE {row_group_size})"
+    return "(HEADER 1, DELIMITER ',')"
+
+
+def convert_streaming(db_conn, table, table_schema, source_files, output_file, output_format, row_group_size=None,
+                      keys=None, layout="none"):
+    # read_csv feeds COPY ... TO chunk by chunk, so the row groups are written while the source is read
+    # and the table is never materialized (a sorted layout spills to the temp directory instead)
+    columns = table_columns(db_conn, table, table_schema)
+    db_conn.execute(f"COPY ({clustered_query(csv_source(source_files, columns), keys, layout)}) "
+                    f"TO '{output_file}' {copy_options(output_format, row_group_size)};")
+
+
+def convert_multi_file(db_conn, table, table_schema, source_files, output_folder, row_group_size,
+                       num_files=4, num_workers=4, keys=None, layout="none"):
+    # Write the table as a folder of parquet files. The chunks of a parallel generation are converted
+    # concurrently, one file each, and every chunk is clustered on its own, which is enough for the row
+    # groups of each file to prune. A single source file is split by the threads of one COPY, or with a
+    # layout, into ranges of the clustered order.
+    columns = table_columns(db_conn, table, table_schema)
+    os.makedirs(output_folder)
+
+    if len(source_files) > 1:
+        def convert_chunk(chunk):
+            i, source_file = chunk
+            cursor = db_conn.cursor()
+            cursor.execute(f"COPY ({clustered_query(csv_source([source_file], columns), keys, layout)}) "
+                           f"TO '{output_folder}/part-{i}.parquet' {copy_options('parquet', row_group_size)};")
+            cursor.close()
+
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            list(executor.map(convert_chunk, enumerate(source_files)))
+        return
+
+    if layout != "none" and keys:
+        # The threads of a COPY with PER_THREAD_OUTPUT take the sorted stream in turns, so every file would
+        # span the whole key range. Instead the rows are numbered into num_files ranges of the layout order
+        # (the table spills to the temp directory), and each range is written sorted to its own file.
+        ordered_source, order, helper_columns = layout_order(csv_source(source_files, columns), keys, layout)
+        range_table = f"{table}_ranges"
+        db_conn.execute(f"CREATE TEMP TABLE {range_table} AS "
+                        f"SELECT *, ntile({num_files}) OVER (ORDER BY {order}) AS __range FROM {ordered_source};")
+        try:
+            for i in range(num_files):
+                db_conn.execute(f"COPY (SELECT * EXCLUDE ({', '.join(helper_columns + ['__range'])}) "
+                                f"FROM {range_table} WHERE __range = {i + 1} ORDER BY {order}) "
+                                f"TO '{output_folder}/part-{i}.parquet' {copy_options('parquet', row_group_size)};")
+        finally:
+            db_conn.execute(f"DROP TABLE {range_table};")
+        return
+
+    # every thread of the COPY writes its own file, so the number of threads is the number of files
+    threads = db_conn.execute("SELECT current_setting('threads');").fetchone()[0]
+    db_conn.execute(f"SET threads={num_files};")
+    try:
+        db_conn.execute(f"COPY ({clustered_query(csv_source(source_files, columns), keys, layout)}) "
+                        f"TO '{output_folder}' "
+                        f"(FORMAT 'parquet', ROW_GROUP_SIZE {row_group_size}, PER_THREAD_OUTPUT true, "
+                        f"FILENAME_PATTERN 'part-{{i}}');")
+    finally:
+        db_conn.execute(f"SET threads={threads};")
+
+
+def is_multi_file(source_files, output_format, num_files=1, split_threshold=0):
+    # Chunked sources keep one parquet file per chunk, a single source is split once it reaches
+    # the threshold (MB)
+    if output_format != "parquet":
+        return False
+    if len(source_files) > 1:
+        return True
+    return num_files > 1 and os.path.getsize(source_files[0]) >= split_threshold * 1024 * 1024
+
+
+def convert_hive_partitioned(db_conn, table, table_schema, source_files, output_folder, row_group_size,
+                             date_key, date_source, partition_prefix, keys=None, layout="none"):
+    # Write {output_folder}/<prefix>_year=<y>/<prefix>_moy=<m>/*.parquet, where the year and the month
+    # come from joining the date key with date_dim. Rows without a date end up in the __HIVE_DEFAULT_PARTITION__ directories.
+    columns = table_columns(db_conn, table, table_schema)
+    partition_columns = f"{partition_prefix}_year, {partition_prefix}_moy"
+    partitioned = (f"(SELECT f.*, d.d_year AS {partition_prefix}_year, d.d_moy AS {partition_prefix}_moy "
+                   f"FROM {csv_source(source_files, columns)} f "
+                   f"LEFT JOIN (SELECT d_date_sk, d_year, d_moy FROM {date_source}) d ON f.{date_key} = d.d_date_sk)")
+    db_conn.execute(f"COPY ({clustered_query(partitioned, keys, layout)}) TO '{output_folder}' "
+                    f"(FORMAT 'parquet', ROW_GROUP_SIZE {row_group_size}, PARTITION_BY ({partition_columns}));")
+
+
+def clear_parquet_output(table):
+    # The runners read {table}/ before {table}.parquet, so a layout left by an earlier conversion
+    # must not shadow the new one
+    shutil.rmtree(table, ignore_errors=True)
+    if os.path.exists(f"{table}.parquet"):
+        os.remove(f"{table}.parquet")
+
+
+def parquet_output_files(output):
+    # A single file, a folder of files, or the partition directories of a folder
+    if os.path.isdir(output):
+        return sorted(glob.glob(f"{output}/**/*.parquet", recursive=True))
+    return [output]
+
+
+def print_parquet_stats(output):
+    files = parquet_output_files(output)
+    num_row_groups = sum(pq.ParquetFile(f).num_row_groups for f in files)
+    print(f"Number of row groups in {output}: {num_row_groups} in {len(files)} file(s)")
+
+
+def print_stats_coverage(db_conn, output, keys):
+    # For every clustering key: the row groups with min/max statistics, and the average share of the
+    # value range of the key that one row group spans. A predicate on a narrow range of the key can
+    # skip the row groups whose [min, max] does not overlap it, so the smaller the share the better.
+    files = parquet_output_files(output)
+    for key in keys:
+        stats = db_conn.execute(f"""
+            WITH row_groups AS (
+                SELECT stats_min IS NOT NULL AND stats_max IS NOT NULL AS has_stats,
+                       coalesce(TRY_CAST(stats_min AS DOUBLE), epoch(TRY_CAST(stats_min AS DATE))) AS min_value,
+                       coalesce(TRY_CAST(stats_max AS DOUBLE), epoch(TRY_CAST(stats_max AS DATE))) AS max_value
+                FROM parquet_metadata({files})
+                WHERE lower(path_in_schema) = lower('{key}')),
+            value_range AS (SELECT max(max_value) - min(min_value) AS width FROM row_groups)
+            SELECT count(*), count(*) FILTER (WHERE has_stats), avg((max_value - min_value) / nullif(width, 0))
+            FROM row_groups, value_range;""").fetchone()
+        range_share = f"{stats[2] * 100:.1f}%" if stats[2] is not None else "n/a"
+        print(f"Statistics coverage of {key} in {output}: {stats[1]}/{stats[0]} row groups with min/max, "
+              f"{range_share} of the value range per row group")
+
+
+def peak_memory_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def print_conversion_stats(table, start_time):
+    print(f"Converted {table} in {time.perf_counter() - start_time:.3f}s, peak memory {peak_memory_mb():.1f} MB")
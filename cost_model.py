@@ -1,9 +1,172 @@
+import argparse
+import json
+import mmap
+import os
+import time
 import psutil
+import numpy as np
 
-from scipy.optimize import curve_fit
+from pathlib import Path
+
+# storage profiles are cached per device, since measuring takes seconds
+STORAGE_PROFILE_CACHE = "~/.cache/riveter/storage_profile.json"
+
+
+class LinearPersistenceModel:
+    name = "linear"
+
+    def __init__(self):
+        self.coef = None
+
+    def features(self, X):
+        # X columns: num_join, num_groupby, input_cardinality, suspension_point
+        return np.column_stack([X, np.ones(len(X))])
+
+    def fit(self, X, y, templates=None):
+        self.coef = np.linalg.lstsq(self.features(X), y, rcond=None)[0]
+        return self
+
+    def predict(self, X, templates=None):
+        return self.features(X) @ self.coef
+
+    def get_param(self):
+        return {"name": self.name, "coef": self.coef.tolist()}
+
+    def set_param(self, param):
+        self.coef = np.array(param["coef"])
+        return self
+
+
+class PiecewiseLinearPersistenceModel(LinearPersistenceModel):
+    # Linear in each feature, with hinge terms so the slope in suspension point can change at the knots
+    name = "piecewise"
+
+    def __init__(self, num_knots=3):
+        super().__init__()
+        self.num_knots = num_knots
+        self.knots = None
+
+    def features(self, X):
+        hinges = [np.maximum(X[:, 3] - k, 0) for k in self.knots]
+        return np.column_stack([X, *hinges, np.ones(len(X))])
+
+    def fit(self, X, y, templates=None):
+        # place the knots at the quantiles of the observed suspension points
+        self.knots = np.unique(np.quantile(X[:, 3], np.linspace(0, 1, self.num_knots + 2)[1:-1]))
+        return super().fit(X, y, templates)
+
+    def get_param(self):
+        return {"name": self.name, "coef": self.coef.tolist(), "knots": self.knots.tolist()}
+
+    def set_param(self, param):
+        self.knots = np.array(param["knots"])
+        return super().set_param(param)
+
+
+class LogCardinalityPersistenceModel(LinearPersistenceModel):
+    # Hash tables and aggregates grow sub-linearly with cardinality and with the progress of the query
+    name = "logcard"
+
+    def features(self, X):
+        log_card = np.log1p(X[:, 2])
+        return np.column_stack([X[:, 0], X[:, 1], log_card, X[:, 3], log_card * X[:, 3], np.ones(len(X))])
+
+
+class PerTemplatePersistenceModel:
+    # One model per query template, and a global model for templates with too few executions
+    name = "template"
+
+    def __init__(self, base_model=LinearPersistenceModel, min_samples=8):
+        self.base_model = base_model
+        self.min_samples = min_samples
+        self.global_model = None
+        self.template_models = dict()
+
+    def fit(self, X, y, templates=None):
+        self.global_model = self.base_model().fit(X, y)
+        self.template_models = dict()
+        if templates is not None:
+            templates = np.asarray(templates)
+            for t in np.unique(templates):
+                mask = templates == t
+                if mask.sum() >= self.min_samples:
+                    self.template_models[t] = self.base_model().fit(X[mask], y[mask])
+        return self
+
+    def predict(self, X, templates=None):
+        y = self.global_model.predict(X)
+        if templates is not None:
+            templates = np.broadcast_to(np.asarray(templates), (len(X),))
+            for t, model in self.template_models.items():
+                mask = templates == t
+                if mask.any():
+                    y[mask] = model.predict(X[mask])
+        return y
+
+    def get_param(self):
+        return {"name": self.name,
+                "global": self.global_model.get_param(),
+                "templates": {t: m.get_param() for t, m in self.template_models.items()}}
+
+    def set_param(self, param):
+        self.global_model = persistence_model_from_param(param["global"])
+        self.template_models = {t: persistence_model_from_param(p) for t, p in param["templates"].items()}
+        return self
+
+
+PERSISTENCE_MODELS = {
+    "linear": LinearPersistenceModel,
+    "piecewise": PiecewiseLinearPersistenceModel,
+    "logcard": LogCardinalityPersistenceModel,
+    "template": PerTemplatePersistenceModel,
+}
+
+
+def persistence_model_from_param(param):
+    return PERSISTENCE_MODELS[param["name"]]().set_param(param)
+
+
+def cross_validate_persistence_model(model_name, X, y, templates=None, num_folds=5, seed=0):
+    # k-fold prediction error of one model family, in the unit of persistence size
+    folds = np.array_split(np.random.default_rng(seed).permutation(len(y)), num_folds)
+    abs_error = np.zeros(len(y))
+    for fold in folds:
+        train = np.setdiff1d(np.arange(len(y)), fold)
+        train_templates = None if templates is None else templates[train]
+        fold_templates = None if templates is None else templates[fold]
+        model = PERSISTENCE_MODELS[model_name]().fit(X[train], y[train], train_templates)
+        abs_error[fold] = np.abs(model.predict(X[fold], fold_templates) - y[fold])
+
+    return {"mae": float(abs_error.mean()),
+            "mape": float(np.mean(abs_error / np.maximum(np.abs(y), 1e-12))),
+            "max_error": float(abs_error.max())}
+
+
+def select_persistence_model(X, y, templates=None, model_names=None, num_folds=5):
+    model_names = list(PERSISTENCE_MODELS) if model_names is None else model_names
+    # a new list, the caller's list is left as it is
+    model_names = [m for m in model_names if templates is not None or m != "template"]
+
+    cv_report = {name: cross_validate_persistence_model(name, X, y, templates, num_folds) for name in model_names}
+    best_name = min(cv_report, key=lambda name: cv_report[name]["mae"])
+    best_model = PERSISTENCE_MODELS[best_name]().fit(X, y, templates)
+
+    return best_model, cv_report
+
+
+def print_cv_report(cv_report, rand_write_speed, rand_read_speed):
+    # the error of the size translates into the error of suspend + resume latency of a decision
+    latency_factor = 1 / rand_write_speed + 1 / rand_read_speed
+    print(f"{'Model':<12}{'MAE':>16}{'MAPE':>10}{'Max Error':>16}{'Latency MAE (s)':>18}")
+    for name, err in sorted(cv_report.items(), key=lambda item: item[1]["mae"]):
+        print(f"{name:<12}{err['mae']:>16.3f}{err['mape']:>10.3f}{err['max_error']:>16.3f}"
+              f"{err['mae'] * latency_factor:>18.6f}")
 
 
 class ProcLatencyEstimator:
+    # identifies the fitted function in the fit cache, change it whenever func_persistence_size changes
+    MODEL_FORM = "linear(num_join,num_groupby,input_cardinality,suspension_point)"
+
     def __init__(self,
                  rand_write_speed,
                  rand_read_speed,
@@ -11,7 +174,9 @@ class ProcLatencyEstimator:
                  num_groupby_array,
                  input_cardinality_array,
                  suspension_point_array,
-                 persistence_size_array):
+                 persistence_size_array,
+                 model_name=None,
+                 query_template_array=None):
         # rand r/w speed of hardware storage
         self.rand_write_speed = rand_write_speed
         self.rand_read_speed = rand_read_speed
@@ -28,6 +193,14 @@ class ProcLatencyEstimator:
         # the param estimated from regression
         self.param = None
 
+        # an optional model family replacing func_persistence_size, "cv" selects one by cross-validation
+        self.model_name = model_name
+        self.model = None
+        self.cv_report = None
+        self.query_template_array = query_template_array
+        # the template of the query under estimation, used by per-template models
+        self.query_template = None
+
         # estimate latency
         self.suspend_latency_est = None
         self.resume_latency_est = None
@@ -39,13 +212,51 @@ class ProcLatencyEstimator:
         return y.ravel()
 
     def fit_curve(self):
+        # scipy is only imported when a fit is needed, which keeps it off the path of cached estimators
         assert len(self.num_join_array) == len(self.input_cardinality_array) == len(self.suspension_point_array)
+
+        if self.model_name is not None:
+            X = np.column_stack([self.num_join_array, self.num_groupby_array,
+                                 self.input_cardinality_array, self.suspension_point_array]).astype(float)
+            y = np.asarray(self.persistence_size_array, dtype=float)
+            templates = None if self.query_template_array is None else np.asarray(self.query_template_array)
+            if self.model_name == "cv":
+                self.model, self.cv_report = select_persistence_model(X, y, templates)
+            else:
+                self.model = PERSISTENCE_MODELS[self.model_name]().fit(X, y, templates)
+            return
+
+        from scipy.optimize import curve_fit
+
         x = (self.num_join_array, self.num_groupby_array, self.input_cardinality_array, self.suspension_point_array)
         y = self.persistence_size_array
 
         self.param, _ = curve_fit(self.func_persistence_size, x, y)
 
+    def model_form(self):
+        if self.model_name is None:
+            return self.MODEL_FORM
+        return f"{self.model_name}:lstsq(num_join,num_groupby,input_cardinality,suspension_point)"
+
+    def get_param(self):
+        if self.model is not None:
+            return self.model.get_param()
+        return [float(p) for p in self.param]
+
+    def set_param(self, param):
+        if isinstance(param, dict):
+            self.model = persistence_model_from_param(param)
+        else:
+            self.param = np.array(param)
+
     def persist_size_estimation(self, num_join, num_groupby, input_card, suspension_point):
+        if self.model is not None:
+            suspension_point = np.asarray(suspension_point, dtype=float)
+            X = np.column_stack(np.broadcast_arrays(float(num_join), float(num_groupby), float(input_card),
+                                                    suspension_point.ravel()))
+            persist_size_est = self.model.predict(X, self.query_template)
+            return persist_size_est.reshape(suspension_point.shape)
+
         return (num_join * self.param[0] +
                 num_groupby * self.param[1] +
                 input_card * self.param[2] +
@@ -62,26 +273,315 @@ class ProcLatencyEstimator:
         return self.resume_latency_est
 
 
+class OnlineProcLatencyEstimator(ProcLatencyEstimator):
+    # Recursive least squares over the same features, so each observation costs O(features^2)
+    # regardless of how many executions have been absorbed
+    MODEL_FORM = ProcLatencyEstimator.MODEL_FORM + ":rls"
+
+    def __init__(self, rand_write_speed, rand_read_speed, forgetting_factor=1.0, init_cov=1e6):
+        super().__init__(rand_write_speed, rand_read_speed, [], [], [], [], [])
+        # forgetting_factor < 1 discounts older executions exponentially
+        self.forgetting_factor = forgetting_factor
+
+        # RLS runs on features divided by the magnitude of the first observation, since the
+        # input cardinality is orders of magnitude larger than the other features
+        self.feature_scale = None
+        self.theta = np.zeros(5)
+        self.cov = np.eye(5) * init_cov
+        self.num_updates = 0
+        self.param = np.zeros(5)
+
+    def update(self, num_join, num_groupby, input_card, suspension_point, persistence_size):
+        x = np.array([num_join, num_groupby, input_card, suspension_point, 1.0], dtype=float)
+        if self.feature_scale is None:
+            self.feature_scale = np.maximum(np.abs(x), 1.0)
+        x = x / self.feature_scale
+
+        cov_x = self.cov @ x
+        gain = cov_x / (self.forgetting_factor + x @ cov_x)
+        self.theta = self.theta + gain * (persistence_size - x @ self.theta)
+        self.cov = (self.cov - np.outer(gain, cov_x)) / self.forgetting_factor
+        # keep the covariance symmetric against rounding errors
+        self.cov = (self.cov + self.cov.T) / 2
+
+        self.param = self.theta / self.feature_scale
+        self.num_updates += 1
+
+    def fit_curve(self):
+        # absorb the historical executions that were given to the constructor-compatible arrays
+        for qe in zip(self.num_join_array, self.num_groupby_array, self.input_cardinality_array,
+                      self.suspension_point_array, self.persistence_size_array):
+            self.update(*qe)
+        self.num_join_array = []
+        self.num_groupby_array = []
+        self.input_cardinality_array = []
+        self.suspension_point_array = []
+        self.persistence_size_array = []
+
+    def get_state(self):
+        return {"model_form": self.MODEL_FORM,
+                "forgetting_factor": self.forgetting_factor,
+                "feature_scale": None if self.feature_scale is None else self.feature_scale.tolist(),
+                "theta": self.theta.tolist(),
+                "cov": self.cov.tolist(),
+                "num_updates": self.num_updates}
+
+    def set_state(self, state):
+        # the forgetting factor of the caller (e.g., -ff) wins over the one the state was saved with
+        if state["forgetting_factor"] != self.forgetting_factor:
+            print(f"[Python] Forgetting factor {state['forgetting_factor']} of the saved state differs, "
+                  f"keeping {self.forgetting_factor}")
+        self.feature_scale = None if state["feature_scale"] is None else np.array(state["feature_scale"])
+        self.theta = np.array(state["theta"])
+        self.cov = np.array(state["cov"])
+        self.num_updates = state["num_updates"]
+        self.param = self.theta if self.feature_scale is None else self.theta / self.feature_scale
+
+
+class ProcCostCurve:
+    def __init__(self, suspension_points, costs, decision_latency):
+        # the probed process-level suspension points and the cost of suspending at each of them
+        self.suspension_points = suspension_points
+        self.costs = costs
+        self.decision_latency = decision_latency
+
+        if len(costs) == 0:
+            self.best_point = None
+            self.best_cost = np.inf
+        else:
+            best_idx = np.argmin(costs)
+            self.best_point = suspension_points[best_idx]
+            self.best_cost = costs[best_idx]
+
+
+def proc_cost(proc_estimator, num_join, num_groupby, input_card, suspension_points,
+              current_exec_time, term_start, current_term_prob):
+    # Evaluate the process-level cost of all suspension points in one array pass
+    latency_suspend = proc_estimator.suspend_latency_estimation(num_join, num_groupby, input_card, suspension_points)
+    latency_resume = proc_estimator.resume_latency_estimation(num_join, num_groupby, input_card, suspension_points)
+    prob_proc_term = np.where(current_exec_time + latency_suspend > term_start, current_term_prob, 0)
+    return latency_suspend + latency_resume + prob_proc_term * suspension_points
+
+
+def proc_cost_curve(proc_estimator, num_join, num_groupby, input_card,
+                    current_exec_time, term_start, term_end, current_term_prob, time_unit, closed_form=False):
+    decision_start = time.perf_counter()
+
+    # the same probes as moving forward from the current time by `time_unit` until `term_end`
+    num_probes = int(np.floor((term_end - current_exec_time) / time_unit)) + 1 if current_exec_time <= term_end else 0
+
+    # other model families are not linear in suspension point, so they always evaluate the full curve
+    if closed_form and num_probes > 0 and proc_estimator.model is None:
+        # The estimated size is linear in the suspension point, so the cost is linear on both sides of the
+        # point where the suspension starts to overlap the termination window. The minimum is at one of the
+        # end points of the two pieces, so only the probes around them are evaluated.
+        slope = proc_estimator.param[3]
+        candidates = {0, num_probes - 1}
+        if slope != 0:
+            intercept = proc_estimator.persist_size_estimation(num_join, num_groupby, input_card, 0)
+            overlap_point = ((term_start - current_exec_time) * proc_estimator.rand_write_speed - intercept) / slope
+            overlap_idx = int(np.floor((overlap_point - current_exec_time) / time_unit))
+            candidates.update(i for i in range(overlap_idx - 1, overlap_idx + 3) if 0 <= i < num_probes)
+        probe_idx = np.array(sorted(candidates))
+    else:
+        probe_idx = np.arange(num_probes)
+
+    suspension_points = current_exec_time + probe_idx * time_unit
+    costs = proc_cost(proc_estimator, num_join, num_groupby, input_card, suspension_points,
+                      current_exec_time, term_start, current_term_prob)
+
+    return ProcCostCurve(suspension_points, costs, time.perf_counter() - decision_start)
+
+
+class IOLatencyModel:
+    # latency = fixed_overhead + file_overhead * num_files + persistence_size / (bandwidth * parallelism ^ efficiency)
+    # The fixed and per-file terms cover file creation, fsync, metadata and the serialization
+    # of small states, and the efficiency tells how well partitioned writes/reads scale
+    def __init__(self, fixed_overhead=0.0, file_overhead=0.0, bandwidth=None, parallel_efficiency=1.0):
+        self.fixed_overhead = fixed_overhead
+        self.file_overhead = file_overhead
+        self.bandwidth = bandwidth
+        self.parallel_efficiency = parallel_efficiency
+
+    def latency_estimation(self, persistence_size, num_files=1, parallelism=1):
+        effective_bandwidth = self.bandwidth * np.power(parallelism, self.parallel_efficiency)
+        return self.fixed_overhead + self.file_overhead * num_files + persistence_size / effective_bandwidth
+
+    def fit(self, persistence_size, num_files, parallelism, latency):
+        from scipy.optimize import nnls
+
+        persistence_size = np.asarray(persistence_size, dtype=float)
+        num_files = np.asarray(num_files, dtype=float)
+        parallelism = np.asarray(parallelism, dtype=float)
+        latency = np.asarray(latency, dtype=float)
+
+        # the model is linear for a fixed efficiency, so search the efficiency on a grid and
+        # solve the non-negative coefficients for each of them
+        best_residual = np.inf
+        for efficiency in np.linspace(0, 1, 21):
+            A = np.column_stack([np.ones(len(latency)), num_files, persistence_size / np.power(parallelism, efficiency)])
+            coef, residual = nnls(A, latency)
+            if residual < best_residual and coef[2] > 0:
+                best_residual = residual
+                self.fixed_overhead, self.file_overhead = coef[0], coef[1]
+                self.bandwidth = 1 / coef[2]
+                self.parallel_efficiency = efficiency
+
+        if self.bandwidth is None:
+            raise ValueError("Cannot calibrate the bandwidth from the given timings")
+        return self
+
+    def get_param(self):
+        return {"fixed_overhead": float(self.fixed_overhead), "file_overhead": float(self.file_overhead),
+                "bandwidth": float(self.bandwidth), "parallel_efficiency": float(self.parallel_efficiency)}
+
+
 class PipelineLatencyEstimator:
-    def __init__(self, persistence_size, rand_write_speed, rand_read_speed):
+    def __init__(self, persistence_size, rand_write_speed, rand_read_speed,
+                 suspend_io_model=None, resume_io_model=None, num_files=1, parallelism=1):
         self.persistence_size = persistence_size
         self.rand_write_speed = rand_write_speed
         self.rand_read_speed = rand_read_speed
 
+        # calibrated I/O models, the plain bandwidth division is used without them
+        self.suspend_io_model = suspend_io_model
+        self.resume_io_model = resume_io_model
+        # number of files written by a (partitioned) suspension and how many are written in parallel
+        self.num_files = num_files
+        self.parallelism = parallelism
+
         # estimate latency
         self.suspend_latency_est = None
         self.resume_latency_est = None
 
     def suspend_latency_estimation(self):
-        self.suspend_latency_est = self.persistence_size / self.rand_write_speed
+        if self.suspend_io_model is not None:
+            self.suspend_latency_est = self.suspend_io_model.latency_estimation(self.persistence_size,
+                                                                                self.num_files, self.parallelism)
+        else:
+            self.suspend_latency_est = self.persistence_size / self.rand_write_speed
         return self.suspend_latency_est
 
     def resume_latency_estimation(self):
-        self.resume_latency_est = self.persistence_size / self.rand_read_speed
+        if self.resume_io_model is not None:
+            self.resume_latency_est = self.resume_io_model.latency_estimation(self.persistence_size,
+                                                                              self.num_files, self.parallelism)
+        else:
+            self.resume_latency_est = self.persistence_size / self.rand_read_speed
         return self.resume_latency_est
 
 
-def profile_hardware():
+def open_direct(path, flags):
+    # bypass the page cache when the filesystem supports it (tmpfs does not)
+    if hasattr(os, "O_DIRECT"):
+        try:
+            return os.open(path, flags | os.O_DIRECT), True
+        except OSError:
+            pass
+    return os.open(path, flags), False
+
+
+def drop_file_cache(fd):
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def profile_storage(directory, file_size_mb=256, block_size=4096, num_random_ops=8192, num_fsync_ops=64):
+    # Measure the throughput (MB/s, the unit of RAND_WRITE_SPEED/RAND_READ_SPEED) and fsync latency (s)
+    # of the device behind `directory`
+    file_size = file_size_mb * (1 << 20)
+    seq_chunk = 1 << 20
+    test_file = Path(directory) / f".riveter_storage_profile_{os.getpid()}"
+    rng = np.random.default_rng(0)
+    # an anonymous mmap is page aligned, which O_DIRECT requires
+    seq_buf = mmap.mmap(-1, seq_chunk)
+    seq_buf.write(rng.bytes(seq_chunk))
+    block_buf = mmap.mmap(-1, block_size)
+    block_buf.write(rng.bytes(block_size))
+    num_blocks = file_size // block_size
+
+    try:
+        fd, direct_io = open_direct(test_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+        seq_write_start = time.perf_counter()
+        for offset in range(0, file_size, seq_chunk):
+            os.pwritev(fd, [seq_buf], offset)
+        os.fsync(fd)
+        seq_write_time = time.perf_counter() - seq_write_start
+
+        rand_offsets = rng.integers(0, num_blocks, num_random_ops) * block_size
+        rand_write_start = time.perf_counter()
+        for offset in rand_offsets:
+            os.pwritev(fd, [block_buf], int(offset))
+        os.fsync(fd)
+        rand_write_time = time.perf_counter() - rand_write_start
+
+        fsync_latency_list = list()
+        for offset in rand_offsets[:num_fsync_ops]:
+            os.pwritev(fd, [block_buf], int(offset))
+            fsync_start = time.perf_counter()
+            os.fsync(fd)
+            fsync_latency_list.append(time.perf_counter() - fsync_start)
+        os.close(fd)
+
+        fd, _ = open_direct(test_file, os.O_RDONLY)
+        drop_file_cache(fd)
+        seq_read_start = time.perf_counter()
+        for offset in range(0, file_size, seq_chunk):
+            os.preadv(fd, [seq_buf], offset)
+        seq_read_time = time.perf_counter() - seq_read_start
+
+        drop_file_cache(fd)
+        rand_offsets = rng.integers(0, num_blocks, num_random_ops) * block_size
+        rand_read_start = time.perf_counter()
+        for offset in rand_offsets:
+            os.preadv(fd, [block_buf], int(offset))
+        rand_read_time = time.perf_counter() - rand_read_start
+        os.close(fd)
+    finally:
+        if test_file.exists():
+            test_file.unlink()
+
+    rand_size_mb = num_random_ops * block_size / 1000000
+    return {"directory": str(Path(directory).resolve()),
+            "direct_io": direct_io,
+            "seq_write_speed": file_size / 1000000 / seq_write_time,
+            "seq_read_speed": file_size / 1000000 / seq_read_time,
+            "rand_write_speed": rand_size_mb / rand_write_time,
+            "rand_read_speed": rand_size_mb / rand_read_time,
+            "fsync_latency": float(np.median(fsync_latency_list)),
+            "profiled_at": time.time()}
+
+
+def storage_device(directory):
+    # the device id of the closest existing directory, since the persistence location may not exist yet
+    directory = Path(directory).resolve()
+    while not directory.exists():
+        directory = directory.parent
+    st_dev = os.stat(directory).st_dev
+    return f"{os.major(st_dev)}:{os.minor(st_dev)}", directory
+
+
+def get_storage_profile(directory, refresh=False, cache_file=STORAGE_PROFILE_CACHE):
+    device, directory = storage_device(directory)
+    cache_file = Path(cache_file).expanduser()
+
+    storage_profiles = dict()
+    if cache_file.exists():
+        with open(cache_file) as fp:
+            storage_profiles = json.load(fp)
+
+    if refresh or device not in storage_profiles:
+        storage_profiles[device] = profile_storage(directory)
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_cache_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_cache_file, "w") as fp:
+            json.dump(storage_profiles, fp, indent=2)
+        os.replace(tmp_cache_file, cache_file)
+
+    return storage_profiles[device]
+
+
+def profile_hardware(storage_dirs=None):
     hw_threads_num = psutil.cpu_count(logical=True)
     total_memory_gb = psutil.virtual_memory()[0] / 1000000000
     available_memory_gb = psutil.virtual_memory()[1] / 1000000000
@@ -90,5 +590,26 @@ def profile_hardware():
     print(f"Total Memory Size (GB): {total_memory_gb}")
     print(f"Available Memory Size (GB): {available_memory_gb}")
 
-    return hw_threads_num, total_memory_gb, available_memory_gb
+    storage_profiles = dict()
+    for storage_dir in storage_dirs if storage_dirs is not None else []:
+        storage_profiles[storage_dir] = get_storage_profile(storage_dir, refresh=True)
+        sp = storage_profiles[storage_dir]
+        print(f"Storage of {storage_dir} (direct I/O: {sp['direct_io']})")
+        print(f"  Sequential Write/Read Speed (MB/s): {sp['seq_write_speed']:.1f} / {sp['seq_read_speed']:.1f}")
+        print(f"  Random Write/Read Speed (MB/s): {sp['rand_write_speed']:.1f} / {sp['rand_read_speed']:.1f}")
+        print(f"  Fsync Latency (ms): {sp['fsync_latency'] * 1000:.3f}")
+
+    return hw_threads_num, total_memory_gb, available_memory_gb, storage_profiles
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-sd", "--storage_dir", type=str, action="store", nargs="+",
+                        help="indicate the persistence and CRIU checkpoint directories to profile")
+    args = parser.parse_args()
+
+    profile_hardware(args.storage_dir)
+
 
+if __name__ == "__main__":
+    main()
@@ -27,89 +27,14 @@ do
     esac
 done
 
-criu_cmd=/usr/lib/criu/criu-3.17.1/criu/criu
+export RIVETER_CRIU_CMD=${RIVETER_CRIU_CMD:-/usr/lib/criu/criu-3.17.1/criu/criu}
 ckpt_path=./criu-ckpt
-sum_time=0.0
-checkpoint_sum_time=0.0
-itr=1
-PID=0
-while [[ $itr -le $LOOP ]]
-do
-    echo "== Starting $itr iteration =="
-    echo "== Cleaning cache =="
-    sudo sh -c "/usr/bin/echo 1 > /proc/sys/vm/drop_caches"
-
-    start_time=$(date +%s.%3N)
-    # cargo run --release --bin tpch -- benchmark --query "$QID" --batch-size "$BATCH_SIZE" --path "$DATASET_PATH" --debug &
-    python3 ../tpch/ratchet_tpch.py -q "$QID" -d "$DATABASE" -df "$DATA_FILE" -td "$THREAD" -tmp tmp&
-    PID=$!
-    # PID=$(ps -ef | grep "target/release/tpch benchmark" | grep -v grep | awk '{print $2}')
-
-    # TODO: support multiple suspends during runtime
-    for i in "${!STOP_TIME[@]}"; do
-      sleep "${STOP_TIME[$i]}"
-      echo "== $i Suspend Job =="
-
-      # checkpoint process into disk
-      checkpoint_start_time=$(date +%s.%3N)
-      if [ "$i" != 0 ]; then
-        PID=$(sudo head -n 1 "$ckpt_path/restore_$((i-1)).pid")
-        echo "CRIU Dumps Proc $PID"
-      fi
-
-      if [ -d "$ckpt_path/ckpt_${PID}_${i}" ]; then
-        echo "Removing and Creating $ckpt_path/ckpt_${PID}_${i} folder."
-        sudo rm -rf "$ckpt_path/ckpt_${PID}_${i}"
-        mkdir "$ckpt_path/ckpt_${PID}_${i}"
-      else
-        echo "Creating $ckpt_path/ckpt_${PID}_${i} folder."
-        mkdir "$ckpt_path/ckpt_${PID}_${i}"
-      fi
-
-      sudo "$criu_cmd" dump -D "$ckpt_path/ckpt_${PID}_${i}" -t "$PID" --file-locks --shell-job
-      echo "Dumping to $ckpt_path/ckpt_${PID}_${i}"
-
-      # force data sync between buffer and disk
-      sync
-      checkpoint_end_time=$(date +%s.%3N)
-      checkpoint_time=$(echo "scale=3; $checkpoint_end_time - $checkpoint_start_time" | bc)
-
-      # clean page cache 
-      sudo sh -c "/usr/bin/echo 1 > /proc/sys/vm/drop_caches"
-
-      echo "== $i Resume Job =="
-      echo "Restoring from $ckpt_path/ckpt_${PID}_${i}"
-      if [ $((i+1)) = ${#STOP_TIME[@]} ]; then
-        echo "Final Restore"
-
-        # The following code is used to re-point to /dev/pts/ptmx, but may bring over-mounted issue
-        # sudo mount -t devpts -o newinstance lxcpts /dev/pts
-        # sudo mount -o bind /dev/pts/ptmx /dev/ptmx
-
-        # restore the process from disk and print out final results
-        output=$(sudo "$criu_cmd" restore -D "$ckpt_path/ckpt_${PID}_${i}" --shell-job)
-        echo "$output"
-      else
-        # restore the process from disk and wait for the next suspend
-        # --restore-detached is used so that the restored process will be running background
-        sudo "$criu_cmd" restore -D "$ckpt_path/ckpt_${PID}_${i}" --pidfile "$ckpt_path/restore_${i}.pid" --shell-job --restore-detached
-      fi
-
-      ckpt_size=$(du -sh "$ckpt_path")
-      eval "echo Size of CKPT by CRIU: $ckpt_size"
-    done
-    end_time=$(date +%s.%3N)
-
-    # elapsed time with millisecond resolution
-    # keep three digits after floating point.
-    elapsed=$(echo "scale=3; $end_time - $start_time" | bc)
-    eval "echo Elapsed Time: $elapsed seconds"
-    sum_time=$(echo "$sum_time" + "$elapsed" | bc)
-    checkpoint_sum_time=$(echo "$checkpoint_sum_time" + "$checkpoint_time" | bc)
-    ((itr = itr + 1))
+stop_args=()
+for st in "${STOP_TIME[@]}"; do
+  stop_args+=(-s "$st")
 done
 
-avg_time=$(echo "scale=3; $sum_time/$LOOP" | bc)
-eval "echo Elapsed Time: $avg_time seconds on average of $LOOP iteration"
-checkpoint_avg_time=$(echo "scale=3; $checkpoint_sum_time/$LOOP" | bc)
-eval "echo Checkpoint Time: $checkpoint_avg_time seconds on average of $LOOP iteration"
\ No newline at end of file
+# criu_driver.py suspends and resumes the query after each stop time, and prints the freeze, write, sync,
+# restore and time-to-first-row of every suspension as one JSON line (also appended to criu_perf.jsonl)
+python3 ../criu_driver.py -o criu_perf.jsonl perf -cp "$ckpt_path" -dc -l "$LOOP" "${stop_args[@]}" \
+  -- python3 ../tpch/ratchet_tpch.py -q "$QID" -d "$DATABASE" -df "$DATA_FILE" -td "$THREAD" -tmp tmp
@@ -3,7 +3,7 @@ help_func() {
     echo "Usage:"
     echo "criu_restore.sh [-p CKPT_PATH]"
     echo "Description:"
-    echo "CKPT_PATH, the checkpoint path for resume"
+    echo "CKPT_PATH, the checkpoint path for resume (the folder written by criu_suspend.sh)"
     exit 0
 }
 
@@ -16,18 +16,12 @@ do
     esac
 done
 
-criu_cmd=/usr/lib/criu/criu-3.17.1/criu/criu
-ckpt_path=/home/ruiliu/Develop/ratchet-duckdb/ratchet/criu/criu-ckpt/
-
-PID=$(ps -ef | grep "python3 demo.py" | grep -v grep | awk '{print $2}')
+export RIVETER_CRIU_CMD=${RIVETER_CRIU_CMD:-/usr/lib/criu/criu-3.17.1/criu/criu}
 
 if [ -d "$CKPT_PATH" ]; then
   echo "Resuming from "$CKPT_PATH" folder."
-  output=$(sudo "$criu_cmd" restore -D "$CKPT_PATH" --shell-job)
-  echo "$output"
+  # restore, wait until the query exits and print the phase metrics as JSON
+  python3 ../criu_driver.py resume -D "$CKPT_PATH"
 else
   echo "We cannot find "$CKPT_PATH" folder."
 fi
-
-
-
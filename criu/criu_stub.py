@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# A stand-in for the criu binary, so criu_driver.py can be exercised without root:
+#   RIVETER_CRIU_CMD=criu/criu_stub.py RIVETER_CRIU_SUDO=0 python3 criu_driver.py perf -s 1 -- <query command>
+# dump writes as many bytes as the resident memory of the process and kills it, restore starts the
+# recorded command line again. The query restarts from the beginning, only the control flow, the
+# images and the timing of the orchestration are real.
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+
+from pathlib import Path
+
+STUB_IMAGE = "stub.json"
+PAGE_IMAGE = "pages-1.img"
+WRITE_CHUNK = 1 << 20
+
+
+def resident_bytes(pid):
+    for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+        if line.startswith("VmRSS:"):
+            return int(line.split()[1]) * 1024
+    return 0
+
+
+def dump(args, kill):
+    images_dir = Path(args.images_dir)
+    images_dir.mkdir(parents=True, exist_ok=True)
+
+    process = {"cmdline": Path(f"/proc/{args.tree}/cmdline").read_bytes().decode().split("\0")[:-1],
+               "cwd": os.readlink(f"/proc/{args.tree}/cwd"),
+               "environ": dict(e.split("=", 1) for e in
+                               Path(f"/proc/{args.tree}/environ").read_bytes().decode().split("\0") if "=" in e)}
+    (images_dir / STUB_IMAGE).write_text(json.dumps(process))
+
+    remaining = resident_bytes(args.tree)
+    with open(images_dir / PAGE_IMAGE, "wb") as f:
+        while remaining > 0:
+            f.write(bytes(min(WRITE_CHUNK, remaining)))
+            remaining -= WRITE_CHUNK
+
+    if kill and not args.leave_running:
+        os.kill(args.tree, signal.SIGKILL)
+
+
+def restore(args):
+    process = json.loads((Path(args.images_dir) / STUB_IMAGE).read_text())
+    proc = subprocess.Popen(process["cmdline"], cwd=process["cwd"], env=process["environ"],
+                            start_new_session=args.restore_detached)
+    if args.restore_detached:
+        if args.pidfile is not None:
+            Path(args.pidfile).write_text(str(proc.pid))
+        return 0
+    return proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("action", choices=["pre-dump", "dump", "restore", "lazy-pages"])
+    parser.add_argument("-D", "--images-dir", dest="images_dir", required=True)
+    parser.add_argument("-t", "--tree", type=int)
+    parser.add_argument("--prev-images-dir")
+    parser.add_argument("--pidfile")
+    parser.add_argument("--restore-detached", action="store_true")
+    parser.add_argument("--leave-running", action="store_true")
+    # accepted and ignored
+    for option in ["--track-mem", "--shell-job", "--file-locks", "--lazy-pages"]:
+        parser.add_argument(option, action="store_true")
+    args = parser.parse_args()
+
+    if args.action == "pre-dump":
+        dump(args, kill=False)
+    elif args.action == "dump":
+        dump(args, kill=True)
+    elif args.action == "restore":
+        sys.exit(restore(args))
+    else:
+        # the daemon serves nothing, it only signals that it listens like criu lazy-pages
+        (Path(args.images_dir) / "lazy-pages.socket").touch()
+
+
+if __name__ == "__main__":
+    main()
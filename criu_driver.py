@@ -0,0 +1,475 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import time
+
+from pathlib import Path
+from result_sink import FIRST_ROW_FILE_ENV
+
+# RIVETER_CRIU_CMD points to another criu binary, e.g., criu/criu_stub.py, and RIVETER_CRIU_SUDO=0
+# runs it without sudo, so the orchestration can be exercised without root
+CRIU_CMD = os.environ.get("RIVETER_CRIU_CMD", "/opt/criu/sbin/criu")
+CRIU_SUDO = os.environ.get("RIVETER_CRIU_SUDO", "1") != "0"
+# With compression, the dumps are written to this folder in memory first, so only the compressed
+# page images are written to the checkpoint folder on the disk
+CKPT_STAGING_ROOT = os.environ.get("RIVETER_CKPT_STAGING", "/dev/shm/riveter-ckpt")
+STORAGE_SCRIPT = str(Path(__file__).resolve().with_name("criu_storage.py"))
+LAZY_PAGES_SOCKET = "lazy-pages.socket"
+
+
+class CheckpointStats:
+    def __init__(self, images_dir):
+        self.images_dir = images_dir
+        # duration of each pre-dump, the query keeps running during them
+        self.pre_dump_ns = list()
+        # the process is frozen during the final dump
+        self.freeze_ns = None
+        # flushing the images from the page cache to the disk
+        self.sync_ns = None
+        # from the first pre-dump (or the dump) until the images are synced
+        self.checkpoint_ns = None
+        # bytes written by the pre-dumps and the dump, only the pages changed since the parent images
+        self.write_bytes = None
+        # codec, raw/compressed bytes and time when the staged page images are compressed to the disk
+        self.compression = None
+
+    def to_dict(self):
+        return {"images_dir": str(self.images_dir),
+                "pre_dump_ns": self.pre_dump_ns,
+                "freeze_ns": self.freeze_ns,
+                "sync_ns": self.sync_ns,
+                "checkpoint_ns": self.checkpoint_ns,
+                "write_bytes": self.write_bytes,
+                "compression": self.compression}
+
+
+class RestoreStats:
+    def __init__(self, images_dir):
+        self.images_dir = images_dir
+        self.pid = None
+        # decompressing the page images of the chain before criu restore (not with lazy pages)
+        self.decompress_ns = None
+        # until criu restore returns, the process is running again if it is detached
+        self.restore_ns = None
+        # until the query fetches its first result row
+        self.first_row_ns = None
+        # until the restored process exits
+        self.resume_ns = None
+
+    def to_dict(self):
+        return {"images_dir": str(self.images_dir),
+                "pid": self.pid,
+                "decompress_ns": self.decompress_ns,
+                "restore_ns": self.restore_ns,
+                "first_row_ns": self.first_row_ns,
+                "resume_ns": self.resume_ns}
+
+
+def images_size(images_dir):
+    # only stat the images, they are owned by root after a sudo criu dump
+    return sum(f.stat().st_size for f in Path(images_dir).rglob("*") if f.is_file())
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # owned by another user, e.g., root, but it exists
+        return True
+    try:
+        # a zombie has exited, it is only waiting for its parent
+        return Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()[0] != "Z"
+    except (FileNotFoundError, IndexError):
+        return False
+
+
+async def wait_for_exit(pid, interval=0.01):
+    # a detached restored process is not our child, so it cannot be waited for
+    while pid_alive(pid):
+        await asyncio.sleep(interval)
+
+
+def read_first_row(first_row_file):
+    try:
+        return int(Path(first_row_file).read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+class AsyncCriuDriver:
+    def __init__(self, criu_cmd=None, use_sudo=None):
+        self.criu_cmd = criu_cmd if criu_cmd is not None else CRIU_CMD
+        self.use_sudo = use_sudo if use_sudo is not None else CRIU_SUDO
+
+    def command(self, *args):
+        return (["sudo"] if self.use_sudo else []) + list(args)
+
+    async def run_criu(self, action, *options):
+        proc = await asyncio.create_subprocess_exec(*self.command(self.criu_cmd, action, *options))
+        return_code = await proc.wait()
+        if return_code != 0:
+            raise RuntimeError(f"criu {action} exited with return code {return_code}")
+
+    async def run_storage(self, storage, action, images_dir, *options):
+        # The images are owned by root after a sudo criu dump, so criu_storage.py runs the same way as criu
+        proc = await asyncio.create_subprocess_exec(
+            *self.command(sys.executable, STORAGE_SCRIPT, action, str(images_dir), "-j", *storage.options(), *options),
+            stdout=asyncio.subprocess.PIPE)
+        stdout, _ = await proc.communicate()
+        if proc.returncode != 0:
+            raise RuntimeError(f"criu_storage.py {action} exited with return code {proc.returncode}")
+        return json.loads(stdout)
+
+    @staticmethod
+    def parent_option(images_dir, prev_images_dir):
+        # criu resolves --prev-images-dir relative to the images directory. The pre-dumps of one checkpoint
+        # are linked relatively, so a staged checkpoint can be moved, and other checkpoints by absolute path.
+        if prev_images_dir is None:
+            return []
+        if Path(prev_images_dir).parent == Path(images_dir).parent:
+            return ["--prev-images-dir", os.path.relpath(prev_images_dir, images_dir)]
+        return ["--prev-images-dir", str(Path(prev_images_dir).absolute())]
+
+    async def pre_dump(self, pid, images_dir, prev_images_dir=None):
+        # copy the memory while the process keeps running, and start tracking dirty pages from here
+        Path(images_dir).mkdir(parents=True, exist_ok=True)
+        await self.run_criu("pre-dump", "-D", str(images_dir), "-t", str(pid), "--track-mem", "--shell-job",
+                            *self.parent_option(images_dir, prev_images_dir))
+
+    async def dump(self, pid, images_dir, prev_images_dir=None, leave_running=False):
+        Path(images_dir).mkdir(parents=True, exist_ok=True)
+        options = ["-D", str(images_dir), "-t", str(pid), "--file-locks", "--shell-job", "--track-mem",
+                   *self.parent_option(images_dir, prev_images_dir)]
+        if leave_running:
+            options.append("--leave-running")
+        await self.run_criu("dump", *options)
+
+    async def restore(self, images_dir, pidfile=None, lazy_pages=False):
+        # With a pidfile the restored process keeps running in the background, and its pid is returned.
+        # With lazy_pages a local criu lazy-pages daemon serves the memory on page faults (userfaultfd),
+        # so the process runs before its whole address space is read back.
+        options = ["-D", str(images_dir), "--file-locks", "--shell-job"]
+        if pidfile is not None:
+            options += ["--restore-detached", "--pidfile", str(Path(pidfile).absolute())]
+
+        lazy_pages_proc = None
+        if lazy_pages:
+            lazy_pages_proc = await asyncio.create_subprocess_exec(
+                *self.command(self.criu_cmd, "lazy-pages", "-D", str(images_dir)))
+            await self.wait_for_lazy_pages(images_dir, lazy_pages_proc)
+            options.append("--lazy-pages")
+
+        await self.run_criu("restore", *options)
+        if lazy_pages_proc is not None and pidfile is None:
+            # the daemon exits once every page is transferred
+            await lazy_pages_proc.wait()
+        if pidfile is not None:
+            return await self.read_pidfile(pidfile)
+
+    @staticmethod
+    async def wait_for_lazy_pages(images_dir, lazy_pages_proc, timeout=10.0, interval=0.005):
+        # criu restore --lazy-pages connects to the socket of the daemon, so it only starts once the daemon listens
+        socket_file = Path(images_dir) / LAZY_PAGES_SOCKET
+        deadline = time.perf_counter() + timeout
+        while not socket_file.exists():
+            if lazy_pages_proc.returncode is not None:
+                raise RuntimeError(f"criu lazy-pages exited with return code {lazy_pages_proc.returncode}")
+            if time.perf_counter() > deadline:
+                lazy_pages_proc.kill()
+                raise RuntimeError(f"criu lazy-pages did not create {socket_file} in {timeout}s")
+            await asyncio.sleep(interval)
+
+    async def read_pidfile(self, pidfile):
+        try:
+            return int(Path(pidfile).read_text().split()[0])
+        except PermissionError:
+            proc = await asyncio.create_subprocess_exec("sudo", "cat", str(pidfile), stdout=asyncio.subprocess.PIPE)
+            stdout, _ = await proc.communicate()
+            return int(stdout.split()[0])
+
+    async def remove_images(self, images_dir):
+        try:
+            shutil.rmtree(images_dir)
+        except PermissionError:
+            if not self.use_sudo:
+                raise
+            proc = await asyncio.create_subprocess_exec("sudo", "rm", "-rf", str(images_dir))
+            await proc.wait()
+
+    async def drop_page_cache(self):
+        # needs root, so it is skipped when criu runs without sudo
+        if not self.use_sudo:
+            return None
+        start_ns = time.perf_counter_ns()
+        proc = await asyncio.create_subprocess_exec("sudo", "sysctl", "-q", "-w", "vm.drop_caches=1")
+        await proc.wait()
+        return time.perf_counter_ns() - start_ns
+
+    async def checkpoint(self, pid, images_dir, dump_delay=0.0, pre_dump_lead=None, max_pre_dumps=3,
+                         prev_images_dir=None, sync=True):
+        # Dump the process `dump_delay` seconds from now. With `pre_dump_lead`, pre-dumps run back to back
+        # from `pre_dump_lead` seconds before the dump, so the final dump only writes the pages dirtied
+        # since the last pre-dump and the process is frozen for a much shorter time.
+        # `prev_images_dir` chains the first (pre-)dump to the images of an earlier checkpoint.
+        images_dir = Path(images_dir)
+        stats = CheckpointStats(images_dir)
+        dump_time_ns = time.perf_counter_ns() + int(dump_delay * 1e9)
+
+        checkpoint_start_ns = None
+        if pre_dump_lead is not None and max_pre_dumps > 0:
+            await asyncio.sleep(max(dump_time_ns - int(pre_dump_lead * 1e9) - time.perf_counter_ns(), 0) / 1e9)
+            checkpoint_start_ns = time.perf_counter_ns()
+
+            while len(stats.pre_dump_ns) < max_pre_dumps:
+                pre_dump_dir = images_dir / f"pre_{len(stats.pre_dump_ns)}"
+                pre_dump_start_ns = time.perf_counter_ns()
+                await self.pre_dump(pid, pre_dump_dir, prev_images_dir)
+                stats.pre_dump_ns.append(time.perf_counter_ns() - pre_dump_start_ns)
+                prev_images_dir = pre_dump_dir
+
+                # stop when the next pre-dump (no longer than the last one) would not finish before the dump
+                if time.perf_counter_ns() + stats.pre_dump_ns[-1] > dump_time_ns:
+                    break
+
+        await asyncio.sleep(max(dump_time_ns - time.perf_counter_ns(), 0) / 1e9)
+        dump_start_ns = time.perf_counter_ns()
+        await self.dump(pid, images_dir / "dump", prev_images_dir)
+        dump_end_ns = time.perf_counter_ns()
+        stats.freeze_ns = dump_end_ns - dump_start_ns
+
+        if sync:
+            await asyncio.to_thread(os.sync)
+            stats.sync_ns = time.perf_counter_ns() - dump_end_ns
+
+        checkpoint_start_ns = checkpoint_start_ns if checkpoint_start_ns is not None else dump_start_ns
+        stats.checkpoint_ns = time.perf_counter_ns() - checkpoint_start_ns
+        stats.write_bytes = images_size(images_dir)
+        return stats
+
+
+class CheckpointManager:
+    # Keeps the image chain of one query process across repeated suspensions. Each checkpoint uses the
+    # previous one as its parent, so a later suspension only writes the pages changed since the last one.
+    # A restore needs the whole chain, so a chain is only dropped after a new full dump replaces it.
+    def __init__(self, ckpt_root, driver=None, max_chain_length=4, storage=None, staging_root=None):
+        self.ckpt_root = Path(ckpt_root)
+        self.driver = driver if driver is not None else AsyncCriuDriver()
+        self.max_chain_length = max_chain_length
+        # An optional criu_storage.CheckpointStorage that compresses the page images at rest. The checkpoint
+        # is dumped to the staging folder in memory and compressed into ckpt_root, so the disk only gets
+        # the compressed pages, and the chain stays on the disk in case the process is not resumed soon.
+        self.storage = storage
+        self.staging_root = Path(staging_root if staging_root is not None else CKPT_STAGING_ROOT)
+        self.chain = list()
+        self.num_checkpoints = 0
+
+    def parent_images_dir(self):
+        return self.chain[-1] / "dump" if len(self.chain) > 0 else None
+
+    async def suspend(self, pid, dump_delay=0.0, pre_dump_lead=None, max_pre_dumps=3):
+        superseded = list()
+        if len(self.chain) >= self.max_chain_length:
+            # restart with a full dump, so restores do not walk an ever growing chain
+            superseded, self.chain = self.chain, list()
+
+        images_dir = self.ckpt_root / f"ckpt_{pid}_{self.num_checkpoints}"
+        if images_dir.exists():
+            await self.driver.remove_images(images_dir)
+
+        if self.storage is None:
+            stats = await self.driver.checkpoint(pid, images_dir, dump_delay, pre_dump_lead, max_pre_dumps,
+                                                 self.parent_images_dir())
+        else:
+            staged_dir = self.staging_root / images_dir.name
+            if staged_dir.exists():
+                await self.driver.remove_images(staged_dir)
+            # the staged images are in memory, only the compressed ones are synced
+            stats = await self.driver.checkpoint(pid, staged_dir, dump_delay, pre_dump_lead, max_pre_dumps,
+                                                 self.parent_images_dir(), sync=False)
+            compression_start_ns = time.perf_counter_ns()
+            stats.compression = await self.driver.run_storage(self.storage, "compress", staged_dir,
+                                                              "-o", str(images_dir.absolute()))
+            sync_start_ns = time.perf_counter_ns()
+            await asyncio.to_thread(os.sync)
+            stats.sync_ns = time.perf_counter_ns() - sync_start_ns
+            stats.checkpoint_ns += time.perf_counter_ns() - compression_start_ns
+            stats.images_dir = images_dir
+            stats.write_bytes = images_size(images_dir)
+        self.chain.append(images_dir)
+        self.num_checkpoints += 1
+
+        for old_images_dir in superseded:
+            await self.driver.remove_images(old_images_dir)
+        return stats
+
+    async def resume(self, lazy_pages=False, first_row_file=None, wait=False):
+        # The restored process is detached and keeps running until the next suspension. With wait,
+        # it is also timed until its first result row (reported through `first_row_file`) and its exit.
+        if self.storage is not None and lazy_pages:
+            # the lazy-pages daemon only reads raw page images, decompressing the whole chain first
+            # would read back every page before the restore and cancel the lazy restore
+            raise ValueError("Lazy pages cannot restore compressed checkpoints")
+        stats = RestoreStats(self.parent_images_dir())
+        start_ns = time.perf_counter_ns()
+        if self.storage is not None:
+            # the restore reads pages from every checkpoint of the chain
+            for images_dir in self.chain:
+                await self.driver.run_storage(self.storage, "decompress", images_dir, "-kc")
+            stats.decompress_ns = time.perf_counter_ns() - start_ns
+
+        if first_row_file is not None and os.path.exists(first_row_file):
+            os.remove(first_row_file)
+        restore_start_ns = time.perf_counter_ns()
+        stats.pid = await self.driver.restore(self.parent_images_dir(), self.chain[-1] / "restore.pid", lazy_pages)
+        stats.restore_ns = time.perf_counter_ns() - restore_start_ns
+
+        if wait:
+            await wait_for_exit(stats.pid)
+            stats.resume_ns = time.perf_counter_ns() - start_ns
+            first_row_time_ns = read_first_row(first_row_file) if first_row_file is not None else None
+            if first_row_time_ns is not None:
+                stats.first_row_ns = first_row_time_ns - start_ns
+
+        if self.storage is not None:
+            for images_dir in self.chain:
+                await self.driver.run_storage(self.storage, "drop_raw", images_dir)
+        return stats
+
+    async def remove(self):
+        for images_dir in self.chain:
+            await self.driver.remove_images(images_dir)
+        self.chain = list()
+
+
+def emit_metrics(metrics, output=None):
+    line = json.dumps(metrics)
+    print(line)
+    if output is not None:
+        with open(output, "a") as f:
+            f.write(line + "\n")
+
+
+async def run_perf(query_cmd, ckpt_root, stop_times, max_chain_length=4, pre_dump_lead=None, max_pre_dumps=3,
+                   storage=None, lazy_pages=False, drop_cache=False, output=None):
+    # Launch the query, then suspend and resume it after each stop time, and report the phases of every
+    # suspension as one JSON line. The resumed process reports its first result row through a file.
+    driver = AsyncCriuDriver()
+    manager = CheckpointManager(ckpt_root, driver, max_chain_length, storage)
+    Path(ckpt_root).mkdir(parents=True, exist_ok=True)
+    first_row_file = str(Path(ckpt_root).absolute() / "first_row")
+    if os.path.exists(first_row_file):
+        os.remove(first_row_file)
+
+    start_ns = time.perf_counter_ns()
+    query_proc = await asyncio.create_subprocess_exec(*query_cmd, env={**os.environ, FIRST_ROW_FILE_ENV: first_row_file})
+    pid = query_proc.pid
+
+    for i, stop_time in enumerate(stop_times):
+        checkpoint_stats = await manager.suspend(pid, stop_time, pre_dump_lead, max_pre_dumps)
+        if i == 0:
+            # the original process is gone after the dump, reap it
+            await query_proc.wait()
+
+        drop_cache_ns = await driver.drop_page_cache() if drop_cache else None
+        # only the last resume runs the query to the end
+        restore_stats = await manager.resume(lazy_pages, first_row_file, wait=i + 1 == len(stop_times))
+        pid = restore_stats.pid
+
+        metrics = {"suspension": i, "stop_time": stop_time, "cmd": " ".join(query_cmd)}
+        metrics.update(checkpoint_stats.to_dict())
+        metrics["drop_cache_ns"] = drop_cache_ns
+        metrics.update({k: v for k, v in restore_stats.to_dict().items() if k != "images_dir"})
+        metrics["elapsed_ns"] = time.perf_counter_ns() - start_ns
+        emit_metrics(metrics, output)
+
+    await manager.remove()
+    if os.path.exists(first_row_file):
+        os.remove(first_row_file)
+
+
+async def run_suspend(pid, images_dir, prev_images_dir=None, pre_dump_lead=None, max_pre_dumps=3, output=None):
+    stats = await AsyncCriuDriver().checkpoint(pid, images_dir, 0.0, pre_dump_lead, max_pre_dumps, prev_images_dir)
+    emit_metrics({"pid": pid, **stats.to_dict()}, output)
+
+
+async def run_resume(images_dir, lazy_pages=False, first_row_file=None, output=None):
+    # resume a checkpoint written by `suspend`, whose final dump is in <images_dir>/dump
+    manager = CheckpointManager(Path(images_dir).parent)
+    manager.chain.append(Path(images_dir))
+    stats = await manager.resume(lazy_pages, first_row_file, wait=True)
+    emit_metrics(stats.to_dict(), output)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-cc", "--compress_codec", type=str, action="store",
+                        choices=["auto", "zstd", "lz4", "zlib"],
+                        help="compress the page images at rest with the codec, auto picks lz4 or zstd if installed")
+    parser.add_argument("-lp", "--lazy_pages", action="store_true", default=False,
+                        help="restore with a local criu lazy-pages daemon, so pages are read on demand")
+    parser.add_argument("-pdl", "--pre_dump_lead", type=float, action="store",
+                        help="indicate how long (second) before each dump to start criu pre-dumps")
+    parser.add_argument("-mpd", "--max_pre_dumps", type=int, action="store", default=3,
+                        help="indicate the maximum number of criu pre-dump iterations")
+    parser.add_argument("-o", "--output", type=str, action="store",
+                        help="indicate the file to append the JSON metrics to")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    perf_parser = subparsers.add_parser("perf", help="launch a query, then suspend and resume it")
+    perf_parser.add_argument("-s", "--stop_time", type=float, action="append", required=True,
+                             help="indicate the time (second) to wait before each suspension, e.g., -s 10 -s 20")
+    perf_parser.add_argument("-cp", "--ckpt_path", type=str, action="store", default="./criu-ckpt",
+                             help="indicate the folder for the CRIU images")
+    perf_parser.add_argument("-ml", "--max_chain_length", type=int, action="store", default=4,
+                             help="indicate the number of incremental checkpoints before a new full dump")
+    perf_parser.add_argument("-dc", "--drop_cache", action="store_true", default=False,
+                             help="drop the page cache before each restore")
+    perf_parser.add_argument("-l", "--loop", type=int, action="store", default=1,
+                             help="indicate the number of loops/iterations")
+    perf_parser.add_argument("query_cmd", nargs=argparse.REMAINDER,
+                             help="the query command after --, such as -- python3 tpch/ratchet_tpch_perf.py -q q1 ...")
+
+    suspend_parser = subparsers.add_parser("suspend", help="checkpoint a running process")
+    suspend_parser.add_argument("-p", "--pid", type=int, action="store", required=True,
+                                help="indicate the process to checkpoint")
+    suspend_parser.add_argument("-D", "--images_dir", type=str, action="store", required=True,
+                                help="indicate the checkpoint folder")
+    suspend_parser.add_argument("-pi", "--prev_images_dir", type=str, action="store",
+                                help="indicate the parent images, such as <criu-ckpt/ckpt_1234_0/dump>")
+
+    resume_parser = subparsers.add_parser("resume", help="restore a checkpoint and wait until it exits")
+    resume_parser.add_argument("-D", "--images_dir", type=str, action="store", required=True,
+                               help="indicate the checkpoint folder")
+    resume_parser.add_argument("-fr", "--first_row_file", type=str, action="store",
+                               help=f"indicate the file set in {FIRST_ROW_FILE_ENV} when the query was launched")
+    args = parser.parse_args()
+
+    storage = None
+    if args.compress_codec is not None and args.lazy_pages:
+        parser.error("-lp cannot restore compressed checkpoints, the lazy-pages daemon only reads raw page images")
+    if args.compress_codec is not None:
+        from criu_storage import CheckpointStorage
+        storage = CheckpointStorage(args.compress_codec)
+
+    if args.command == "perf":
+        query_cmd = args.query_cmd[1:] if args.query_cmd[:1] == ["--"] else args.query_cmd
+        if len(query_cmd) == 0:
+            sys.exit("Please indicate the query command after --")
+        for _ in range(args.loop):
+            asyncio.run(run_perf(query_cmd, args.ckpt_path, args.stop_time, args.max_chain_length,
+                                 args.pre_dump_lead, args.max_pre_dumps, storage, args.lazy_pages,
+                                 args.drop_cache, args.output))
+    elif args.command == "suspend":
+        asyncio.run(run_suspend(args.pid, args.images_dir, args.prev_images_dir,
+                                args.pre_dump_lead, args.max_pre_dumps, args.output))
+    else:
+        asyncio.run(run_resume(args.images_dir, args.lazy_pages, args.first_row_file, args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+import argparse
+import fnmatch
+import json
+import os
+import shutil
+import struct
+import time
+import zlib
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Page images are cut into blocks that are compressed independently, so a single pages-*.img
+# (one DuckDB process usually has one) is still compressed by all workers
+COMPRESSION_BLOCK_SIZE = 16 << 20
+BLOCK_HEADER = struct.Struct("<QQ")
+
+PAGE_IMAGE_PATTERN = "pages-*.img"
+
+
+class ZlibCodec:
+    name = "zlib"
+
+    def __init__(self, level=1):
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class ZstdCodec:
+    name = "zstd"
+
+    def __init__(self, level=1):
+        import zstandard
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def decompress(self, data):
+        return self.decompressor.decompress(data)
+
+
+class Lz4Codec:
+    name = "lz4"
+
+    def __init__(self, level=0):
+        import lz4.frame
+        self.frame = lz4.frame
+        self.level = level
+
+    def compress(self, data):
+        return self.frame.compress(data, compression_level=self.level)
+
+    def decompress(self, data):
+        return self.frame.decompress(data)
+
+
+CODECS = {
+    "zstd": ZstdCodec,
+    "lz4": Lz4Codec,
+    "zlib": ZlibCodec,
+}
+
+
+def get_codec(name="auto", level=None):
+    # "auto" picks the fastest codec that is installed, zlib is always available
+    if name == "auto":
+        for codec_name in ["lz4", "zstd"]:
+            try:
+                return get_codec(codec_name, level)
+            except ImportError:
+                continue
+        return get_codec("zlib", level)
+
+    if name not in CODECS:
+        raise ValueError(f"Codec {name} is not supported")
+    return CODECS[name]() if level is None else CODECS[name](level)
+
+
+def compressed_path(image_file, codec):
+    return image_file.with_name(f"{image_file.name}.{codec.name}")
+
+
+def stream_blocks(transform, fin, fout, num_workers, read_block, write_block):
+    # Keep a bounded window of blocks in flight, so memory stays at a few blocks per worker
+    # while the output is still written in order
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        in_flight = deque()
+        while True:
+            block = read_block(fin)
+            if block is None:
+                break
+            in_flight.append(executor.submit(transform, block))
+            if len(in_flight) >= 2 * num_workers:
+                write_block(fout, in_flight.popleft().result())
+        while len(in_flight) > 0:
+            write_block(fout, in_flight.popleft().result())
+
+
+def checkpoint_files(images_dir):
+    # The "parent" links of incremental images point to other checkpoints, they are not followed
+    for root, dirs, files in os.walk(images_dir):
+        for name in sorted(dirs + files):
+            yield Path(root) / name
+
+
+def compress_file(image_file, codec, num_workers=4, block_size=COMPRESSION_BLOCK_SIZE, output_file=None):
+    image_file = Path(image_file)
+    output_file = compressed_path(image_file if output_file is None else Path(output_file), codec)
+
+    def read_block(fin):
+        data = fin.read(block_size)
+        return data if len(data) > 0 else None
+
+    def write_block(fout, block):
+        raw_size, data = block
+        fout.write(BLOCK_HEADER.pack(raw_size, len(data)))
+        fout.write(data)
+
+    with open(image_file, "rb") as fin, open(output_file, "wb") as fout:
+        stream_blocks(lambda data: (len(data), codec.compress(data)), fin, fout, num_workers, read_block, write_block)
+    os.remove(image_file)
+    return output_file
+
+
+def decompress_file(compressed_file, codec, num_workers=4, keep_compressed=False):
+    compressed_file = Path(compressed_file)
+    output_file = compressed_file.with_suffix("")
+
+    def read_block(fin):
+        header = fin.read(BLOCK_HEADER.size)
+        if len(header) == 0:
+            return None
+        raw_size, compressed_size = BLOCK_HEADER.unpack(header)
+        return raw_size, fin.read(compressed_size)
+
+    def decompress_block(block):
+        raw_size, data = block
+        data = codec.decompress(data)
+        if len(data) != raw_size:
+            raise ValueError(f"Corrupted block in {compressed_file}: {len(data)} bytes instead of {raw_size}")
+        return data
+
+    with open(compressed_file, "rb") as fin, open(output_file, "wb") as fout:
+        stream_blocks(decompress_block, fin, fout, num_workers, read_block, lambda f, data: f.write(data))
+    if not keep_compressed:
+        os.remove(compressed_file)
+    return output_file
+
+
+class CheckpointStorage:
+    # Compresses the page images of a checkpoint after the dump, and restores them before criu restore.
+    # CRIU (and its lazy-pages daemon) only reads raw page images, so a compressed checkpoint has to be
+    # decompressed before it is restored: compression trades resume latency for disk space and bandwidth.
+    # The images are owned by root after a sudo criu dump, so criu_driver.py runs this module through sudo.
+    def __init__(self, codec="auto", level=None, num_workers=4):
+        self.codec = get_codec(codec, level)
+        self.level = level
+        self.num_workers = num_workers
+
+    def options(self):
+        # the command line options of main() for the same codec
+        options = ["-c", self.codec.name, "-nw", str(self.num_workers)]
+        return options + (["-l", str(self.level)] if self.level is not None else [])
+
+    def compress(self, images_dir, output_dir=None):
+        # With output_dir, the checkpoint is moved there and only its page images are written compressed,
+        # e.g., from a staging folder in memory, so the raw pages never reach the disk
+        start_ns = time.perf_counter_ns()
+        images_dir = Path(images_dir)
+        output_dir = images_dir if output_dir is None else Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        raw_bytes, compressed_bytes = 0, 0
+        for path in list(checkpoint_files(images_dir)):
+            target = output_dir / path.relative_to(images_dir)
+            if path.is_symlink():
+                if output_dir != images_dir:
+                    os.symlink(os.readlink(path), target)
+            elif path.is_dir():
+                target.mkdir(parents=True, exist_ok=True)
+            elif fnmatch.fnmatch(path.name, PAGE_IMAGE_PATTERN):
+                raw_bytes += path.stat().st_size
+                compressed_file = compress_file(path, self.codec, self.num_workers, output_file=target)
+                compressed_bytes += compressed_file.stat().st_size
+            elif output_dir != images_dir:
+                shutil.copy2(path, target)
+        if output_dir != images_dir:
+            shutil.rmtree(images_dir)
+        return {"codec": self.codec.name, "raw_bytes": raw_bytes, "compressed_bytes": compressed_bytes,
+                "compress_ns": time.perf_counter_ns() - start_ns}
+
+    def decompress(self, images_dir, keep_compressed=False):
+        # keep_compressed leaves the compressed images in place, so drop_raw() can free the raw ones after the restore
+        start_ns = time.perf_counter_ns()
+        for compressed_file in list(checkpoint_files(images_dir)):
+            if not fnmatch.fnmatch(compressed_file.name, f"{PAGE_IMAGE_PATTERN}.*"):
+                continue
+            # the images may have been compressed with another codec
+            codec_name = compressed_file.suffix[1:]
+            codec = self.codec if codec_name == self.codec.name else get_codec(codec_name)
+            decompress_file(compressed_file, codec, self.num_workers, keep_compressed)
+        return time.perf_counter_ns() - start_ns
+
+    def drop_raw(self, images_dir):
+        for image_file in list(checkpoint_files(images_dir)):
+            if fnmatch.fnmatch(image_file.name, PAGE_IMAGE_PATTERN) and any(image_file.with_name(f"{image_file.name}.{name}").exists() for name in CODECS):
+                os.remove(image_file)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("action", type=str, choices=["compress", "decompress", "drop_raw"],
+                        help="compress the page images of a checkpoint, restore them for criu restore, "
+                             "or drop the restored ones again")
+    parser.add_argument("images_dir", type=str,
+                        help="indicate the checkpoint folder, such as <criu-ckpt/ckpt_1234_0>")
+    parser.add_argument("-c", "--codec", type=str, action="store", default="auto",
+                        choices=["auto", *CODECS.keys()],
+                        help="indicate the codec, auto picks lz4 or zstd if installed and falls back to zlib")
+    parser.add_argument("-l", "--level", type=int, action="store",
+                        help="indicate the compression level of the codec")
+    parser.add_argument("-nw", "--num_workers", type=int, action="store", default=4,
+                        help="indicate the number of compression threads")
+    parser.add_argument("-o", "--output_dir", type=str, action="store",
+                        help="indicate the folder the compressed checkpoint is moved to, such as a staged dump")
+    parser.add_argument("-kc", "--keep_compressed", action="store_true", default=False,
+                        help="keep the compressed page images when decompressing them")
+    parser.add_argument("-j", "--json", action="store_true", default=False,
+                        help="print the statistics as one JSON line, as read by criu_driver.py")
+    args = parser.parse_args()
+
+    storage = CheckpointStorage(args.codec, args.level, args.num_workers)
+    if args.action == "compress":
+        stats = storage.compress(args.images_dir, args.output_dir)
+        ratio = stats["raw_bytes"] / stats["compressed_bytes"] if stats["compressed_bytes"] > 0 else 0
+        message = (f"Compressed {stats['raw_bytes'] / (1 << 20):.1f} MB with {stats['codec']} "
+                   f"in {stats['compress_ns'] / 1e9:.3f}s, ratio {ratio:.2f}")
+    elif args.action == "decompress":
+        stats = {"decompress_ns": storage.decompress(args.images_dir, args.keep_compressed)}
+        message = f"Decompressed in {stats['decompress_ns'] / 1e9:.3f}s"
+    else:
+        storage.drop_raw(args.images_dir)
+        stats, message = {}, f"Dropped the decompressed page images of {args.images_dir}"
+    print(json.dumps(stats) if args.json else message)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+import argparse
+import glob
+import hashlib
+import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from suspension_log import load_timing_records
+
+MANIFEST_TABLE = "riveter_manifest"
+
+# A table is either loaded into the database (CREATE TABLE AS) or a view over its parquet files
+TABLE_MODES = ["table", "view"]
+
+
+def is_hive_partitioned(data_folder, table):
+    # {table}/<column>=<value>/.../*.parquet, as written by COPY ... (PARTITION_BY ...)
+    return len(glob.glob(f"{data_folder}/{table}/*=*/")) > 0
+
+
+def parquet_files(data_folder, table):
+    # A large table is converted into a folder of parquet files, {table}/part-<i>.parquet
+    return sorted(glob.glob(parquet_source(data_folder, table), recursive=True))
+
+
+def parquet_source(data_folder, table):
+    # read_parquet() takes the glob as is and scans the files of a folder in parallel
+    if is_hive_partitioned(data_folder, table):
+        return f"{data_folder}/{table}/**/*.parquet"
+    if os.path.isdir(f"{data_folder}/{table}"):
+        return f"{data_folder}/{table}/*.parquet"
+    return f"{data_folder}/{table}.parquet"
+
+
+def parquet_scan(data_folder, table):
+    # The partition columns of a Hive-partitioned table are read from the directory names, and filters
+    # on them skip whole directories
+    source = parquet_source(data_folder, table)
+    if is_hive_partitioned(data_folder, table):
+        return f"read_parquet('{source}', hive_partitioning = true)"
+    return f"read_parquet('{source}')"
+
+
+def source_stat(files):
+    file_size = sum(os.path.getsize(f) for f in files)
+    mtime = max(os.path.getmtime(f) for f in files)
+    return file_size, mtime
+
+
+def row_group_hash(db_conn, files):
+    # Only the parquet footers are read, which is cheap even for SF100 tables
+    row_groups = db_conn.execute(f"""SELECT file_name, row_group_id, row_group_num_rows, row_group_bytes,
+                                            column_id, total_compressed_size, stats_min, stats_max
+                                     FROM parquet_metadata({files})
+                                     ORDER BY file_name, row_group_id, column_id;""").fetchall()
+    num_rows = sum(rg[2] for rg in row_groups if rg[4] == 0)
+    return hashlib.sha1(repr(row_groups).encode()).hexdigest(), num_rows
+
+
+def create_manifest(db_conn):
+    db_conn.execute(f"""CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+                            table_name VARCHAR PRIMARY KEY,
+                            source_path VARCHAR,
+                            file_size BIGINT,
+                            mtime DOUBLE,
+                            row_group_hash VARCHAR,
+                            num_rows BIGINT
+                        );""")
+
+
+def get_manifest(db_conn):
+    entries = db_conn.execute(f"SELECT * FROM {MANIFEST_TABLE};").fetchall()
+    return {e[0]: e[1:] for e in entries}
+
+
+def update_manifest(db_conn, table, source, file_size, mtime, rg_hash, num_rows):
+    db_conn.execute(f"INSERT OR REPLACE INTO {MANIFEST_TABLE} VALUES (?, ?, ?, ?, ?, ?);",
+                    [table, source, file_size, mtime, rg_hash, num_rows])
+
+
+def existing_tables(db_conn):
+    return {t[0] for t in db_conn.execute("SELECT table_name FROM duckdb_tables();").fetchall()}
+
+
+def existing_views(db_conn):
+    # only the views stored in the database, the temporary views of the table mode are gone after a run
+    return {v[0] for v in db_conn.execute("SELECT view_name FROM duckdb_views() "
+                                          "WHERE NOT internal AND NOT temporary;").fetchall()}
+
+
+def drop_relation(db_conn, table):
+    # A view stored under the table name (by an older run) would block loading the table
+    if table in existing_views(db_conn):
+        db_conn.execute(f"DROP VIEW {table};")
+    db_conn.execute(f"DROP TABLE IF EXISTS {table};")
+
+
+def stale_tables(db_conn, data_folder, table_names, update_table=False):
+    # Compare each table with the parquet files it was loaded from, and return (table, source, fingerprint)
+    # for the tables that have to be (re)loaded
+    create_manifest(db_conn)
+    manifest = get_manifest(db_conn)
+    tables_in_db = existing_tables(db_conn)
+
+    stale_list = list()
+    for t in table_names:
+        source = parquet_source(data_folder, t)
+        files = parquet_files(data_folder, t)
+        if len(files) == 0:
+            raise ValueError(f"Cannot find the parquet file(s) of {t} in {data_folder}")
+
+        file_size, mtime = source_stat(files)
+        entry = manifest.get(t)
+
+        if not update_table and t in tables_in_db and entry is not None:
+            # fast path: the source files are untouched since they were loaded
+            if entry[0] == source and entry[1] == file_size and entry[2] == mtime:
+                continue
+
+        rg_hash, num_rows = row_group_hash(db_conn, files)
+
+        if not update_table and t in tables_in_db:
+            if entry is not None and entry[0] == source and entry[3] == rg_hash:
+                # the files were touched or copied but the content is the same
+                update_manifest(db_conn, t, source, file_size, mtime, rg_hash, num_rows)
+                continue
+            if entry is None and db_conn.execute(f"SELECT count(*) FROM {t};").fetchone()[0] == num_rows:
+                # adopt a table loaded before the manifest existed
+                update_manifest(db_conn, t, source, file_size, mtime, rg_hash, num_rows)
+                continue
+
+        stale_list.append((t, source, (file_size, mtime, rg_hash, num_rows)))
+
+    return stale_list
+
+
+def load_table(db_conn, table, source, fingerprint):
+    drop_relation(db_conn, table)
+    db_conn.execute(f"CREATE TABLE {table} AS SELECT * FROM read_parquet('{source}');")
+    update_manifest(db_conn, table, source, *fingerprint)
+
+
+def register_views(db_conn, data_folder, table_names):
+    # Query the parquet files in place instead of loading them. The views are temporary, so they only
+    # shadow the loaded tables for this connection: the tables and the manifest stay as they are, and
+    # the next run in table mode finds them up to date
+    for t in table_names:
+        if len(parquet_files(data_folder, t)) == 0:
+            raise ValueError(f"Cannot find the parquet file(s) of {t} in {data_folder}")
+        db_conn.execute(f"CREATE OR REPLACE TEMP VIEW {t} AS SELECT * FROM {parquet_scan(data_folder, t)};")
+
+
+def load_tables(db_conn, data_folder, table_names, update_table=False):
+    stale_list = stale_tables(db_conn, data_folder, table_names, update_table)
+    for table, source, fingerprint in stale_list:
+        load_table(db_conn, table, source, fingerprint)
+
+    return [table for table, _, _ in stale_list]
+
+
+def load_tables_parallel(db_conn, data_folder, table_names, update_table=False, num_workers=4, table_threads=1):
+    stale_list = stale_tables(db_conn, data_folder, table_names, update_table)
+    # largest tables first, so the fact tables that dominate the critical path start immediately
+    stale_list.sort(key=lambda stale: stale[2][0], reverse=True)
+
+    # DuckDB schedules all connections on one instance-wide thread pool, so the per-table budget
+    # is applied by sizing that pool to the number of concurrent loads during bootstrap
+    query_threads = db_conn.execute("SELECT current_setting('threads');").fetchone()[0]
+    db_conn.execute(f"PRAGMA threads={num_workers * table_threads}")
+
+    def load(stale):
+        table, source, fingerprint = stale
+        cursor = db_conn.cursor()
+        load_start = time.perf_counter()
+        load_table(cursor, table, source, fingerprint)
+        load_time = time.perf_counter() - load_start
+        cursor.close()
+        return table, fingerprint[0], fingerprint[3], load_time
+
+    try:
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            load_stats = list(executor.map(load, stale_list))
+    finally:
+        db_conn.execute(f"PRAGMA threads={query_threads}")
+
+    return load_stats
+
+
+def print_load_stats(load_stats, total_time):
+    print(f"{'Table':<24}{'Size (MB)':>12}{'Rows':>14}{'Time (s)':>10}{'Rows/s':>14}")
+    for table, file_size, num_rows, load_time in sorted(load_stats, key=lambda stat: stat[3], reverse=True):
+        rows_per_sec = num_rows / load_time if load_time > 0 else 0
+        print(f"{table:<24}{file_size / 1e6:>12.1f}{num_rows:>14}{load_time:>10.3f}{rows_per_sec:>14.0f}")
+    print(f"Loaded {len(load_stats)} tables in {total_time:.3f}s")
+
+
+def table_modes(table_names, default_mode="table", mode_specs=None):
+    # The mode of every table, with the default overridden by specs such as "lineitem:view"
+    modes = {t: default_mode for t in table_names}
+    for spec in mode_specs or []:
+        table, mode = spec.split(":")
+        if table not in modes:
+            raise ValueError(f"Unknown table {table}, expected one of {table_names}")
+        if mode not in TABLE_MODES:
+            raise ValueError(f"Unknown table mode {mode}, expected one of {TABLE_MODES}")
+        modes[table] = mode
+    return modes
+
+
+def mode_summary(modes):
+    distinct_modes = set(modes.values())
+    return distinct_modes.pop() if len(distinct_modes) == 1 else "mixed"
+
+
+def setup_tables(db_conn, data_folder, modes, update_table=False, num_workers=1, table_threads=1):
+    # Register the views and (re)load the other tables, returns the stats of a parallel load
+    register_views(db_conn, data_folder, [t for t, mode in modes.items() if mode == "view"])
+    load_table_names = [t for t, mode in modes.items() if mode == "table"]
+    if num_workers > 1:
+        return load_tables_parallel(db_conn, data_folder, load_table_names, update_table, num_workers, table_threads)
+    load_tables(db_conn, data_folder, load_table_names, update_table)
+    return None
+
+
+def print_setup_timing(modes, setup_time, query_time):
+    num_views = sum(1 for mode in modes.values() if mode == "view")
+    print(f"Setup Time ({mode_summary(modes)}, {num_views} views, {len(modes) - num_views} tables): {setup_time:.3f}s")
+    print(f"Query Time ({mode_summary(modes)}): {query_time:.3f}s")
+
+
+def compare_table_modes(timing_log):
+    # Average setup and query time of every query per table mode, from the runs with -tl
+    runs = dict()
+    for record in load_timing_records(timing_log):
+        if record["op"] != "query" or "table_mode" not in record:
+            continue
+        runs.setdefault((record["query"], record["table_mode"]), list()).append(record)
+
+    print(f"{'Query':<8}{'Mode':<8}{'Runs':>6}{'Setup (s)':>12}{'Query (s)':>12}{'Total (s)':>12}")
+    for (qid, mode), records in sorted(runs.items()):
+        setup_time = sum(r["setup_time"] for r in records) / len(records)
+        call_time = sum(r["call_time"] for r in records) / len(records)
+        print(f"{qid:<8}{mode:<8}{len(records):>6}{setup_time:>12.3f}{call_time:>12.3f}{setup_time + call_time:>12.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-tl", "--timing_log", type=str, action="store", required=True,
+                        help="indicate the timing log written by the runners with -tl")
+    args = parser.parse_args()
+
+    compare_table_modes(args.timing_log)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import argparse
+import os
+import time
+import duckdb
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Number of rows in each Arrow record batch fetched from DuckDB
+RESULT_BATCH_SIZE = 1000000
+
+# Low mantissa bits of doubles dropped before hashing, parallel aggregations sum in a different order
+# from run to run and only differ in the last bits (about 9 significant digits are kept)
+CHECKSUM_FLOAT_BITS = 20
+# The value a null hashes as, whatever is in the data buffer under it
+CHECKSUM_NULL = np.uint64(0x9E3779B97F4A7C15)
+# Multiplier that combines the column hashes of a row, so equal values in other columns differ
+CHECKSUM_COLUMN_PRIME = np.uint64(0x100000001B3)
+
+# Set by criu_driver.py to measure the time-to-first-row after a restore, perf_counter_ns is the
+# system-wide monotonic clock on Linux, so the timestamp is comparable across processes
+FIRST_ROW_FILE_ENV = "RIVETER_FIRST_ROW_FILE"
+
+
+def mark_first_row():
+    first_row_file = os.environ.get(FIRST_ROW_FILE_ENV)
+    if first_row_file is not None and not os.path.exists(first_row_file):
+        with open(first_row_file, "w") as f:
+            f.write(str(time.perf_counter_ns()))
+
+
+class PandasSink:
+    def __init__(self):
+        self.results = None
+
+    def consume(self, execution):
+        self.results = execution.fetchdf()
+        if len(self.results) > 0:
+            mark_first_row()
+        return len(self.results)
+
+    def report(self):
+        print(self.results)
+
+
+class ArrowSink:
+    # Streams the result as Arrow record batches, optionally into an Arrow IPC stream file
+    def __init__(self, output=None, batch_size=RESULT_BATCH_SIZE):
+        self.output = output
+        self.batch_size = batch_size
+        self.schema = None
+        self.num_rows = 0
+        self.num_batches = 0
+
+    def consume(self, execution):
+        reader = execution.fetch_record_batch(self.batch_size)
+        self.schema = reader.schema
+
+        writer = None
+        if self.output is not None:
+            writer = pa.ipc.new_stream(self.output, self.schema)
+
+        for batch in reader:
+            if self.num_rows == 0 and batch.num_rows > 0:
+                mark_first_row()
+            self.num_rows += batch.num_rows
+            self.num_batches += 1
+            if writer is not None:
+                writer.write_batch(batch)
+
+        if writer is not None:
+            writer.close()
+        return self.num_rows
+
+    def report(self):
+        print(self.schema)
+        print(f"Result: {self.num_rows} rows in {self.num_batches} record batches")
+        if self.output is not None:
+            print(f"Result is written to {self.output}")
+
+
+class CountSink:
+    # Only counts rows and checksums the values. Every row is hashed from its Arrow values, normalised by
+    # the Arrow type of the column (nulls hash as CHECKSUM_NULL, doubles are rounded), and the row hashes
+    # are summed, so the checksum does not depend on the batch size or on the order of the rows.
+    def __init__(self, batch_size=RESULT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.num_rows = 0
+        self.checksum = 0
+
+    def consume(self, execution):
+        for batch in execution.fetch_record_batch(self.batch_size):
+            if self.num_rows == 0 and batch.num_rows > 0:
+                mark_first_row()
+            self.num_rows += batch.num_rows
+            if batch.num_rows > 0:
+                row_hashes = row_checksums(batch)
+                # the uint64 sum of a batch wraps around, the running sum is kept in 64 bits the same way
+                self.checksum = (self.checksum + int(row_hashes.sum(dtype=np.uint64))) % (1 << 64)
+        return self.num_rows
+
+    def report(self):
+        print(f"Result: {self.num_rows} rows, checksum {self.checksum:016x}")
+
+
+def fixed_width_words(column):
+    # The values of a fixed-width array (e.g., decimal128) as rows of uint64 words, from its data buffer
+    num_words = column.type.bit_width // 64
+    words = np.frombuffer(column.buffers()[1], dtype=np.uint64)
+    return words[column.offset * num_words:(column.offset + len(column)) * num_words].reshape(-1, num_words)
+
+
+def binary_keys(column):
+    # A polynomial hash of the bytes of every string, computed over the offsets and the data buffer
+    offset_type = np.int64 if pa.types.is_large_string(column.type) or pa.types.is_large_binary(column.type) \
+        else np.int32
+    _, offsets_buffer, data_buffer = column.buffers()
+    offsets = np.frombuffer(offsets_buffer, dtype=offset_type)[column.offset:column.offset + len(column) + 1]
+    offsets = offsets.astype(np.int64)
+    lengths = np.diff(offsets)
+    keys = lengths.astype(np.uint64) * CHECKSUM_COLUMN_PRIME
+    if data_buffer is None or lengths.sum() == 0:
+        return keys
+
+    data = np.frombuffer(data_buffer, dtype=np.uint8)[offsets[0]:offsets[-1]].astype(np.uint64)
+    # byte j of a string of length n is weighted by prime^(n-1-j)
+    powers = np.cumprod(np.full(int(lengths.max()), CHECKSUM_COLUMN_PRIME, dtype=np.uint64), dtype=np.uint64)
+    powers = np.concatenate([np.ones(1, dtype=np.uint64), powers[:-1]])
+    distance = np.repeat(offsets[1:] - offsets[0], lengths) - 1 - np.arange(len(data))
+    weighted = (data + np.uint64(1)) * powers[distance]
+    non_empty = lengths > 0
+    keys[non_empty] += np.add.reduceat(weighted, (offsets[:-1] - offsets[0])[non_empty], dtype=np.uint64)
+    return keys
+
+
+def column_checksums(column):
+    # One uint64 per row from the value of an Arrow array, read from its buffers without pandas
+    arrow_type = column.type
+    if pa.types.is_floating(arrow_type):
+        # rounded to the kept mantissa bits, with one value for NaN and for both zeros
+        values = column.cast(pa.float64()).fill_null(0.0).to_numpy()
+        values = np.where(values == 0, 0.0, values)
+        bits = values.view(np.uint64)
+        bits = (bits + np.uint64(1 << (CHECKSUM_FLOAT_BITS - 1))) & ~np.uint64((1 << CHECKSUM_FLOAT_BITS) - 1)
+        keys = np.where(np.isnan(values), np.uint64(0), bits)
+    elif pa.types.is_integer(arrow_type) or pa.types.is_boolean(arrow_type):
+        keys = column.cast(pa.int64()).fill_null(0).to_numpy().view(np.uint64)
+    elif (pa.types.is_date(arrow_type) or pa.types.is_time(arrow_type) or pa.types.is_timestamp(arrow_type)
+          or pa.types.is_duration(arrow_type)):
+        # dates, times and timestamps are integers of their unit
+        integer_type = pa.int32() if arrow_type.bit_width == 32 else pa.int64()
+        keys = column.view(integer_type).cast(pa.int64()).fill_null(0).to_numpy().view(np.uint64)
+    elif pa.types.is_decimal(arrow_type) and arrow_type.bit_width in (128, 256):
+        # the exact unscaled value, the scale is the same for the whole column
+        words = fixed_width_words(column)
+        keys = words[:, 0].copy()
+        for i in range(1, words.shape[1]):
+            keys = keys * CHECKSUM_COLUMN_PRIME + words[:, i]
+    elif (pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type)
+          or pa.types.is_binary(arrow_type) or pa.types.is_large_binary(arrow_type)):
+        keys = binary_keys(column)
+    else:
+        # nested values, intervals and the rest hash their text, which is slow but rare in results
+        text = pa.array([None if v is None else repr(v) for v in column.to_pylist()], pa.string())
+        keys = binary_keys(text)
+
+    hashes = pd.util.hash_array(keys, categorize=False)
+    if column.null_count > 0:
+        hashes = np.where(column.is_valid().to_numpy(zero_copy_only=False), hashes, CHECKSUM_NULL)
+    return hashes
+
+
+def row_checksums(batch):
+    row_hashes = np.zeros(batch.num_rows, dtype=np.uint64)
+    for column in batch.columns:
+        row_hashes = row_hashes * CHECKSUM_COLUMN_PRIME + column_checksums(column)
+    return row_hashes
+
+
+def get_result_sink(sink_type, output=None):
+    if sink_type == "pandas":
+        return PandasSink()
+    elif sink_type == "arrow":
+        return ArrowSink(output)
+    elif sink_type == "count":
+        return CountSink()
+    else:
+        raise ValueError(f"Result sink {sink_type} is not supported")
+
+
+def main():
+    # Checks that CountSink gives the same checksum whatever the batch size, on a table with null integers
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--num_rows", type=int, action="store", default=100000,
+                        help="indicate the number of rows in the checked table")
+    parser.add_argument("-bs", "--batch_sizes", type=int, nargs="+", action="store", default=[1000, 4096, 1000000],
+                        help="indicate the batch sizes whose checksums are compared")
+    args = parser.parse_args()
+
+    db_conn = duckdb.connect(database=':memory:')
+    # the first batches of the smaller sizes have no null, the later ones do
+    db_conn.execute(f"""
+        CREATE TABLE checked AS
+        SELECT CASE WHEN i > {args.num_rows // 2} AND i % 7 = 0 THEN NULL ELSE i END AS a,
+               CASE WHEN i % 11 = 0 THEN NULL ELSE i / 3 END::DOUBLE AS d,
+               CASE WHEN i % 13 = 0 THEN NULL ELSE 's' || (i % 100) END AS s,
+               (i / 7)::DECIMAL(15, 2) AS m
+        FROM range({args.num_rows}) t(i)""")
+
+    checksums = dict()
+    for batch_size in args.batch_sizes:
+        sink = CountSink(batch_size)
+        sink.consume(db_conn.execute("SELECT * FROM checked"))
+        checksums[batch_size] = sink.checksum
+        print(f"Batch size {batch_size}: {sink.num_rows} rows, checksum {sink.checksum:016x}")
+    db_conn.close()
+
+    if len(set(checksums.values())) != 1:
+        raise RuntimeError("CountSink checksums differ across batch sizes")
+
+
+if __name__ == "__main__":
+    main()
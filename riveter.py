@@ -1,24 +1,43 @@
 import argparse
+import copy
 import subprocess
 import ctypes
-import sysv_ipc
 import json
 import yaml
 import toml
 import time
+import hashlib
+import os
+import asyncio
 import pandas as pd
 import numpy as np
 
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
-from cost_model import ProcLatencyEstimator, PipelineLatencyEstimator
+from cost_model import (ProcLatencyEstimator, OnlineProcLatencyEstimator, PipelineLatencyEstimator,
+                        PERSISTENCE_MODELS, proc_cost_curve, print_cv_report, get_storage_profile)
+from worker_pool import WorkerPoolClient
+from criu_driver import AsyncCriuDriver
+from suspension_log import calibrate_io_models
+from shm_channel import (SHM_COST_MODEL_FLAG_KEYFILE, SHM_STRATEGY_KEYFILE, SHM_PERSISTENCE_SIZE_KEYFILE,
+                         SEM_PIPELINE_BREAKER_KEYFILE, PipelineBreakerNotifier, attach_shared_memory,
+                         namespaced_keyfile, wait_for_pipeline_breaker)
 
 # Constants
 RAND_WRITE_SPEED = 2500
 RAND_READ_SPEED = 2500
-CRIU_CMD="/opt/criu/sbin/criu"
 CKPT_PATH="./criu-ckpt"
+SHM_ATTACH_TIMEOUT = 60
+FIT_CACHE_DIR = "~/.cache/riveter"
+
+# Strategy codes written to `shm_strategy` for Ratchet
+# STRATEGY_CONTINUE lets the query run on to its next pipeline breaker, where Ratchet notifies again
+STRATEGY_CONTINUE = 0
+STRATEGY_REDO = 1
+STRATEGY_PIPELINE = 2
+STRATEGY_PROCESS = 3
 
 
 class PropertyUtils:
@@ -42,6 +61,95 @@ class PropertyUtils:
         return properties
 
 
+def fit_cache_file(estimation_file, model_form, cache_dir=FIT_CACHE_DIR):
+    # The cache entry is keyed by the content of the historical data and the form of the fitted model
+    fit_key = hashlib.sha1()
+    with open(estimation_file, "rb") as fp:
+        fit_key.update(fp.read())
+    fit_key.update(model_form.encode())
+    return Path(cache_dir).expanduser() / f"proc_fit_{fit_key.hexdigest()}.json"
+
+
+def fit_proc_estimator(estimation_file, model_name=None):
+    # Load json file for estimation
+    query_json = PropertyUtils.load_property_file(properties_file=estimation_file)
+    query_executions = query_json["query_executions"]
+
+    num_join_list = list()
+    num_groupby_list = list()
+    input_card_list = list()
+    suspension_point_list = list()
+    persist_size_list = list()
+    # an execution can be tagged with its query template, such as "tpch-q5", for per-template models
+    query_template_list = list()
+
+    for qe in query_executions:
+        num_join_list.append(qe["num_join"])
+        num_groupby_list.append(qe["num_groupby"])
+        input_card_list.append(qe["input_cardinality"])
+        suspension_point_list.append(qe["suspension_point"])
+        persist_size_list.append(qe["persistence_size"])
+        query_template_list.append(qe.get("query_template", ""))
+
+    proc_estimator = ProcLatencyEstimator(RAND_WRITE_SPEED, RAND_READ_SPEED,
+                                          num_join_list, num_groupby_list,
+                                          input_card_list, suspension_point_list, persist_size_list,
+                                          model_name, query_template_list)
+    proc_estimator.fit_curve()
+
+    if proc_estimator.cv_report is not None:
+        print_cv_report(proc_estimator.cv_report, RAND_WRITE_SPEED, RAND_READ_SPEED)
+
+    return proc_estimator
+
+
+def load_proc_estimator(estimation_file, model_name=None, cache_dir=FIT_CACHE_DIR):
+    proc_estimator = ProcLatencyEstimator(RAND_WRITE_SPEED, RAND_READ_SPEED, [], [], [], [], [], model_name)
+    cache_file = fit_cache_file(estimation_file, proc_estimator.model_form(), cache_dir)
+
+    if cache_file.exists():
+        with open(cache_file) as fp:
+            fit_cache = json.load(fp)
+        proc_estimator.set_param(fit_cache["param"])
+        return proc_estimator
+
+    proc_estimator = fit_proc_estimator(estimation_file, model_name)
+
+    # write to a temporary file first, so concurrent runs never read a partial cache entry
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_cache_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_cache_file, "w") as fp:
+        json.dump({"estimation_file": str(estimation_file),
+                   "model_form": proc_estimator.model_form(),
+                   "param": proc_estimator.get_param()}, fp)
+    os.replace(tmp_cache_file, cache_file)
+
+    return proc_estimator
+
+
+def load_online_estimator(state_file, estimation_file, forgetting_factor=1.0):
+    online_estimator = OnlineProcLatencyEstimator(RAND_WRITE_SPEED, RAND_READ_SPEED, forgetting_factor)
+    state_file = Path(state_file)
+    if state_file.exists():
+        with open(state_file) as fp:
+            online_estimator.set_state(json.load(fp))
+
+    # The historical data is append-only, so only the executions after the absorbed ones are new
+    query_json = PropertyUtils.load_property_file(properties_file=estimation_file)
+    new_executions = query_json["query_executions"][online_estimator.num_updates:]
+    for qe in new_executions:
+        online_estimator.update(qe["num_join"], qe["num_groupby"], qe["input_cardinality"],
+                                qe["suspension_point"], qe["persistence_size"])
+
+    if len(new_executions) > 0:
+        tmp_state_file = state_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_state_file, "w") as fp:
+            json.dump(online_estimator.get_state(), fp)
+        os.replace(tmp_state_file, state_file)
+
+    return online_estimator
+
+
 def observe_term_point(term_start, term_end, term_prob):
     np.random.seed(int(datetime.now().timestamp()))
     if term_prob == 1:
@@ -68,6 +176,102 @@ def get_current_term_prob(term_end, current_time, term_prob):
         return term_prob
 
 
+class StrategyDecision:
+    def __init__(self, strategy, cost_redo, cost_proc, cost_ppl, proc_curve, proc_suspension_point):
+        self.strategy = strategy
+        self.cost_redo = cost_redo
+        self.cost_proc = cost_proc
+        self.cost_ppl = cost_ppl
+        self.proc_curve = proc_curve
+        self.proc_suspension_point = proc_suspension_point
+
+    def to_dict(self):
+        return {"strategy": self.strategy,
+                "cost_redo": float(self.cost_redo),
+                "cost_proc": float(self.cost_proc),
+                "cost_ppl": float(self.cost_ppl),
+                "proc_suspension_point": float(self.proc_suspension_point)}
+
+
+def decide_strategy(proc_estimator, ppl_estimator, num_join, num_groupby, input_card,
+                    current_exec_time, term_start, term_end, term_prob, time_unit, closed_form=False):
+    current_term_prob = get_current_term_prob(term_end, current_exec_time, term_prob)
+
+    # Calculate redo strategy cost
+    cost_redo = current_term_prob * current_exec_time
+
+    # Calculate pipeline-level strategy cost
+    latency_ppl_suspend = ppl_estimator.suspend_latency_estimation()
+    latency_ppl_resume = ppl_estimator.resume_latency_estimation()
+    if current_exec_time + latency_ppl_suspend > term_start:
+        prob_ppl_term = current_term_prob
+    else:
+        prob_ppl_term = 0
+    cost_ppl = latency_ppl_suspend + latency_ppl_resume + (prob_ppl_term * current_exec_time)
+
+    # Calculate process-level strategy cost
+    # Probe the "best" proc suspension time based on latency, over the whole cost curve at once
+    proc_curve = proc_cost_curve(proc_estimator, num_join, num_groupby, input_card,
+                                 current_exec_time, term_start, term_end, current_term_prob,
+                                 time_unit, closed_form)
+    cost_proc = proc_curve.best_cost
+    proc_suspension_point = proc_curve.best_point if proc_curve.best_point is not None else current_exec_time
+
+    # the first cheapest strategy wins a tie
+    strategy_list = [STRATEGY_REDO, STRATEGY_PROCESS, STRATEGY_PIPELINE]
+    strategy = strategy_list[int(np.argmin([cost_redo, cost_proc, cost_ppl]))]
+    return StrategyDecision(strategy, cost_redo, cost_proc, cost_ppl, proc_curve, proc_suspension_point)
+
+
+class BreakerHistory:
+    # The pipeline breakers a query has reached so far, as (execution time, state size)
+    def __init__(self):
+        self.times = list()
+        self.sizes = list()
+
+    def add(self, breaker_time, persistence_size):
+        self.times.append(breaker_time)
+        self.sizes.append(persistence_size)
+
+    def predict_next(self):
+        # The next breaker is expected after the longest gap so far, which keeps the deadline check
+        # conservative, and its state size follows the least-squares trend of the observed sizes, but
+        # never below the smallest state seen so far, so a falling trend does not wait forever
+        next_time = self.times[-1] + np.max(np.diff([0.0] + self.times))
+        if len(self.times) < 2:
+            return next_time, self.sizes[-1]
+        slope, intercept = np.polyfit(self.times, self.sizes, 1)
+        return next_time, max(slope * next_time + intercept, min(self.sizes))
+
+
+def decide_at_breaker(breaker_history, proc_estimator, ppl_estimator, num_join, num_groupby, input_card,
+                      current_exec_time, term_start, term_end, term_prob, time_unit, closed_form=False):
+    # decide_strategy at every pipeline breaker, but keep the query running (STRATEGY_CONTINUE) while a
+    # later breaker is expected to be cheaper and still before the termination window
+    decision = decide_strategy(proc_estimator, ppl_estimator, num_join, num_groupby, input_card,
+                               current_exec_time, term_start, term_end, term_prob, time_unit, closed_form)
+
+    # the process-level dump is timed on the execution timeline, not at a breaker, and after the
+    # window there is nothing left to wait for
+    if decision.strategy == STRATEGY_PROCESS or current_exec_time >= term_end:
+        return decision
+
+    # the work at stake grows until the window, so redo is only final after it
+    if decision.strategy == STRATEGY_REDO:
+        decision.strategy = STRATEGY_CONTINUE
+        return decision
+
+    next_time, next_size = breaker_history.predict_next()
+    next_ppl_estimator = copy.copy(ppl_estimator)
+    next_ppl_estimator.persistence_size = next_size
+    next_suspend = next_ppl_estimator.suspend_latency_estimation()
+    if next_time + next_suspend <= term_start:
+        next_cost = next_suspend + next_ppl_estimator.resume_latency_estimation()
+        if next_cost < decision.cost_ppl:
+            decision.strategy = STRATEGY_CONTINUE
+    return decision
+
+
 def demo_proc_latency_estimation():
     parser = argparse.ArgumentParser()
     parser.add_argument("-ef", "--estimation_file", type=str, action="store", required=True,
@@ -77,27 +281,8 @@ def demo_proc_latency_estimation():
 
     start = time.perf_counter()
 
-    # Load json file for estimation
-    query_json = PropertyUtils.load_property_file(properties_file=estimation_file)
-    query_executions = query_json["query_executions"]
-
-    num_join_list = list()
-    num_groupby_list = list()
-    input_card_list = list()
-    suspension_point_list = list()
-    persist_size_list = list()
-
-    for qe in query_executions:
-        num_join_list.append(qe["num_join"])
-        num_groupby_list.append(qe["num_groupby"])
-        input_card_list.append(qe["input_cardinality"])
-        suspension_point_list.append(qe["suspension_point"])
-        persist_size_list.append(qe["persistence_size"])
-
-    ple = ProcLatencyEstimator(RAND_WRITE_SPEED, RAND_READ_SPEED,
-                               num_join_list, num_groupby_list,
-                               input_card_list, suspension_point_list, persist_size_list)
-    ple.fit_curve()
+    # Load the fitted estimator from the cache, or fit it from the historical data and cache it
+    ple = load_proc_estimator(estimation_file)
 
     # features for estimation
     input_num_join = 1
@@ -115,6 +300,15 @@ def demo_proc_latency_estimation():
     print("Total Runtime: {}".format(end - start))
 
 
+def storage_speeds(storage_future, default_speeds):
+    # The states and the images are written and read as large sequential files, so the sequential speeds
+    # of the profile apply. Until the profile is measured, the default speeds are used.
+    if storage_future is None or not storage_future.done() or storage_future.exception() is not None:
+        return default_speeds
+    storage = storage_future.result()
+    return storage["seq_write_speed"], storage["seq_read_speed"]
+
+
 def demo_e2e():
     parser = argparse.ArgumentParser()
     # Options for query execution
@@ -133,6 +327,12 @@ def demo_e2e():
                         help="indicate the persisted data or folder during suspension and resumption")
     parser.add_argument("-td", "--thread", type=int, action="store", default=1,
                         help="indicate the number of threads for query execution")
+    parser.add_argument("-spf", "--storage_profile", action="store_true", default=False,
+                        help="use the measured speed of the persistence and checkpoint storage instead of constants")
+    parser.add_argument("-tl", "--timing_log", type=str, action="store",
+                        help="indicate the suspend/resume timings recorded by the runners to calibrate the I/O model")
+    parser.add_argument("-wp", "--worker_pool", type=str, action="store",
+                        help="indicate the unix socket of a running worker pool instead of launching a new process")
 
     # Options for cost model estimation
     parser.add_argument("-nj", "--number_join", type=int, action="store",
@@ -143,6 +343,13 @@ def demo_e2e():
                         help="indicate the cardinality of input dataset")
     parser.add_argument("-ef", "--estimation_file", type=str, action="store", required=True,
                         help="indicate the file stored historical data for estimation")
+    parser.add_argument("-pm", "--persistence_model", type=str, action="store",
+                        choices=list(PERSISTENCE_MODELS) + ["cv"],
+                        help="indicate the model family for persistence size, cv selects one by cross-validation")
+    parser.add_argument("-os", "--online_state", type=str, action="store",
+                        help="indicate the state file of the online estimator, which only absorbs new executions")
+    parser.add_argument("-ff", "--forgetting_factor", type=float, action="store", default=1.0,
+                        help="indicate the forgetting factor of the online estimator, 1 keeps all executions")
 
     # Options for termination time window
     parser.add_argument("-ts", "--termination_start", type=float, action="store",
@@ -153,6 +360,14 @@ def demo_e2e():
                         help="indicate the probability of termination happened in the window")
     parser.add_argument("-tu", "--time_unit", type=int, action="store",
                         help="indicate the time unit for moving forward when estimating latency for proc-level")
+    parser.add_argument("-cf", "--closed_form", action="store_true", default=False,
+                        help="only evaluate the end points of the linear cost curve for proc-level")
+    parser.add_argument("-pdl", "--pre_dump_lead", type=float, action="store",
+                        help="indicate how long (second) before the process-level dump to start criu pre-dumps")
+    parser.add_argument("-mpd", "--max_pre_dumps", type=int, action="store", default=3,
+                        help="indicate the maximum number of criu pre-dump iterations")
+    parser.add_argument("-mb", "--multi_breaker", action="store_true", default=False,
+                        help="decide again at every pipeline breaker, Ratchet has to support STRATEGY_CONTINUE")
     args = parser.parse_args()
 
     # Get options for query execution
@@ -163,18 +378,26 @@ def demo_e2e():
     tmp = args.tmp_folder
     ploc = f"{benchmark}/{args.persistence_location}"
     td = args.thread
+    worker_pool = args.worker_pool
+    storage_profile = args.storage_profile
+    timing_log = args.timing_log
 
     # Get options for cost model estimation
     num_join = args.number_join
     num_groupby = args.number_groupby
     input_card = args.input_cardinality
     estimation_file = args.estimation_file
+    persistence_model = args.persistence_model
+    online_state = args.online_state
+    forgetting_factor = args.forgetting_factor
 
     # Get options for termination time window
     term_start = args.termination_start
     term_end = args.termination_end
     term_prob = args.termination_prob
     time_unit = args.time_unit
+    closed_form = args.closed_form
+    multi_breaker = args.multi_breaker
 
     # Get benchmark python command
     benchmark_arg = f"{benchmark}/ratchet_{benchmark}.py"
@@ -189,158 +412,165 @@ def demo_e2e():
     # Mark the start time of query execution
     execution_start = time.perf_counter()
 
-    # Execute the query through subprocess
-    ratchet_proc = subprocess.Popen([exec_cmd], shell=True)
-
-    # Match the keyfile with the C++ program
-    shm_cost_model_flag_keyfile = "/tmp/shm_cost_model_flag_keyfile"
-    shm_strategy_keyfile = "/tmp/shm_strategy_keyfile"
-    shm_persistence_size_keyfile = "/tmp/shm_persistence_size_keyfile"
-
-    # Get shared memory key based on the name of keyfile
-    shm_cost_model_flag_key = ctypes.CDLL(None).ftok(shm_cost_model_flag_keyfile.encode(), ord('R'))
-    shm_strategy_key = ctypes.CDLL(None).ftok(shm_strategy_keyfile.encode(), ord('R'))
-    shm_persistence_size_key = ctypes.CDLL(None).ftok(shm_persistence_size_keyfile.encode(), ord('R'))
-
-    # it seems like time.sleep() is necessary
-    time.sleep(0.5)
-
-    shm_cost_model_flag = sysv_ipc.SharedMemory(shm_cost_model_flag_key, ctypes.sizeof(ctypes.c_uint16), 0 | 0o666)
-    shm_strategy = sysv_ipc.SharedMemory(shm_strategy_key, ctypes.sizeof(ctypes.c_uint16), 0 | 0o666)
-    shm_persistence_size = sysv_ipc.SharedMemory(shm_persistence_size_key, ctypes.sizeof(ctypes.c_uint64), 0 | 0o666)
-
-    # Wait until the query execution reach a pipeline breaker and mark `cost_model_flag = 1`
-    while True:
-        execution_check = time.perf_counter()
-
-        # Convert share memory to variables
-        cost_model_flag = ctypes.c_uint16.from_buffer(shm_cost_model_flag).value
-        persistence_size = ctypes.c_uint64.from_buffer(shm_persistence_size).value
-
-        if cost_model_flag == 1:
-            print("[Python] Cost model is running...")
-            print(f"[Python] Size of intermediate states: {persistence_size}")
-            break
-
-        time.sleep(0.5)
-
-    ##########################
-    # Cost Model Preparation
-    ##########################
-    # Get the execution time of reaching current
-    pipeline_breaker = time.perf_counter()
-    current_exec_time = pipeline_breaker - execution_start
-
-    # Check if the query should be terminated
-    if current_exec_time > term_point:
-        print("The query has been terminated")
-        exit(0)
-
-    # Create an estimator for latency of pipeline-level strategy
-    ppl_estimator = PipelineLatencyEstimator(persistence_size, RAND_WRITE_SPEED, RAND_READ_SPEED)
-
-    # Load json file for estimation
-    query_json = PropertyUtils.load_property_file(properties_file=estimation_file)
-    query_executions = query_json["query_executions"]
-
-    # Create an estimator for latency of process-level strategy
-    num_join_list = list()
-    num_groupby_list = list()
-    input_card_list = list()
-    suspension_point_list = list()
-    persist_size_list = list()
-
-    for qe in query_executions:
-        num_join_list.append(qe["num_join"])
-        num_groupby_list.append(qe["num_groupby"])
-        input_card_list.append(qe["input_cardinality"])
-        suspension_point_list.append(qe["suspension_point"])
-        persist_size_list.append(qe["persistence_size"])
-
-    proc_estimator = ProcLatencyEstimator(RAND_WRITE_SPEED, RAND_READ_SPEED,
-                                          num_join_list, num_groupby_list,
-                                          input_card_list, suspension_point_list, persist_size_list)
-    proc_estimator.fit_curve()
-
-    ######################
-    # Cost Model Decision
-    ######################
-    # Calculate redo strategy cost
-    cost_redo = get_current_term_prob(term_end, current_exec_time, term_prob) * current_exec_time
+    # Create the notification channel before launching, so that the first pipeline breaker cannot be missed.
+    # A pool worker has its own namespace and the pool keeps its channel, so it is opened after the submission
+    breaker_notifier = PipelineBreakerNotifier(create=True) if worker_pool is None else None
+
+    # Load the estimator for process-level strategy while the query runs towards its first pipeline breaker
+    proc_estimator_loader = ThreadPoolExecutor(max_workers=1)
+    ppl_storage_future, proc_storage_future = None, None
+    if storage_profile:
+        # profiles are cached per device, so only the first run on a device pays for measuring. Measuring
+        # runs on its own executor and the decisions use the constants until it is done, so it never
+        # delays the estimator or the first breaker.
+        storage_profiler = ThreadPoolExecutor(max_workers=1)
+        ppl_storage_future = storage_profiler.submit(get_storage_profile, ploc)
+        proc_storage_future = storage_profiler.submit(get_storage_profile, CKPT_PATH)
+        storage_profiler.shutdown(wait=False)
+    if timing_log is not None:
+        io_model_future = proc_estimator_loader.submit(calibrate_io_models, timing_log)
+    if online_state is None:
+        proc_estimator_future = proc_estimator_loader.submit(load_proc_estimator, estimation_file, persistence_model)
+    else:
+        proc_estimator_future = proc_estimator_loader.submit(load_online_estimator, online_state,
+                                                             estimation_file, forgetting_factor)
 
-    # Calculate pipeline-level strategy cost
-    latency_ppl_suspend = ppl_estimator.suspend_latency_estimation()
-    latency_ppl_resume = ppl_estimator.resume_latency_estimation()
-    if current_exec_time + latency_ppl_suspend > term_start:
-        prob_ppl_term = get_current_term_prob(term_end, current_exec_time, term_prob)
+    # Execute the query through subprocess, or through a pre-warmed worker with the tables already loaded
+    namespace = None
+    if worker_pool is None:
+        ratchet_proc = subprocess.Popen([exec_cmd], shell=True)
     else:
-        prob_ppl_term = 0
-    cost_ppl = latency_ppl_suspend + latency_ppl_resume + (prob_ppl_term * current_exec_time)
+        ratchet_proc = WorkerPoolClient(worker_pool).submit({"op": "query", "qid": qid, "persistence_location": ploc})
+        if ratchet_proc.returncode is not None:
+            print(f"[Python] Worker pool job failed: {ratchet_proc.response}")
+            exit(1)
+        namespace = ratchet_proc.namespace
+        breaker_notifier = PipelineBreakerNotifier(namespaced_keyfile(SEM_PIPELINE_BREAKER_KEYFILE, namespace),
+                                                   create=False)
+
+    # Attach shared memory once Ratchet has created the segments
+    shm_cost_model_flag = attach_shared_memory(namespaced_keyfile(SHM_COST_MODEL_FLAG_KEYFILE, namespace),
+                                               timeout=SHM_ATTACH_TIMEOUT)
+    shm_strategy = attach_shared_memory(namespaced_keyfile(SHM_STRATEGY_KEYFILE, namespace),
+                                        timeout=SHM_ATTACH_TIMEOUT)
+    shm_persistence_size = attach_shared_memory(namespaced_keyfile(SHM_PERSISTENCE_SIZE_KEYFILE, namespace),
+                                                timeout=SHM_ATTACH_TIMEOUT)
+
+    suspend_io_model, resume_io_model = None, None
+    if timing_log is not None:
+        # fixed overhead + bandwidth + parallelism, calibrated from the suspend/resume runs
+        suspend_io_model, resume_io_model = io_model_future.result()
+
+    # The estimator is loaded (or fitted) in the background since the query was launched
+    proc_estimator = proc_estimator_future.result()
+    proc_default_speeds = (proc_estimator.rand_write_speed, proc_estimator.rand_read_speed)
+    proc_estimator_loader.shutdown()
+    proc_estimator.query_template = f"{benchmark}-{qid}"
+
+    # Decide at the first pipeline breaker, or at every breaker until the query is suspended with -mb
+    breaker_history = BreakerHistory()
+    strategy_id = STRATEGY_CONTINUE
+    while strategy_id == STRATEGY_CONTINUE:
+        # Wait until the query execution reach a pipeline breaker and mark `cost_model_flag = 1`
+        reach_breaker = wait_for_pipeline_breaker(shm_cost_model_flag, breaker_notifier,
+                                                  is_alive=lambda: ratchet_proc.poll() is None)
+        if not reach_breaker and len(breaker_history.times) == 0:
+            print(f"[Python] Ratchet exited before reaching a pipeline breaker: {ratchet_proc.returncode}")
+            exit(0)
+        elif not reach_breaker:
+            # the query finished without another breaker, so it was never suspended
+            print(f"[Python] Ratchet finished after {len(breaker_history.times)} pipeline breakers")
+            strategy_id = STRATEGY_REDO
+            break
 
-    # Calculate process-level strategy cost
-    # Probe the "best" proc suspension time based on latency
-    cost_proc = np.inf
-    proc_suspension_probe = current_exec_time
-    proc_suspension_point = current_exec_time
-    while proc_suspension_probe <= term_end:
-        latency_proc_suspend_est = proc_estimator.suspend_latency_estimation(num_join, num_groupby,
-                                                                             input_card, proc_suspension_probe)
-
-        latency_proc_resume_est = proc_estimator.resume_latency_estimation(num_join, num_groupby,
-                                                                           input_card, proc_suspension_probe)
-
-        if current_exec_time + latency_proc_suspend_est > term_start:
-            prob_proc_term = get_current_term_prob(term_end, current_exec_time, term_prob)
+        persistence_size = ctypes.c_uint64.from_buffer(shm_persistence_size).value
+        print("[Python] Cost model is running...")
+        print(f"[Python] Size of intermediate states: {persistence_size}")
+
+        ##########################
+        # Cost Model Preparation
+        ##########################
+        # Get the execution time of reaching current
+        pipeline_breaker = time.perf_counter()
+        current_exec_time = pipeline_breaker - execution_start
+
+        # Check if the query should be terminated
+        if current_exec_time > term_point:
+            print("The query has been terminated")
+            exit(0)
+
+        # Create an estimator for latency of pipeline-level strategy with the speeds known by now
+        ppl_write_speed, ppl_read_speed = storage_speeds(ppl_storage_future, (RAND_WRITE_SPEED, RAND_READ_SPEED))
+        proc_estimator.rand_write_speed, proc_estimator.rand_read_speed = storage_speeds(proc_storage_future,
+                                                                                         proc_default_speeds)
+        ppl_estimator = PipelineLatencyEstimator(persistence_size, ppl_write_speed, ppl_read_speed,
+                                                 suspend_io_model, resume_io_model)
+        breaker_history.add(current_exec_time, persistence_size)
+
+        ######################
+        # Cost Model Decision
+        ######################
+        if multi_breaker:
+            decision = decide_at_breaker(breaker_history, proc_estimator, ppl_estimator,
+                                         num_join, num_groupby, input_card, current_exec_time,
+                                         term_start, term_end, term_prob, time_unit, closed_form)
         else:
-            prob_proc_term = 0
-
-        cost_proc_new = latency_proc_suspend_est + latency_proc_resume_est + (prob_proc_term * proc_suspension_probe)
-
-        if cost_proc_new < cost_proc:
-            cost_proc = cost_proc_new
-            proc_suspension_point = proc_suspension_probe
-
-        proc_suspension_probe += time_unit
-
-    cost_list = [cost_redo, cost_proc, cost_ppl]
-    strategy_id = np.where(cost_list == np.min(cost_list))[0]
-
-    # 1: Redo Strategy
-    # 2: Process-level Strategy
-    # 3: Pipeline-level Strategy
-    print(f"[Python] Select Strategy: {strategy_id}")
-
-    cost_model_flag_new = 0
-    cost_model_flag_to_send = cost_model_flag_new.to_bytes(ctypes.sizeof(ctypes.c_uint16), byteorder='little')
-    shm_cost_model_flag.write(cost_model_flag_to_send)
-    print("[Python] Cost model is finished")
-
-    strategy_new = strategy_id
-    strategy_to_send = strategy_new.to_bytes(ctypes.sizeof(ctypes.c_uint16), byteorder='little')
-    shm_strategy.write(strategy_to_send)
-
-    if strategy_id == 1:
+            decision = decide_strategy(proc_estimator, ppl_estimator, num_join, num_groupby, input_card,
+                                       current_exec_time, term_start, term_end, term_prob, time_unit, closed_form)
+        strategy_id = decision.strategy
+        proc_suspension_point = decision.proc_suspension_point
+        proc_curve = decision.proc_curve
+        print(f"[Python] Process-level cost curve: {len(proc_curve.costs)} points in {proc_curve.decision_latency:.6f}s")
+        print(f"[Python] Select Strategy: {strategy_id} at pipeline breaker {len(breaker_history.times)}")
+
+        # the strategy is in place before Ratchet sees the flag cleared
+        strategy_new = strategy_id
+        strategy_to_send = strategy_new.to_bytes(ctypes.sizeof(ctypes.c_uint16), byteorder='little')
+        shm_strategy.write(strategy_to_send)
+
+        cost_model_flag_new = 0
+        cost_model_flag_to_send = cost_model_flag_new.to_bytes(ctypes.sizeof(ctypes.c_uint16), byteorder='little')
+        shm_cost_model_flag.write(cost_model_flag_to_send)
+        print("[Python] Cost model is finished")
+
+        # a notification of this breaker must not wake up the wait for the next one
+        if strategy_id == STRATEGY_CONTINUE:
+            breaker_notifier.drain()
+
+    if strategy_id == STRATEGY_REDO:
         print("[Python] Using Redo Suspension")
         # Wait until the process is finished
         ratchet_proc.wait()
         return_code = ratchet_proc.returncode
         print(f'[Python] Ratchet exited with return code: {return_code}')
-    elif strategy_id == 2:
+        if worker_pool is not None:
+            print(f'[Python] Worker pool job: {ratchet_proc.response}')
+    elif strategy_id == STRATEGY_PIPELINE:
         print("[Python] Using Pipeline-level Suspension")
         # Wait until the process is finished
         ratchet_proc.wait()
         return_code = ratchet_proc.returncode
         print(f'[Python] Ratchet exited with return code: {return_code}')
+        if worker_pool is not None:
+            print(f'[Python] Worker pool job: {ratchet_proc.response}')
     else:
         print("[Python] Using Process-level Suspension")
-        time.sleep(proc_suspension_point)
-        proc_suspend_cmd = f"sudo {CRIU_CMD} dump -D {CKPT_PATH}/ckpt_{qid}_{ratchet_proc.pid} -t {ratchet_proc.pid} --file-locks --shell-job"
-        # Trigger process-level suspension through subprocess
-        proc_suspend = subprocess.Popen([proc_suspend_cmd], shell=True)
+        # The suspension point is on the execution timeline, so only wait for the part not executed yet.
+        # Pre-dumps copy the memory while the query keeps running, the final dump only writes dirty pages
+        dump_delay = max(proc_suspension_point - (time.perf_counter() - execution_start), 0)
+        criu_driver = AsyncCriuDriver()
+        checkpoint_stats = asyncio.run(criu_driver.checkpoint(ratchet_proc.pid,
+                                                              f"{CKPT_PATH}/ckpt_{qid}_{ratchet_proc.pid}",
+                                                              dump_delay, args.pre_dump_lead, args.max_pre_dumps))
+        print(f"[Python] Freeze Time (s): {checkpoint_stats.freeze_ns / 1e9:.3f}")
+        print(f"[Python] Total Checkpoint Time (s): {checkpoint_stats.checkpoint_ns / 1e9:.3f}")
+        print(f"[Python] Checkpoint Metrics: {json.dumps(checkpoint_stats.to_dict())}")
 
     shm_cost_model_flag.detach()
     shm_strategy.detach()
     shm_persistence_size.detach()
+    if worker_pool is None:
+        breaker_notifier.remove()
     print(f'Detached shared memory variable from Ratchet')
 
 
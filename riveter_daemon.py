@@ -0,0 +1,414 @@
+import argparse
+import asyncio
+import copy
+import ctypes
+import os
+import subprocess
+import threading
+import time
+
+from multiprocessing.connection import Listener, Client
+from cost_model import PERSISTENCE_MODELS, PipelineLatencyEstimator, get_storage_profile, storage_device
+from criu_driver import AsyncCriuDriver, pid_alive
+from suspension_log import calibrate_io_models
+from shm_channel import (SHM_COST_MODEL_FLAG_KEYFILE, SHM_STRATEGY_KEYFILE, SHM_PERSISTENCE_SIZE_KEYFILE,
+                         SEM_PIPELINE_BREAKER_KEYFILE, IPC_NAMESPACE_ENV, PipelineBreakerNotifier,
+                         attach_shared_memory, namespaced_keyfile, wait_for_pipeline_breaker)
+from riveter import (RAND_WRITE_SPEED, RAND_READ_SPEED, CKPT_PATH, SHM_ATTACH_TIMEOUT, STRATEGY_PIPELINE,
+                     STRATEGY_PROCESS, load_proc_estimator, load_online_estimator, decide_strategy,
+                     get_current_term_prob)
+from suspension_scheduler import SuspensionOption, SuspensionCandidate, schedule
+
+DAEMON_ADDRESS = "/tmp/riveter_daemon.sock"
+DAEMON_AUTHKEY = b"riveter"
+# how long the first query at a pipeline breaker waits for the others before the batch is scheduled
+BATCH_INTERVAL = 0.05
+
+
+class BandwidthBudget:
+    # The persistence device is shared by every query that may be suspended, so each query plans with
+    # an even share of its bandwidth
+    def __init__(self, write_speed, read_speed):
+        self.write_speed = write_speed
+        self.read_speed = read_speed
+        self.active_slots = set()
+        self.lock = threading.Lock()
+
+    def acquire(self, slot_id):
+        with self.lock:
+            self.active_slots.add(slot_id)
+
+    def release(self, slot_id):
+        with self.lock:
+            self.active_slots.discard(slot_id)
+
+    def share(self):
+        with self.lock:
+            num_active = max(len(self.active_slots), 1)
+        return self.write_speed / num_active, self.read_speed / num_active
+
+
+class SuspensionBatcher:
+    # Queries that reach a pipeline breaker close together are scheduled as one batch on the shared devices.
+    # The first query of a batch waits batch_interval for the others and runs the scheduler for all of them;
+    # the time of the accepted suspensions is reserved on their devices, so the next batch starts after them.
+    def __init__(self, policy, batch_interval=BATCH_INTERVAL):
+        self.policy = policy
+        self.batch_interval = batch_interval
+        self.pending = dict()
+        self.has_leader = False
+        # device -> when its last planned suspension completes
+        self.device_free_at = dict()
+        self.lock = threading.Lock()
+
+    def submit(self, candidate):
+        entry = {"candidate": candidate, "done": threading.Event(), "plan": None, "start": None}
+        with self.lock:
+            self.pending[candidate.query_id] = entry
+            is_leader = not self.has_leader
+            self.has_leader = True
+
+        if is_leader:
+            time.sleep(self.batch_interval)
+            with self.lock:
+                batch, self.pending, self.has_leader = self.pending, dict(), False
+                # deadlines are absolute perf_counter times, so the device times are too
+                candidates = [e["candidate"] for e in batch.values()]
+                now = time.perf_counter()
+                device_free = {o.device: max(self.device_free_at.get(o.device, 0.0), now)
+                               for c in candidates for o in c.options}
+                plan = schedule(candidates, self.policy, device_free)
+                completions, starts = plan.completion_times(), plan.start_times()
+                for query_id, completion in completions.items():
+                    device = plan.assignments[query_id].device
+                    self.device_free_at[device] = max(self.device_free_at.get(device, 0.0), completion)
+            for query_id, e in batch.items():
+                e["plan"] = plan
+                e["start"] = starts.get(query_id)
+                e["done"].set()
+
+        entry["done"].wait()
+        return entry["plan"], entry["start"]
+
+
+class QuerySlot:
+    # The namespaced IPC of one running query
+    def __init__(self, slot_id):
+        self.slot_id = slot_id
+        self.namespace = f"slot{slot_id}"
+        self.notifier = PipelineBreakerNotifier(namespaced_keyfile(SEM_PIPELINE_BREAKER_KEYFILE, self.namespace),
+                                                create=True)
+        self.shm_cost_model_flag = None
+        self.shm_strategy = None
+        self.shm_persistence_size = None
+
+    def env(self):
+        return {IPC_NAMESPACE_ENV: self.namespace}
+
+    def attach(self, timeout=SHM_ATTACH_TIMEOUT):
+        self.shm_cost_model_flag = attach_shared_memory(namespaced_keyfile(SHM_COST_MODEL_FLAG_KEYFILE, self.namespace),
+                                                        timeout=timeout)
+        self.shm_strategy = attach_shared_memory(namespaced_keyfile(SHM_STRATEGY_KEYFILE, self.namespace),
+                                                 timeout=timeout)
+        self.shm_persistence_size = attach_shared_memory(namespaced_keyfile(SHM_PERSISTENCE_SIZE_KEYFILE, self.namespace),
+                                                         timeout=timeout)
+
+    def release(self):
+        for shm in [self.shm_cost_model_flag, self.shm_strategy, self.shm_persistence_size]:
+            if shm is not None:
+                shm.detach()
+        self.notifier.remove()
+
+
+class RiveterDaemon:
+    def __init__(self, estimation_file, persistence_model=None, online_state=None, forgetting_factor=1.0,
+                 storage_profile=False, persistence_location=".", timing_log=None, address=DAEMON_ADDRESS,
+                 schedule_policy="even-split", batch_interval=BATCH_INTERVAL):
+        self.estimation_file = estimation_file
+        self.persistence_model = persistence_model
+        self.online_state = online_state
+        self.forgetting_factor = forgetting_factor
+        self.storage_profile = storage_profile
+        self.persistence_location = persistence_location
+        self.timing_log = timing_log
+        self.address = address
+        # even-split decides each query on its own with a share of the bandwidth, the other policies
+        # schedule the suspensions of all queries at a breaker together
+        self.batcher = None if schedule_policy == "even-split" else SuspensionBatcher(schedule_policy, batch_interval)
+
+        self.proc_estimator = None
+        self.ppl_budget = None
+        self.proc_budget = None
+        # the scheduler keeps one timeline per device, the states and the images may share one
+        self.ppl_device, _ = storage_device(persistence_location)
+        self.proc_device, _ = storage_device(CKPT_PATH)
+        self.suspend_io_model, self.resume_io_model = None, None
+
+        self.free_slots = list()
+        self.num_slots = 0
+        self.slot_lock = threading.Lock()
+
+    def start(self):
+        # Everything a decision needs is loaded once, instead of once per query
+        bootstrap_start = time.perf_counter()
+        if self.online_state is None:
+            self.proc_estimator = load_proc_estimator(self.estimation_file, self.persistence_model)
+        else:
+            self.proc_estimator = load_online_estimator(self.online_state, self.estimation_file, self.forgetting_factor)
+
+        ppl_write_speed, ppl_read_speed = RAND_WRITE_SPEED, RAND_READ_SPEED
+        proc_write_speed, proc_read_speed = RAND_WRITE_SPEED, RAND_READ_SPEED
+        if self.storage_profile:
+            ppl_storage = get_storage_profile(self.persistence_location)
+            # states and images are large sequential files, see storage_speeds() in riveter.py
+            ppl_write_speed, ppl_read_speed = ppl_storage["seq_write_speed"], ppl_storage["seq_read_speed"]
+            proc_storage = get_storage_profile(CKPT_PATH)
+            proc_write_speed, proc_read_speed = proc_storage["seq_write_speed"], proc_storage["seq_read_speed"]
+        self.ppl_budget = BandwidthBudget(ppl_write_speed, ppl_read_speed)
+        self.proc_budget = BandwidthBudget(proc_write_speed, proc_read_speed)
+
+        if self.timing_log is not None:
+            self.suspend_io_model, self.resume_io_model = calibrate_io_models(self.timing_log)
+        print(f"[Daemon] Estimator and storage profiles are ready in {time.perf_counter() - bootstrap_start:.3f}s")
+
+    def allocate_slot(self):
+        # reuse the lowest free slot, so the keyfiles in /tmp stay bounded by the peak concurrency
+        with self.slot_lock:
+            if len(self.free_slots) > 0:
+                slot_id = min(self.free_slots)
+                self.free_slots.remove(slot_id)
+            else:
+                slot_id = self.num_slots
+                self.num_slots += 1
+        return QuerySlot(slot_id)
+
+    def free_slot(self, slot):
+        slot.release()
+        with self.slot_lock:
+            self.free_slots.append(slot.slot_id)
+
+    def decide(self, request, persistence_size, current_exec_time):
+        ppl_write_speed, ppl_read_speed = self.ppl_budget.share()
+        ppl_estimator = PipelineLatencyEstimator(persistence_size, ppl_write_speed, ppl_read_speed,
+                                                 self.suspend_io_model, self.resume_io_model)
+
+        # the loaded estimator is shared by all queries, so only a shallow copy carries the per-query settings
+        proc_estimator = copy.copy(self.proc_estimator)
+        proc_estimator.rand_write_speed, proc_estimator.rand_read_speed = self.proc_budget.share()
+        proc_estimator.query_template = f"{request['benchmark']}-{request['qid']}"
+
+        return decide_strategy(proc_estimator, ppl_estimator,
+                               request["num_join"], request["num_groupby"], request["input_cardinality"],
+                               current_exec_time, request["termination_start"], request["termination_end"],
+                               request["termination_prob"], request["time_unit"], request.get("closed_form", False))
+
+    def candidate(self, request, slot, persistence_size, current_exec_time, execution_start):
+        # Both options are estimated with the full bandwidth, the scheduler serializes them on their devices
+        ppl_estimator = PipelineLatencyEstimator(persistence_size, self.ppl_budget.write_speed,
+                                                 self.ppl_budget.read_speed, self.suspend_io_model,
+                                                 self.resume_io_model)
+        ppl_option = SuspensionOption(STRATEGY_PIPELINE, ppl_estimator.suspend_latency_estimation(),
+                                      ppl_estimator.resume_latency_estimation(), persistence_size, self.ppl_device)
+
+        proc_estimator = copy.copy(self.proc_estimator)
+        proc_estimator.rand_write_speed = self.proc_budget.write_speed
+        proc_estimator.rand_read_speed = self.proc_budget.read_speed
+        proc_estimator.query_template = f"{request['benchmark']}-{request['qid']}"
+        features = [request["num_join"], request["num_groupby"], request["input_cardinality"], current_exec_time]
+        proc_option = SuspensionOption(STRATEGY_PROCESS, proc_estimator.suspend_latency_estimation(*features),
+                                       proc_estimator.resume_latency_estimation(*features),
+                                       proc_estimator.persist_size_estimation(*features), self.proc_device)
+
+        # persisted before the window opens, or before it closes once the query is already inside it
+        term_start, term_end = request["termination_start"], request["termination_end"]
+        deadline = execution_start + (term_start if current_exec_time < term_start else term_end)
+        term_prob = get_current_term_prob(term_end, current_exec_time, request["termination_prob"])
+        return SuspensionCandidate(slot.slot_id, current_exec_time, term_prob, deadline, [ppl_option, proc_option])
+
+    def schedule(self, request, slot, persistence_size, current_exec_time, execution_start):
+        plan, start = self.batcher.submit(self.candidate(request, slot, persistence_size, current_exec_time,
+                                                         execution_start))
+        decision = {"strategy": plan.strategy(slot.slot_id), "policy": plan.policy,
+                    "batch_size": len(plan.candidates), "decision_latency": plan.decision_latency}
+        # the suspension starts at its turn on the device, the plan assumes it has the full bandwidth
+        hold = max(start - time.perf_counter(), 0) if start is not None else 0
+        return decision, hold
+
+    def serve_query(self, client_conn):
+        request = client_conn.recv()
+        slot = self.allocate_slot()
+        self.ppl_budget.acquire(slot.slot_id)
+        self.proc_budget.acquire(slot.slot_id)
+        try:
+            # the client launches the query with the namespace, then reports its pid and start time
+            client_conn.send({"status": "registered", "slot": slot.slot_id, "env": slot.env()})
+            launch = client_conn.recv()
+            pid, execution_start = launch["pid"], launch["execution_start"]
+
+            slot.attach()
+            reach_breaker = wait_for_pipeline_breaker(slot.shm_cost_model_flag, slot.notifier,
+                                                      is_alive=lambda: pid_alive(pid))
+            if not reach_breaker:
+                client_conn.send({"status": "finished", "slot": slot.slot_id})
+                return
+
+            persistence_size = ctypes.c_uint64.from_buffer(slot.shm_persistence_size).value
+            # perf_counter is the system-wide monotonic clock, so the client's start time is comparable
+            current_exec_time = time.perf_counter() - execution_start
+            if self.batcher is None:
+                decision = self.decide(request, persistence_size, current_exec_time).to_dict()
+                dump_delay = max(decision["proc_suspension_point"] - (time.perf_counter() - execution_start), 0)
+            else:
+                decision, dump_delay = self.schedule(request, slot, persistence_size, current_exec_time,
+                                                     execution_start)
+            strategy = decision["strategy"]
+            if self.batcher is not None and strategy == STRATEGY_PIPELINE and dump_delay > 0:
+                # Ratchet persists the state as soon as it sees the strategy, so the query waits at the
+                # breaker until the suspensions planned before it on the device are written
+                time.sleep(dump_delay)
+                decision["hold_time"] = dump_delay
+
+            # the strategy is in place before Ratchet sees the flag cleared
+            slot.shm_strategy.write(strategy.to_bytes(ctypes.sizeof(ctypes.c_uint16), byteorder='little'))
+            slot.shm_cost_model_flag.write((0).to_bytes(ctypes.sizeof(ctypes.c_uint16), byteorder='little'))
+            print(f"[Daemon] Slot {slot.slot_id} ({request['benchmark']}-{request['qid']}): "
+                  f"strategy {strategy}, state {persistence_size} bytes at {current_exec_time:.3f}s")
+
+            response = {"status": "decided", "slot": slot.slot_id, "persistence_size": persistence_size,
+                        "current_exec_time": current_exec_time, **decision}
+            if strategy == STRATEGY_PROCESS:
+                checkpoint_stats = asyncio.run(AsyncCriuDriver().checkpoint(
+                    pid, f"{CKPT_PATH}/ckpt_{request['qid']}_{pid}", dump_delay,
+                    request.get("pre_dump_lead"), request.get("max_pre_dumps", 3)))
+                response["checkpoint"] = checkpoint_stats.to_dict()
+            client_conn.send(response)
+        except Exception as e:
+            client_conn.send({"status": "error", "slot": slot.slot_id, "error": repr(e)})
+        finally:
+            self.ppl_budget.release(slot.slot_id)
+            self.proc_budget.release(slot.slot_id)
+            self.free_slot(slot)
+            client_conn.close()
+
+    def serve_forever(self):
+        if os.path.exists(self.address):
+            os.remove(self.address)
+
+        with Listener(self.address, family="AF_UNIX", authkey=DAEMON_AUTHKEY) as listener:
+            print(f"[Daemon] Listening on {self.address}")
+            while True:
+                client_conn = listener.accept()
+                threading.Thread(target=self.serve_query, args=(client_conn,), daemon=True).start()
+
+
+class RiveterDaemonClient:
+    def __init__(self, address=DAEMON_ADDRESS):
+        self.address = address
+
+    def run_query(self, request, exec_cmd):
+        # register, launch the query in its own IPC namespace, and wait for the decision and the query
+        conn = Client(self.address, family="AF_UNIX", authkey=DAEMON_AUTHKEY)
+        conn.send(request)
+        registration = conn.recv()
+
+        execution_start = time.perf_counter()
+        ratchet_proc = subprocess.Popen(exec_cmd, env={**os.environ, **registration["env"]})
+        conn.send({"pid": ratchet_proc.pid, "execution_start": execution_start})
+
+        try:
+            response = conn.recv()
+        except EOFError:
+            response = {"status": "error", "error": "daemon closed the connection"}
+        conn.close()
+
+        response["return_code"] = ratchet_proc.wait()
+        response["total_time"] = time.perf_counter() - execution_start
+        return response
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-a", "--address", type=str, action="store", default=DAEMON_ADDRESS,
+                        help="indicate the unix socket the daemon listens on")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="run the daemon")
+    serve_parser.add_argument("-ef", "--estimation_file", type=str, action="store", required=True,
+                              help="indicate the file stored historical data for estimation")
+    serve_parser.add_argument("-pm", "--persistence_model", type=str, action="store",
+                              choices=list(PERSISTENCE_MODELS) + ["cv"],
+                              help="indicate the persistence-size model family, or cv to select it by cross-validation")
+    serve_parser.add_argument("-os", "--online_state", type=str, action="store",
+                              help="indicate the state file of the online (recursive least-squares) estimator")
+    serve_parser.add_argument("-ff", "--forgetting_factor", type=float, action="store", default=1.0,
+                              help="indicate the forgetting factor of the online estimator")
+    serve_parser.add_argument("-spf", "--storage_profile", action="store_true", default=False,
+                              help="use the profiled speed of the storage instead of the constants")
+    serve_parser.add_argument("-pl", "--persistence_location", type=str, action="store", default=".",
+                              help="indicate the folder for the pipeline-level persistence, for the storage profile")
+    serve_parser.add_argument("-tl", "--timing_log", type=str, action="store",
+                              help="indicate the timing log to calibrate the I/O latency models")
+    serve_parser.add_argument("-sp", "--schedule_policy", type=str, action="store", default="even-split",
+                              choices=["even-split", "greedy", "knapsack"],
+                              help="indicate how the suspensions of concurrent queries share the persistence device")
+    serve_parser.add_argument("-bi", "--batch_interval", type=float, action="store", default=BATCH_INTERVAL,
+                              help="indicate how long (second) to batch the queries at pipeline breakers")
+
+    submit_parser = subparsers.add_parser("submit", help="run one query under the daemon")
+    submit_parser.add_argument("-b", "--benchmark", type=str, action="store", required=True,
+                               choices=["vanilla", "tpch", "tpcds"],
+                               help="indicate the benchmark for evaluation")
+    submit_parser.add_argument("-q", "--query_id", type=str, action="store", required=True,
+                               help="indicate the query id")
+    submit_parser.add_argument("-d", "--database", type=str, action="store", default="memory",
+                               help="indicate the database location, memory or other location")
+    submit_parser.add_argument("-df", "--data_folder", type=str, action="store", required=True,
+                               help="indicate the dataset for queries, such as <dataset/tpch/parquet-sf1>")
+    submit_parser.add_argument("-tmp", "--tmp_folder", type=str, action="store", default="tmp",
+                               help="indicate the tmp folder for DuckDB, such as <exp/tmp>")
+    submit_parser.add_argument("-pl", "--persistence_location", type=str, action="store",
+                               help="indicate the folder for pipeline-level persistence")
+    submit_parser.add_argument("-td", "--thread", type=int, action="store", default=1,
+                               help="indicate the number of threads in DuckDB")
+    submit_parser.add_argument("-nj", "--number_join", type=int, action="store",
+                               help="indicate the number of joins in the query")
+    submit_parser.add_argument("-ng", "--number_groupby", type=int, action="store",
+                               help="indicate the number of group-bys in the query")
+    submit_parser.add_argument("-ic", "--input_cardinality", type=int, action="store",
+                               help="indicate the input cardinality of the query")
+    submit_parser.add_argument("-ts", "--termination_start", type=float, action="store",
+                               help="indicate the start point of termination time window (second)")
+    submit_parser.add_argument("-te", "--termination_end", type=float, action="store",
+                               help="indicate the end point of termination time window (second)")
+    submit_parser.add_argument("-tp", "--termination_prob", type=float, action="store",
+                               help="indicate the probability of termination happened in the window")
+    submit_parser.add_argument("-tu", "--time_unit", type=int, action="store",
+                               help="indicate the time unit for moving forward when estimating latency for proc-level")
+    submit_parser.add_argument("-cf", "--closed_form", action="store_true", default=False,
+                               help="only evaluate the end points of the linear cost curve for proc-level")
+    submit_parser.add_argument("-pdl", "--pre_dump_lead", type=float, action="store",
+                               help="indicate how long (second) before the process-level dump to start criu pre-dumps")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        daemon = RiveterDaemon(args.estimation_file, args.persistence_model, args.online_state,
+                               args.forgetting_factor, args.storage_profile, args.persistence_location,
+                               args.timing_log, args.address, args.schedule_policy, args.batch_interval)
+        daemon.start()
+        daemon.serve_forever()
+    else:
+        ploc = f"{args.benchmark}/{args.persistence_location}"
+        exec_cmd = ["python3", f"{args.benchmark}/ratchet_{args.benchmark}.py", "-q", args.query_id,
+                    "-d", args.database, "-df", args.data_folder, "-tmp", args.tmp_folder,
+                    "-td", str(args.thread), "-pl", ploc]
+        request = {"benchmark": args.benchmark, "qid": args.query_id,
+                   "num_join": args.number_join, "num_groupby": args.number_groupby,
+                   "input_cardinality": args.input_cardinality,
+                   "termination_start": args.termination_start, "termination_end": args.termination_end,
+                   "termination_prob": args.termination_prob, "time_unit": args.time_unit,
+                   "closed_form": args.closed_form, "pre_dump_lead": args.pre_dump_lead}
+        print(RiveterDaemonClient(args.address).run_query(request, exec_cmd))
+
+
+if __name__ == "__main__":
+    main()
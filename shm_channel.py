@@ -0,0 +1,222 @@
+import argparse
+import ctypes
+import os
+import threading
+import time
+import sysv_ipc
+
+from pathlib import Path
+
+# Match the keyfile with the C++ program
+SHM_COST_MODEL_FLAG_KEYFILE = "/tmp/shm_cost_model_flag_keyfile"
+SHM_STRATEGY_KEYFILE = "/tmp/shm_strategy_keyfile"
+SHM_PERSISTENCE_SIZE_KEYFILE = "/tmp/shm_persistence_size_keyfile"
+
+# Semaphore posted by Ratchet right after it marks `cost_model_flag = 1`
+SEM_PIPELINE_BREAKER_KEYFILE = "/tmp/sem_pipeline_breaker_keyfile"
+
+SHM_PROJ_ID = 'R'
+
+# With several queries on one box, Ratchet suffixes every keyfile with `.<namespace>` from this variable,
+# so each query gets its own segments and semaphore
+IPC_NAMESPACE_ENV = "RIVETER_IPC_NAMESPACE"
+
+
+def namespaced_keyfile(keyfile, namespace=None):
+    return keyfile if namespace is None else f"{keyfile}.{namespace}"
+
+
+def get_ipc_key(keyfile):
+    # ftok() returns -1 if the keyfile does not exist (yet)
+    return ctypes.CDLL(None).ftok(keyfile.encode(), ord(SHM_PROJ_ID))
+
+
+class Backoff:
+    def __init__(self, initial=0.0001, maximum=0.05, factor=2.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.current = initial
+
+    def next_delay(self):
+        delay = self.current
+        self.current = min(self.current * self.factor, self.maximum)
+        return delay
+
+    def sleep(self):
+        time.sleep(self.next_delay())
+
+    def reset(self):
+        self.current = self.initial
+
+
+def attach_shared_memory(keyfile, timeout=None, backoff=None):
+    # Ratchet creates the segments after it starts up, so retry with backoff instead of a fixed sleep
+    backoff = backoff if backoff is not None else Backoff()
+    deadline = None if timeout is None else time.perf_counter() + timeout
+
+    while True:
+        shm_key = get_ipc_key(keyfile)
+        if shm_key != -1:
+            try:
+                return sysv_ipc.SharedMemory(shm_key, 0, 0o666)
+            except sysv_ipc.ExistentialError:
+                pass
+
+        if deadline is not None and time.perf_counter() > deadline:
+            raise TimeoutError(f"Shared memory for {keyfile} is not available after {timeout} seconds")
+        backoff.sleep()
+
+
+class PipelineBreakerNotifier:
+    def __init__(self, keyfile=SEM_PIPELINE_BREAKER_KEYFILE, create=True):
+        self.keyfile = keyfile
+        if create:
+            Path(keyfile).touch(exist_ok=True)
+
+        sem_key = get_ipc_key(keyfile)
+        if sem_key == -1:
+            raise ValueError(f"Cannot generate an ipc key from {keyfile}")
+
+        if create:
+            self.sem = sysv_ipc.Semaphore(sem_key, sysv_ipc.IPC_CREAT, 0o666, 0)
+            # drop any notification left by a previous run
+            self.sem.value = 0
+        else:
+            self.sem = sysv_ipc.Semaphore(sem_key)
+
+    def notify(self):
+        self.sem.release()
+
+    def wait(self, timeout=None):
+        # timeout=None blocks, timeout=0 only checks for a pending notification
+        try:
+            self.sem.acquire(timeout)
+            return True
+        except sysv_ipc.BusyError:
+            return False
+        except sysv_ipc.ExistentialError:
+            # the query side removed it on exit, there is nothing left to wait for
+            return False
+
+    def drain(self):
+        # drop the notifications that are already pending, such as a repeated post for the same breaker
+        self.sem.value = 0
+
+    def remove(self):
+        try:
+            self.sem.remove()
+        except sysv_ipc.ExistentialError:
+            pass
+
+
+def wait_for_pipeline_breaker(shm_cost_model_flag, notifier, timeout=None, backoff=None, is_alive=None):
+    # Block on the semaphore and re-check the flag in between, so Ratchet builds that only write
+    # the flag (without posting the semaphore) are still picked up with an exponential backoff
+    backoff = backoff if backoff is not None else Backoff()
+    deadline = None if timeout is None else time.perf_counter() + timeout
+
+    while True:
+        if ctypes.c_uint16.from_buffer(shm_cost_model_flag).value == 1:
+            return True
+
+        if is_alive is not None and not is_alive():
+            return False
+
+        wait_time = backoff.next_delay()
+        if deadline is not None:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return False
+            wait_time = min(wait_time, remaining)
+
+        notifier.wait(wait_time)
+
+
+class LocalRatchetWriter:
+    # A stand-in for the C++ side of Ratchet, which owns the segments and notifies at pipeline breakers
+    def __init__(self,
+                 cost_model_flag_keyfile=SHM_COST_MODEL_FLAG_KEYFILE,
+                 strategy_keyfile=SHM_STRATEGY_KEYFILE,
+                 persistence_size_keyfile=SHM_PERSISTENCE_SIZE_KEYFILE,
+                 notify_keyfile=SEM_PIPELINE_BREAKER_KEYFILE,
+                 namespace=None):
+        namespace = namespace if namespace is not None else os.environ.get(IPC_NAMESPACE_ENV)
+        self.shm_cost_model_flag = self._create_segment(namespaced_keyfile(cost_model_flag_keyfile, namespace),
+                                                        ctypes.sizeof(ctypes.c_uint16))
+        self.shm_strategy = self._create_segment(namespaced_keyfile(strategy_keyfile, namespace),
+                                                 ctypes.sizeof(ctypes.c_uint16))
+        self.shm_persistence_size = self._create_segment(namespaced_keyfile(persistence_size_keyfile, namespace),
+                                                         ctypes.sizeof(ctypes.c_uint64))
+        # the notifier is created by Riveter before the query starts, so it is only opened here
+        self.notifier = PipelineBreakerNotifier(namespaced_keyfile(notify_keyfile, namespace), create=namespace is None)
+
+    @staticmethod
+    def _create_segment(keyfile, size):
+        Path(keyfile).touch(exist_ok=True)
+        shm = sysv_ipc.SharedMemory(get_ipc_key(keyfile), sysv_ipc.IPC_CREAT, 0o666, size, b'\0')
+        shm.write(bytes(size))
+        return shm
+
+    def reach_pipeline_breaker(self, persistence_size):
+        self.shm_persistence_size.write(persistence_size.to_bytes(ctypes.sizeof(ctypes.c_uint64), byteorder='little'))
+        self.shm_cost_model_flag.write((1).to_bytes(ctypes.sizeof(ctypes.c_uint16), byteorder='little'))
+        self.notifier.notify()
+
+    def read_strategy(self):
+        return ctypes.c_uint16.from_buffer(self.shm_strategy).value
+
+    def wait_for_decision(self, timeout=None, backoff=None):
+        # Riveter writes the strategy and then clears the flag, the query runs on to its next
+        # pipeline breaker if the strategy is 0 (continue)
+        backoff = backoff if backoff is not None else Backoff()
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while ctypes.c_uint16.from_buffer(self.shm_cost_model_flag).value == 1:
+            if deadline is not None and time.perf_counter() > deadline:
+                raise TimeoutError(f"No decision after {timeout} seconds")
+            backoff.sleep()
+        return self.read_strategy()
+
+    def remove(self):
+        for shm in [self.shm_cost_model_flag, self.shm_strategy, self.shm_persistence_size]:
+            shm.detach()
+            shm.remove()
+        self.notifier.remove()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--num_rounds", type=int, action="store", default=100,
+                        help="indicate the number of notifications for measuring wake-up latency")
+    args = parser.parse_args()
+
+    writer = LocalRatchetWriter()
+    notifier = PipelineBreakerNotifier(create=False)
+    shm_cost_model_flag = attach_shared_memory(SHM_COST_MODEL_FLAG_KEYFILE, timeout=1)
+
+    latency_list = list()
+    for _ in range(args.num_rounds):
+        shm_cost_model_flag.write(bytes(ctypes.sizeof(ctypes.c_uint16)))
+        notify_time = [0.0]
+
+        def notify():
+            time.sleep(0.001)
+            notify_time[0] = time.perf_counter()
+            writer.reach_pipeline_breaker(0)
+
+        notify_thread = threading.Thread(target=notify)
+        notify_thread.start()
+        wait_for_pipeline_breaker(shm_cost_model_flag, notifier, timeout=1)
+        latency_list.append(time.perf_counter() - notify_time[0])
+        notify_thread.join()
+
+    latency_list.sort()
+    print(f"Median Wake-up Latency (us): {latency_list[len(latency_list) // 2] * 1e6:.1f}")
+    print(f"Max Wake-up Latency (us): {latency_list[-1] * 1e6:.1f}")
+
+    shm_cost_model_flag.detach()
+    writer.remove()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+import argparse
+import itertools
+import json
+import time
+import numpy as np
+
+from cost_model import PipelineLatencyEstimator
+from riveter import (RAND_WRITE_SPEED, RAND_READ_SPEED, STRATEGY_REDO, STRATEGY_PIPELINE, STRATEGY_PROCESS,
+                     load_proc_estimator, decide_strategy)
+from suspension_log import load_timing_records, calibrate_io_models, is_valid_resume, is_valid_suspend
+
+STRATEGY_CODES = np.array([STRATEGY_REDO, STRATEGY_PROCESS, STRATEGY_PIPELINE])
+
+
+class QueryTrace:
+    # A recorded execution of one query, one JSON line per query:
+    #   {"query": "tpch-q5", "num_join": 5, "num_groupby": 1, "input_cardinality": 60000000, "runtime": 42.0,
+    #    "breakers": [{"time": 3.1, "persistence_size": 123, "suspend_latency": 0.2, "resume_latency": 0.1}, ...],
+    #    "proc": [{"time": 10.0, "image_size": 456, "suspend_latency": 1.5, "resume_latency": 0.8}, ...]}
+    # The latencies are measured; without them the pipeline-level ones follow from the size and the
+    # speed of the storage. The process-level samples are interpolated over the execution.
+    def __init__(self, query, num_join, num_groupby, input_cardinality, runtime, breakers, proc=None):
+        self.query = query
+        self.num_join = num_join
+        self.num_groupby = num_groupby
+        self.input_cardinality = input_cardinality
+        self.runtime = runtime
+        self.breakers = sorted(breakers, key=lambda b: b["time"])
+        self.proc = sorted(proc if proc is not None else list(), key=lambda p: p["time"])
+
+    @staticmethod
+    def from_dict(trace):
+        return QueryTrace(trace["query"], trace["num_join"], trace["num_groupby"], trace["input_cardinality"],
+                          trace["runtime"], trace["breakers"], trace.get("proc"))
+
+    def to_dict(self):
+        return {"query": self.query, "num_join": self.num_join, "num_groupby": self.num_groupby,
+                "input_cardinality": self.input_cardinality, "runtime": self.runtime,
+                "breakers": self.breakers, "proc": self.proc}
+
+    def breaker_latency(self, breaker, write_speed, read_speed):
+        size = breaker["persistence_size"]
+        return (breaker.get("suspend_latency", size / write_speed),
+                breaker.get("resume_latency", size / read_speed))
+
+    def proc_latency(self, suspension_points, proc_estimator):
+        # the measured checkpoints between the samples, the estimator if the trace has none
+        if len(self.proc) == 0:
+            features = [self.num_join, self.num_groupby, self.input_cardinality, suspension_points]
+            return (proc_estimator.suspend_latency_estimation(*features),
+                    proc_estimator.resume_latency_estimation(*features))
+        times = [p["time"] for p in self.proc]
+        return (np.interp(suspension_points, times, [p["suspend_latency"] for p in self.proc]),
+                np.interp(suspension_points, times, [p["resume_latency"] for p in self.proc]))
+
+
+def load_traces(trace_file):
+    with open(trace_file) as fp:
+        return [QueryTrace.from_dict(json.loads(line)) for line in fp if line.strip()]
+
+
+def trace_from_logs(benchmark, query, num_join, num_groupby, input_card, timing_records, criu_metrics=None):
+    # The runners log the plain run (runtime) and every pipeline-level suspend and resume, and
+    # `criu_driver.py perf` logs one line per process-level suspension
+    runtime, breakers, last_suspend = None, dict(), dict()
+    for r in timing_records:
+        if r["query"] != query:
+            continue
+        if r["op"] == "query":
+            runtime = r["call_time"]
+        elif r["op"] == "suspend" and "suspend_point" in r:
+            if not is_valid_suspend(r):
+                last_suspend.pop(r["location"], None)
+                continue
+            breaker = {"time": r["suspend_point"], "persistence_size": r["persistence_size"],
+                       "suspend_latency": r["call_time"] - r["suspend_point"]}
+            breakers[r["suspend_point"]] = breaker
+            last_suspend[r["location"]] = (r, breaker)
+        elif r["op"] == "resume" and r.get("location") in last_suspend and runtime is not None:
+            suspend, breaker = last_suspend[r["location"]]
+            if is_valid_resume(r, suspend):
+                breaker["resume_latency"] = r["call_time"] - (runtime - breaker["time"])
+    if runtime is None:
+        raise ValueError(f"No plain run of {query} in the timing log")
+
+    proc = list()
+    for m in criu_metrics if criu_metrics is not None else list():
+        # later suspensions of a run are incremental and restart from a resumed process
+        if m.get("suspension") != 0 or m.get("stop_time") is None:
+            continue
+        proc.append({"time": m["stop_time"], "image_size": m["write_bytes"],
+                     "suspend_latency": m["checkpoint_ns"] / 1e9,
+                     "resume_latency": ((m.get("decompress_ns") or 0) + m["restore_ns"]) / 1e9})
+
+    # named like the query templates of the estimator
+    return QueryTrace(f"{benchmark}-{query}", num_join, num_groupby, input_card, runtime, list(breakers.values()), proc)
+
+
+def sample_term_windows(rng, num_samples, runtime, window_width, term_prob):
+    # The windows start anywhere in the execution, and the termination point inside a window is
+    # drawn the same way as observe_term_point, np.inf if the query is not terminated
+    term_start = rng.uniform(0, runtime, num_samples)
+    term_end = term_start + window_width
+    term_point = np.round(rng.uniform(term_start, term_end))
+    if term_prob != 1:
+        term_point = np.where(rng.random(num_samples) > term_prob, term_point, np.inf)
+    return term_start, term_end, term_point
+
+
+def current_term_prob(term_end, current_time, term_prob):
+    # get_current_term_prob over arrays
+    if term_prob == 1:
+        return (term_end - current_time) / term_end
+    return np.full(np.shape(term_end), term_prob, dtype=float)
+
+
+def vectorized_decisions(current_exec_time, ppl_suspend, ppl_resume, proc_estimator, trace,
+                         term_start, term_end, term_prob, time_unit):
+    # decide_strategy for every window at once, the process-level curve is one row per window
+    ctp = current_term_prob(term_end, current_exec_time, term_prob)
+    cost_redo = ctp * current_exec_time
+    cost_ppl = ppl_suspend + ppl_resume + np.where(current_exec_time + ppl_suspend > term_start, ctp, 0) * current_exec_time
+
+    num_probes = np.where(current_exec_time <= term_end, np.floor((term_end - current_exec_time) / time_unit) + 1, 0)
+    num_probes = num_probes.astype(int)
+    points = current_exec_time + np.arange(max(num_probes.max(initial=0), 1)) * time_unit
+    features = [trace.num_join, trace.num_groupby, trace.input_cardinality, points]
+    proc_suspend = proc_estimator.suspend_latency_estimation(*features)
+    proc_resume = proc_estimator.resume_latency_estimation(*features)
+
+    prob_proc_term = np.where(current_exec_time + proc_suspend[None, :] > term_start[:, None], ctp[:, None], 0)
+    proc_costs = proc_suspend + proc_resume + prob_proc_term * points
+    proc_costs = np.where(np.arange(len(points))[None, :] < num_probes[:, None], proc_costs, np.inf)
+    best_probe = np.argmin(proc_costs, axis=1)
+    cost_proc = proc_costs[np.arange(len(term_start)), best_probe]
+
+    # the first cheapest strategy wins a tie, as in decide_strategy
+    strategy = STRATEGY_CODES[np.argmin(np.column_stack([cost_redo, cost_proc, cost_ppl]), axis=1)]
+    return strategy, points[best_probe]
+
+
+def realized_overhead(trace, strategy, suspension_point, term_point, breaker_time, breaker_suspend,
+                      breaker_resume, proc_estimator):
+    # The time lost against an uninterrupted run: a terminated query loses everything it did unless its
+    # suspension was persisted before the termination, and a persisted suspension costs its suspend and
+    # resume latency. A query that finishes before the termination (or the dump) loses nothing.
+    terminated = term_point < trace.runtime
+
+    redo = np.where(terminated, term_point, 0.0)
+
+    ppl_persisted = breaker_time + breaker_suspend <= term_point
+    ppl = np.where(ppl_persisted, breaker_suspend + breaker_resume, redo)
+
+    proc_suspend, proc_resume = trace.proc_latency(suspension_point, proc_estimator)
+    proc_persisted = suspension_point + proc_suspend <= term_point
+    proc = np.where(suspension_point >= trace.runtime, redo,
+                    np.where(proc_persisted, proc_suspend + proc_resume, redo))
+
+    return np.select([strategy == STRATEGY_PIPELINE, strategy == STRATEGY_PROCESS], [ppl, proc], redo)
+
+
+def oracle_overhead(trace, term_point, breaker_time, breaker_suspend, breaker_resume, proc_estimator, time_unit):
+    # the best strategy knowing the termination point, over every process-level point after the breaker
+    num_samples = len(term_point)
+    points = np.arange(breaker_time, trace.runtime + time_unit, time_unit)
+    candidates = [realized_overhead(trace, np.full(num_samples, s), np.full(num_samples, breaker_time), term_point,
+                                    breaker_time, breaker_suspend, breaker_resume, proc_estimator)
+                  for s in [STRATEGY_REDO, STRATEGY_PIPELINE]]
+
+    proc_suspend, proc_resume = trace.proc_latency(points, proc_estimator)
+    persisted = points[None, :] + proc_suspend[None, :] <= term_point[:, None]
+    redo = np.where(term_point < trace.runtime, term_point, 0.0)
+    proc = np.where(persisted, (proc_suspend + proc_resume)[None, :], redo[:, None])
+    candidates.append(proc.min(axis=1))
+    return np.min(candidates, axis=0)
+
+
+def simulate_trace(trace, proc_estimator, num_samples=10000, window_width=20.0, term_prob=1.0, time_unit=1,
+                   write_speed=RAND_WRITE_SPEED, read_speed=RAND_READ_SPEED, suspend_io_model=None,
+                   resume_io_model=None, num_timed_decisions=100, seed=0):
+    rng = np.random.default_rng(seed)
+    term_start, term_end, term_point = sample_term_windows(rng, num_samples, trace.runtime, window_width, term_prob)
+
+    # demo_e2e decides once, at the first pipeline breaker, with the state size it reports
+    breaker = trace.breakers[0]
+    breaker_time = breaker["time"]
+    breaker_suspend, breaker_resume = trace.breaker_latency(breaker, write_speed, read_speed)
+    ppl_estimator = PipelineLatencyEstimator(breaker["persistence_size"], write_speed, read_speed,
+                                             suspend_io_model, resume_io_model)
+    ppl_suspend, ppl_resume = ppl_estimator.suspend_latency_estimation(), ppl_estimator.resume_latency_estimation()
+    proc_estimator.query_template = trace.query
+
+    simulation_start = time.perf_counter()
+    strategy, suspension_point = vectorized_decisions(breaker_time, ppl_suspend, ppl_resume, proc_estimator, trace,
+                                                      term_start, term_end, term_prob, time_unit)
+    # the query is already gone if the termination comes before the first breaker
+    strategy = np.where(term_point < breaker_time, STRATEGY_REDO, strategy)
+    overhead = realized_overhead(trace, strategy, suspension_point, term_point, breaker_time, breaker_suspend,
+                                 breaker_resume, proc_estimator)
+    oracle = oracle_overhead(trace, term_point, breaker_time, breaker_suspend, breaker_resume, proc_estimator,
+                             time_unit)
+    simulation_time = time.perf_counter() - simulation_start
+
+    # the latency of the decision itself, as demo_e2e makes it
+    num_timed_decisions = min(num_timed_decisions, num_samples)
+    decision_start = time.perf_counter()
+    for i in range(num_timed_decisions):
+        decide_strategy(proc_estimator, ppl_estimator, trace.num_join, trace.num_groupby, trace.input_cardinality,
+                        breaker_time, term_start[i], term_end[i], term_prob, time_unit)
+    decision_latency = (time.perf_counter() - decision_start) / max(num_timed_decisions, 1)
+
+    return {"query": trace.query, "window_width": window_width, "term_prob": term_prob,
+            "num_samples": num_samples, "runtime": trace.runtime,
+            "expected_cost": float(trace.runtime + overhead.mean()),
+            "expected_overhead": float(overhead.mean()),
+            "oracle_overhead": float(oracle.mean()),
+            "regret": float((overhead - oracle).mean()),
+            "strategy_share": {int(s): float(np.mean(strategy == s)) for s in STRATEGY_CODES},
+            "decision_latency": decision_latency,
+            "simulation_time": simulation_time}
+
+
+def print_results(results):
+    print(f"{'Query':<14}{'Width':>7}{'Prob':>6}{'Cost (s)':>10}{'Overhead':>10}{'Oracle':>10}{'Regret':>9}"
+          f"{'Redo/Proc/Ppl':>18}{'Decision (ms)':>15}")
+    for r in results:
+        share = "/".join(f"{r['strategy_share'][s]:.2f}" for s in STRATEGY_CODES)
+        print(f"{r['query']:<14}{r['window_width']:>7.1f}{r['term_prob']:>6.2f}{r['expected_cost']:>10.2f}"
+              f"{r['expected_overhead']:>10.2f}{r['oracle_overhead']:>10.2f}{r['regret']:>9.2f}"
+              f"{share:>18}{r['decision_latency'] * 1e3:>15.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="replay random termination windows against the traces")
+    run_parser.add_argument("-t", "--traces", type=str, action="store", required=True,
+                            help="indicate the trace file, one JSON line per query")
+    run_parser.add_argument("-ef", "--estimation_file", type=str, action="store", required=True,
+                            help="indicate the file stored historical data for estimation")
+    run_parser.add_argument("-pm", "--persistence_model", type=str, action="store",
+                            help="indicate the persistence-size model family, or cv to select it by cross-validation")
+    run_parser.add_argument("-tl", "--timing_log", type=str, action="store",
+                            help="indicate the timing log to calibrate the I/O latency models")
+    run_parser.add_argument("-ns", "--num_samples", type=int, action="store", default=10000,
+                            help="indicate the number of termination windows per query and setting")
+    run_parser.add_argument("-tw", "--window_width", type=float, action="store", nargs="+", default=[20.0],
+                            help="indicate the widths (second) of the termination windows to sweep")
+    run_parser.add_argument("-tp", "--termination_prob", type=float, action="store", nargs="+", default=[1.0],
+                            help="indicate the termination probabilities to sweep")
+    run_parser.add_argument("-tu", "--time_unit", type=int, action="store", default=1,
+                            help="indicate the time unit for moving forward when estimating latency for proc-level")
+    run_parser.add_argument("-s", "--seed", type=int, action="store", default=0,
+                            help="indicate the random seed of the termination windows")
+    run_parser.add_argument("-o", "--output", type=str, action="store",
+                            help="indicate the file to append the JSON results to")
+
+    build_parser = subparsers.add_parser("build", help="build the trace of one query from the runner logs")
+    build_parser.add_argument("-b", "--benchmark", type=str, action="store", required=True,
+                              choices=["vanilla", "tpch", "tpcds"],
+                              help="indicate the benchmark of the query")
+    build_parser.add_argument("-q", "--query_id", type=str, action="store", required=True,
+                              help="indicate the query id in the timing log")
+    build_parser.add_argument("-tl", "--timing_log", type=str, action="store", required=True,
+                              help="indicate the timing log written by the runners")
+    build_parser.add_argument("-cm", "--criu_metrics", type=str, action="store",
+                              help="indicate the JSON metrics of `criu_driver.py perf` for the same query")
+    build_parser.add_argument("-nj", "--number_join", type=int, action="store", required=True,
+                              help="indicate the number of joins in the query")
+    build_parser.add_argument("-ng", "--number_groupby", type=int, action="store", required=True,
+                              help="indicate the number of group-bys in the query")
+    build_parser.add_argument("-ic", "--input_cardinality", type=int, action="store", required=True,
+                              help="indicate the input cardinality of the query")
+    build_parser.add_argument("-o", "--output", type=str, action="store", required=True,
+                              help="indicate the trace file to append to")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        criu_metrics = load_timing_records(args.criu_metrics) if args.criu_metrics is not None else None
+        trace = trace_from_logs(args.benchmark, args.query_id, args.number_join, args.number_groupby, args.input_cardinality,
+                                load_timing_records(args.timing_log), criu_metrics)
+        with open(args.output, "a") as fp:
+            fp.write(json.dumps(trace.to_dict()) + "\n")
+        print(f"{trace.query}: {len(trace.breakers)} pipeline breakers, {len(trace.proc)} checkpoints, "
+              f"runtime {trace.runtime:.3f}s")
+        return
+
+    proc_estimator = load_proc_estimator(args.estimation_file, args.persistence_model)
+    suspend_io_model, resume_io_model = None, None
+    if args.timing_log is not None:
+        suspend_io_model, resume_io_model = calibrate_io_models(args.timing_log)
+
+    results = list()
+    for trace in load_traces(args.traces):
+        for window_width, term_prob in itertools.product(args.window_width, args.termination_prob):
+            results.append(simulate_trace(trace, proc_estimator, args.num_samples, window_width, term_prob,
+                                          args.time_unit, suspend_io_model=suspend_io_model,
+                                          resume_io_model=resume_io_model, seed=args.seed))
+    print_results(results)
+
+    if args.output is not None:
+        with open(args.output, "a") as fp:
+            for r in results:
+                fp.write(json.dumps(r) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import glob
+import json
+import os
+import random
+
+
+def persisted_files(location, partitioned):
+    # partitioned suspension writes part-*.ratchet files into the location folder
+    if partitioned:
+        return sorted(glob.glob(os.path.join(location, "part-*.ratchet")))
+    return [location] if os.path.exists(location) else []
+
+
+def draw_suspend_point(suspend_start_time, suspend_end_time):
+    # The runners draw the point from [st, se] themselves and pass it to Ratchet as a window of zero width,
+    # so the point the query was suspended at is known and logged
+    return random.uniform(suspend_start_time, suspend_end_time)
+
+
+def append_timing_record(timing_log, qid, op, thread, call_time, suspend_point=None,
+                         location=None, partitioned=False, table_mode=None, setup_time=None, call_start_time=None):
+    # One json line per run, so the suspend/resume latency model can be calibrated from real runs.
+    # call_start_time is the wall-clock time (time.time()) the call started.
+    record = {"query": qid, "op": op, "thread": thread, "call_time": call_time}
+    if table_mode is not None:
+        # how the tables were set up (table, view or mixed) and how long it took before the query
+        record.update({"table_mode": table_mode, "setup_time": setup_time})
+    if location is not None:
+        files = persisted_files(location, partitioned)
+        if op == "suspend" and call_start_time is not None:
+            # files left in the location by an earlier run are not the state of this one
+            files = [f for f in files if os.path.getmtime(f) >= call_start_time]
+        record.update({"location": os.path.abspath(location),
+                       "partitioned": partitioned,
+                       "persistence_size": sum(os.path.getsize(f) for f in files),
+                       "num_files": len(files),
+                       # partitioned files are written/read by the query threads in parallel
+                       "parallelism": min(len(files), thread) if partitioned else 1,
+                       # identifies the state a resume read, see is_valid_resume()
+                       "persisted_mtime": max((os.path.getmtime(f) for f in files), default=None)})
+        if op == "suspend":
+            record["suspended"] = len(files) > 0
+    if suspend_point is not None:
+        record["suspend_point"] = suspend_point
+
+    with open(timing_log, "a") as fp:
+        fp.write(json.dumps(record) + "\n")
+
+
+def load_timing_records(timing_log):
+    with open(timing_log) as fp:
+        return [json.loads(line) for line in fp if line.strip()]
+
+
+def is_valid_suspend(record):
+    # The query may finish before the suspension point, then nothing is persisted by the run
+    return ("suspend_point" in record and record.get("suspended", True)
+            and record["call_time"] >= record["suspend_point"])
+
+
+def is_valid_resume(record, suspend):
+    # The resume must read the state written by the last (valid) suspension into the location, not a stale
+    # one left by an earlier run or overwritten since. Older records without the mtime are trusted.
+    if suspend is None:
+        return False
+    if record.get("persisted_mtime") is None or suspend.get("persisted_mtime") is None:
+        return True
+    return record["persisted_mtime"] == suspend["persisted_mtime"]
+
+
+def latency_samples(records):
+    # The runners only time the whole call, so the I/O latency is what is left after the query work:
+    #   suspend: call time - suspension point
+    #   resume: call time - (runtime of a plain run - suspension point)
+    baseline = dict()
+    last_suspend = dict()
+    samples = {"suspend": list(), "resume": list()}
+
+    for r in records:
+        if r["op"] == "query":
+            baseline[(r["query"], r["thread"])] = r["call_time"]
+        elif r["op"] == "suspend" and "suspend_point" in r:
+            if not is_valid_suspend(r):
+                # a resume from this location would read the state of some earlier run
+                last_suspend.pop(r["location"], None)
+                continue
+            last_suspend[r["location"]] = r
+            samples["suspend"].append((r["persistence_size"], r["num_files"], r["parallelism"],
+                                       r["call_time"] - r["suspend_point"]))
+        elif r["op"] == "resume":
+            suspend = last_suspend.get(r["location"])
+            runtime = baseline.get((r["query"], r["thread"]))
+            if is_valid_resume(r, suspend) and runtime is not None:
+                samples["resume"].append((suspend["persistence_size"], suspend["num_files"], suspend["parallelism"],
+                                          r["call_time"] - (runtime - suspend["suspend_point"])))
+
+    return samples
+
+
+def calibrate_io_models(timing_log):
+    # imported here so that the runners only writing records do not load the cost model
+    from cost_model import IOLatencyModel
+
+    samples = latency_samples(load_timing_records(timing_log))
+    io_models = dict()
+    for op in ["suspend", "resume"]:
+        if len(samples[op]) < 3:
+            io_models[op] = None
+        else:
+            io_models[op] = IOLatencyModel().fit(*zip(*samples[op]))
+    return io_models["suspend"], io_models["resume"]
@@ -0,0 +1,307 @@
+import argparse
+import time
+import numpy as np
+
+from riveter import STRATEGY_REDO, STRATEGY_PIPELINE, STRATEGY_PROCESS, get_current_term_prob
+
+STRATEGY_NAMES = {STRATEGY_REDO: "redo", STRATEGY_PIPELINE: "pipeline", STRATEGY_PROCESS: "process"}
+DEFAULT_DEVICE = "default"
+
+
+class SuspensionOption:
+    # The latencies are estimated with the full bandwidth of the device the state is written to
+    def __init__(self, strategy, suspend_latency=0.0, resume_latency=0.0, state_size=0, device=DEFAULT_DEVICE):
+        self.strategy = strategy
+        self.suspend_latency = suspend_latency
+        self.resume_latency = resume_latency
+        self.state_size = state_size
+        self.device = device
+
+
+def free_at(device_free, device):
+    # when each device is free, one time for every device or a dict with the time of each device, on the
+    # clock of the deadlines (e.g., absolute perf_counter times in the daemon)
+    if isinstance(device_free, dict):
+        return device_free.get(device, 0.0)
+    return device_free
+
+
+class SuspensionCandidate:
+    def __init__(self, query_id, current_exec_time, term_prob, deadline, options):
+        self.query_id = query_id
+        # the work done so far, which is lost if the query is terminated without a suspension
+        self.current_exec_time = current_exec_time
+        self.term_prob = term_prob
+        # when the suspension has to be persisted, e.g., the start of the termination window, as an absolute
+        # time on the caller's clock (the daemon passes perf_counter times), the same clock as device_free
+        self.deadline = deadline
+        self.options = [o for o in options if o.strategy != STRATEGY_REDO]
+
+    def saved_work(self, option):
+        # the expected redo cost avoided, minus the time spent on suspending and resuming
+        return self.term_prob * self.current_exec_time - option.suspend_latency - option.resume_latency
+
+
+class SuspensionPlan:
+    def __init__(self, policy, candidates, assignments, order, sequential=True, device_free=0.0):
+        self.policy = policy
+        self.candidates = {c.query_id: c for c in candidates}
+        # query_id -> the chosen option, the queries without an entry are redone
+        self.assignments = assignments
+        # the order of the suspensions, each device writes the suspensions assigned to it in this order
+        self.order = order
+        # sequential suspensions use the full bandwidth one after the other, otherwise they share it evenly
+        self.sequential = sequential
+        self.device_free = device_free
+        self.decision_latency = None
+
+    def strategy(self, query_id):
+        option = self.assignments.get(query_id)
+        return option.strategy if option is not None else STRATEGY_REDO
+
+    def devices(self):
+        return sorted({option.device for option in self.assignments.values()})
+
+    def completion_times(self):
+        # when each suspension is persisted, as absolute times on the clock of device_free and the deadlines,
+        # every device has its own timeline
+        completions = dict()
+        for device in self.devices():
+            order = [q for q in self.order if self.assignments[q].device == device]
+            works = [self.assignments[q].suspend_latency for q in order]
+            if self.sequential:
+                completions.update(zip(order, free_at(self.device_free, device) + np.cumsum(works)))
+                continue
+
+            # processor sharing: the n unfinished suspensions progress at 1/n of the bandwidth each
+            now, done, remaining = free_at(self.device_free, device), 0.0, len(works)
+            for query_id, work in sorted(zip(order, works), key=lambda qw: qw[1]):
+                now += (work - done) * remaining
+                done = work
+                remaining -= 1
+                completions[query_id] = now
+        return completions
+
+    def start_times(self):
+        # when each suspension starts writing at full bandwidth, as absolute times on the clock of device_free,
+        # only for sequential plans
+        completions = self.completion_times()
+        return {q: completions[q] - self.assignments[q].suspend_latency for q in completions}
+
+    def realized_saved_work(self):
+        # a suspension that misses its deadline saves nothing, and its suspension time is wasted
+        saved = 0.0
+        for query_id, completion in self.completion_times().items():
+            candidate, option = self.candidates[query_id], self.assignments[query_id]
+            if completion <= candidate.deadline:
+                saved += candidate.saved_work(option)
+            else:
+                saved -= option.suspend_latency
+        return saved
+
+
+def edd_order(assignments, candidates):
+    # earliest deadline first is the feasible order whenever any order is
+    deadlines = {c.query_id: c.deadline for c in candidates}
+    return sorted(assignments, key=lambda q: deadlines[q])
+
+
+def is_feasible(assignments, candidates, device_free=0.0):
+    deadlines = {c.query_id: c.deadline for c in candidates}
+    completions = dict()
+    for query_id in edd_order(assignments, candidates):
+        option = assignments[query_id]
+        completion = completions.get(option.device, free_at(device_free, option.device)) + option.suspend_latency
+        if completion > deadlines[query_id]:
+            return False
+        completions[option.device] = completion
+    return True
+
+
+def schedule_independent(candidates, device_free=0.0, share=1):
+    # Every query decides on its own as if it had 1/share of the bandwidth, which is what a single
+    # decision per query does, and the suspensions then contend for the device
+    assignments = dict()
+    for candidate in candidates:
+        best_option, best_saved = None, 0.0
+        for option in candidate.options:
+            if free_at(device_free, option.device) + option.suspend_latency * share <= candidate.deadline:
+                saved = candidate.saved_work(option) - (share - 1) * option.suspend_latency
+                if saved > best_saved:
+                    best_option, best_saved = option, saved
+        if best_option is not None:
+            assignments[candidate.query_id] = best_option
+    policy = "independent" if share == 1 else "even-split"
+    return SuspensionPlan(policy, candidates, assignments, list(assignments), sequential=False, device_free=device_free)
+
+
+def schedule_even_split(candidates, device_free=0.0):
+    return schedule_independent(candidates, device_free, share=max(len(candidates), 1))
+
+
+def schedule_greedy(candidates, device_free=0.0):
+    # Take (query, option) pairs by saved work per second of device time, as long as all chosen
+    # suspensions still meet their deadlines in EDD order
+    pairs = [(c.saved_work(o) / max(o.suspend_latency, 1e-9), c, o)
+             for c in candidates for o in c.options if c.saved_work(o) > 0]
+    pairs.sort(key=lambda p: p[0], reverse=True)
+
+    assignments = dict()
+    for _, candidate, option in pairs:
+        if candidate.query_id in assignments:
+            continue
+        assignments[candidate.query_id] = option
+        if not is_feasible(assignments, candidates, device_free):
+            del assignments[candidate.query_id]
+    return SuspensionPlan("greedy", candidates, assignments, edd_order(assignments, candidates),
+                          device_free=device_free)
+
+
+def schedule_knapsack(candidates, device_free=0.0, resolution=0.01, max_states=1 << 16):
+    # Multiple-choice knapsack over the device time: in EDD order, each query is redone or takes one of
+    # its options, and a chosen suspension has to complete on its device before its deadline. The time of
+    # every device is discretized by `resolution` seconds (rounded up, so a plan is never infeasible),
+    # which is coarsened with several devices, so the table has at most `max_states` entries.
+    ordered = sorted(candidates, key=lambda c: c.deadline)
+    devices = sorted({o.device for c in ordered for o in c.options})
+    last_deadline = max([c.deadline for c in ordered] + [0.0])
+    horizons = [last_deadline - free_at(device_free, d) for d in devices]
+    if len(devices) == 0 or max(horizons) < 0:
+        return SuspensionPlan("knapsack", candidates, dict(), list(), device_free=device_free)
+    resolution = max(resolution, max(horizons) / max(max_states ** (1 / len(devices)) - 1, 1))
+    shape = tuple(max(int(np.floor(h / resolution)) + 1, 1) for h in horizons)
+
+    def weight(option):
+        return int(np.ceil(option.suspend_latency / resolution))
+
+    # best[t]: the most saved work with exactly t[d] slots of time used on each device d
+    best = np.full(shape, -np.inf)
+    best[(0,) * len(devices)] = 0.0
+    choices = list()
+    for candidate in ordered:
+        new_best = best.copy()
+        choice = np.full(shape, -1)
+        for i, option in enumerate(candidate.options):
+            axis = devices.index(option.device)
+            saved = candidate.saved_work(option)
+            limit = int(np.floor((candidate.deadline - free_at(device_free, option.device)) / resolution))
+            if saved <= 0 or weight(option) > limit:
+                continue
+            # only completions up to the deadline of this query are allowed, on the device of the option
+            source, target = [slice(None)] * len(devices), [slice(None)] * len(devices)
+            source[axis], target[axis] = slice(0, limit + 1 - weight(option)), slice(weight(option), limit + 1)
+            shifted = np.full(shape, -np.inf)
+            shifted[tuple(target)] = best[tuple(source)] + saved
+            improved = shifted > new_best
+            new_best[improved] = shifted[improved]
+            choice[improved] = i
+        best = new_best
+        choices.append(choice)
+
+    # walk back from the best end state
+    t = list(np.unravel_index(np.argmax(best), shape))
+    assignments = dict()
+    for candidate, choice in zip(reversed(ordered), reversed(choices)):
+        i = choice[tuple(t)]
+        if i >= 0:
+            option = candidate.options[i]
+            assignments[candidate.query_id] = option
+            t[devices.index(option.device)] -= weight(option)
+    return SuspensionPlan("knapsack", candidates, assignments, edd_order(assignments, candidates),
+                          device_free=device_free)
+
+
+SCHEDULE_POLICIES = {
+    "independent": schedule_independent,
+    "even-split": schedule_even_split,
+    "greedy": schedule_greedy,
+    "knapsack": schedule_knapsack,
+}
+
+
+def schedule(candidates, policy="knapsack", device_free=0.0):
+    decision_start = time.perf_counter()
+    plan = SCHEDULE_POLICIES[policy](candidates, device_free)
+    plan.decision_latency = time.perf_counter() - decision_start
+    return plan
+
+
+def random_candidates(rng, num_queries, write_speed, read_speed, term_start, term_end, term_prob=1.0,
+                      separate_devices=False):
+    # A workload snapshot at a preemption signal: queries at random points of their execution, with
+    # state sizes up to a few times the data the device writes in one second
+    candidates = list()
+    for q in range(num_queries):
+        current_exec_time = rng.uniform(1, term_end)
+        ppl_size = rng.lognormal(np.log(write_speed), 1.0)
+        # the process image also holds the buffers and the loaded tables
+        proc_size = ppl_size * rng.uniform(1.5, 4.0)
+        proc_device = "ckpt" if separate_devices else DEFAULT_DEVICE
+        options = [SuspensionOption(STRATEGY_PIPELINE, ppl_size / write_speed, ppl_size / read_speed, ppl_size),
+                   SuspensionOption(STRATEGY_PROCESS, proc_size / write_speed, proc_size / read_speed, proc_size,
+                                    proc_device)]
+        # the window is on the execution timeline as in the daemon: persisted before it opens,
+        # or before it closes once the query is already inside it
+        deadline = (term_start if current_exec_time < term_start else term_end) - current_exec_time
+        candidates.append(SuspensionCandidate(f"q{q}", current_exec_time,
+                                              get_current_term_prob(term_end, current_exec_time, term_prob),
+                                              deadline, options))
+    return candidates
+
+
+def simulate(num_trials=1000, num_queries=8, write_speed=2500, read_speed=2500, term_start=10.0, term_end=30.0,
+             policies=None, seed=0, separate_devices=False):
+    rng = np.random.default_rng(seed)
+    policies = policies if policies is not None else list(SCHEDULE_POLICIES)
+
+    results = {p: {"saved": list(), "suspended": list(), "missed": list(), "latency": list()} for p in policies}
+    for _ in range(num_trials):
+        candidates = random_candidates(rng, num_queries, write_speed, read_speed, term_start, term_end,
+                                       separate_devices=separate_devices)
+        for policy in policies:
+            plan = schedule(candidates, policy)
+            completions = plan.completion_times()
+            results[policy]["saved"].append(plan.realized_saved_work())
+            results[policy]["suspended"].append(len(plan.assignments))
+            results[policy]["missed"].append(sum(completions[q] > plan.candidates[q].deadline for q in completions))
+            results[policy]["latency"].append(plan.decision_latency)
+    return results
+
+
+def print_simulation(results):
+    print(f"{'Policy':<14}{'Saved Work (s)':>16}{'Suspended':>12}{'Missed':>10}{'Decision (ms)':>16}")
+    for policy, r in results.items():
+        print(f"{policy:<14}{np.mean(r['saved']):>16.2f}{np.mean(r['suspended']):>12.2f}"
+              f"{np.mean(r['missed']):>10.2f}{np.mean(r['latency']) * 1e3:>16.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-nt", "--num_trials", type=int, action="store", default=1000,
+                        help="indicate the number of simulated preemption signals")
+    parser.add_argument("-nq", "--num_queries", type=int, action="store", default=8,
+                        help="indicate the number of in-flight queries at each signal")
+    parser.add_argument("-ws", "--write_speed", type=float, action="store", default=2500,
+                        help="indicate the write speed of the shared persistence device")
+    parser.add_argument("-rs", "--read_speed", type=float, action="store", default=2500,
+                        help="indicate the read speed of the shared persistence device")
+    parser.add_argument("-ts", "--termination_start", type=float, action="store", default=10.0,
+                        help="indicate the start of the termination window in the execution of the queries (second)")
+    parser.add_argument("-te", "--termination_end", type=float, action="store", default=30.0,
+                        help="indicate the end of the termination window in the execution of the queries (second)")
+    parser.add_argument("-sdv", "--separate_devices", action="store_true", default=False,
+                        help="indicate that the process images are written to another device than the pipeline states")
+    parser.add_argument("-p", "--policies", type=str, action="store", nargs="+",
+                        choices=list(SCHEDULE_POLICIES),
+                        help="indicate the policies to compare, all of them by default")
+    parser.add_argument("-s", "--seed", type=int, action="store", default=0,
+                        help="indicate the random seed of the workloads")
+    args = parser.parse_args()
+
+    results = simulate(args.num_trials, args.num_queries, args.write_speed, args.read_speed,
+                       args.termination_start, args.termination_end, args.policies, args.seed, args.separate_devices)
+    print_simulation(results)
+
+
+if __name__ == "__main__":
+    main()
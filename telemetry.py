@@ -0,0 +1,200 @@
+import argparse
+import ctypes
+import os
+import threading
+import time
+import numpy as np
+import sysv_ipc
+
+from pathlib import Path
+from shm_channel import IPC_NAMESPACE_ENV, Backoff, attach_shared_memory, get_ipc_key, namespaced_keyfile
+
+# Ring buffer of per-pipeline records published by Ratchet, namespaced like the other keyfiles
+SHM_TELEMETRY_KEYFILE = "/tmp/shm_telemetry_keyfile"
+TELEMETRY_CAPACITY = 4096
+
+# Match the layout with the C++ program:
+#   struct TelemetryHeader { uint64_t capacity; uint64_t record_size; uint64_t write_index; uint64_t reserved; };
+#   struct TelemetryRecord { uint32_t pipeline_id; uint16_t operator_type; uint16_t reserved;
+#                            uint64_t rows; uint64_t ht_bytes; uint64_t elapsed_ns; };
+# The producer writes the record at `write_index % capacity` and only then increments `write_index`,
+# so every index below `write_index` is complete unless the producer has lapped it since.
+TELEMETRY_HEADER_DTYPE = np.dtype([("capacity", "<u8"), ("record_size", "<u8"), ("write_index", "<u8"),
+                                   ("reserved", "<u8")])
+TELEMETRY_RECORD_DTYPE = np.dtype([("pipeline_id", "<u4"), ("operator_type", "<u2"), ("reserved", "<u2"),
+                                   ("rows", "<u8"), ("ht_bytes", "<u8"), ("elapsed_ns", "<u8")])
+WRITE_INDEX_OFFSET = TELEMETRY_HEADER_DTYPE.fields["write_index"][1]
+
+# The sink operator of the pipeline that produced the record
+OPERATOR_TYPES = {
+    0: "UNKNOWN",
+    1: "HASH_JOIN",
+    2: "HASH_GROUP_BY",
+    3: "PERFECT_HASH_GROUP_BY",
+    4: "UNGROUPED_AGGREGATE",
+    5: "ORDER_BY",
+    6: "TOP_N",
+    7: "WINDOW",
+    8: "RESULT_COLLECTOR",
+}
+
+
+def telemetry_size(capacity):
+    return TELEMETRY_HEADER_DTYPE.itemsize + capacity * TELEMETRY_RECORD_DTYPE.itemsize
+
+
+class TelemetryReader:
+    # Decodes the ring buffer in place: `records` is a structured array over the shared memory itself,
+    # and read() copies the new records out of it before checking whether the producer lapped them
+    def __init__(self, shm):
+        self.shm = shm
+        self.header = np.frombuffer(shm, dtype=TELEMETRY_HEADER_DTYPE, count=1)[0]
+        if self.header["record_size"] != TELEMETRY_RECORD_DTYPE.itemsize:
+            raise ValueError(f"Telemetry records are {self.header['record_size']} bytes, "
+                             f"expected {TELEMETRY_RECORD_DTYPE.itemsize}")
+        self.capacity = int(self.header["capacity"])
+        self.records = np.frombuffer(shm, dtype=TELEMETRY_RECORD_DTYPE, count=self.capacity,
+                                     offset=TELEMETRY_HEADER_DTYPE.itemsize)
+        self.read_index = 0
+        self.num_lost = 0
+
+    @staticmethod
+    def attach(namespace=None, timeout=None):
+        namespace = namespace if namespace is not None else os.environ.get(IPC_NAMESPACE_ENV)
+        return TelemetryReader(attach_shared_memory(namespaced_keyfile(SHM_TELEMETRY_KEYFILE, namespace), timeout))
+
+    def write_index(self):
+        return ctypes.c_uint64.from_buffer(self.shm, WRITE_INDEX_OFFSET).value
+
+    def read(self, copy=True):
+        # All records published since the last read, oldest first. Records the producer has lapped
+        # (before or while they were copied) are dropped and counted in num_lost.
+        # With copy=False, the records are a view into the ring unless they wrap around its end. The view
+        # is only checked once, when read() returns: the producer overwrites it without being counted
+        # after `capacity` more records, so it has to be consumed before that.
+        end = self.write_index()
+        start = max(self.read_index, end - self.capacity)
+        self.num_lost += start - self.read_index
+
+        first, last = start % self.capacity, end % self.capacity
+        if end - start == 0:
+            new_records = self.records[:0]
+        elif first < last:
+            new_records = self.records[first:last]
+        else:
+            new_records = np.concatenate([self.records[first:], self.records[:last]])
+        if copy and new_records.base is not None:
+            new_records = new_records.copy()
+
+        # Like a seqlock, the write index is read again after the copy: the records at indices up to
+        # `write_index - capacity` may have been overwritten (or be half written) while they were copied
+        overwritten = min(max(self.write_index() - self.capacity + 1 - start, 0), len(new_records))
+        self.num_lost += overwritten
+        self.read_index = end
+        return new_records[overwritten:]
+
+    def detach(self):
+        self.shm.detach()
+
+
+def state_size_curve(records):
+    # The total hash-table bytes over time, with the latest record of every pipeline counted once
+    order = np.argsort(records["elapsed_ns"], kind="stable")
+    latest = dict()
+    elapsed_ns, state_size = np.empty(len(order), dtype=np.uint64), np.empty(len(order), dtype=np.uint64)
+    for i, r in enumerate(records[order]):
+        latest[int(r["pipeline_id"])] = int(r["ht_bytes"])
+        elapsed_ns[i], state_size[i] = r["elapsed_ns"], sum(latest.values())
+    return elapsed_ns, state_size
+
+
+class LocalTelemetryWriter:
+    # A stand-in for the C++ side of Ratchet, which creates the ring buffer and publishes a record
+    # whenever a pipeline makes progress
+    def __init__(self, capacity=TELEMETRY_CAPACITY, keyfile=SHM_TELEMETRY_KEYFILE, namespace=None):
+        namespace = namespace if namespace is not None else os.environ.get(IPC_NAMESPACE_ENV)
+        keyfile = namespaced_keyfile(keyfile, namespace)
+        Path(keyfile).touch(exist_ok=True)
+        self.shm = sysv_ipc.SharedMemory(get_ipc_key(keyfile), sysv_ipc.IPC_CREAT, 0o666, telemetry_size(capacity))
+        self.shm.write(bytes(telemetry_size(capacity)))
+
+        header = np.zeros(1, dtype=TELEMETRY_HEADER_DTYPE)
+        header["capacity"], header["record_size"] = capacity, TELEMETRY_RECORD_DTYPE.itemsize
+        self.shm.write(header.tobytes())
+        self.capacity = capacity
+        self.write_index = 0
+        self.start_ns = time.perf_counter_ns()
+
+    def publish(self, pipeline_id, operator_type, rows, ht_bytes, elapsed_ns=None):
+        record = np.zeros(1, dtype=TELEMETRY_RECORD_DTYPE)
+        record["pipeline_id"], record["operator_type"] = pipeline_id, operator_type
+        record["rows"], record["ht_bytes"] = rows, ht_bytes
+        record["elapsed_ns"] = elapsed_ns if elapsed_ns is not None else time.perf_counter_ns() - self.start_ns
+
+        slot = self.write_index % self.capacity
+        self.shm.write(record.tobytes(), TELEMETRY_HEADER_DTYPE.itemsize + slot * TELEMETRY_RECORD_DTYPE.itemsize)
+        self.write_index += 1
+        self.shm.write(self.write_index.to_bytes(ctypes.sizeof(ctypes.c_uint64), byteorder='little'),
+                       WRITE_INDEX_OFFSET)
+
+    def remove(self):
+        self.shm.detach()
+        self.shm.remove()
+
+
+def simulate_query(writer, num_pipelines=4, num_records=1000, interval=0.0005):
+    # Hash joins build their tables pipeline by pipeline, the aggregate at the end grows with its input
+    operator_types = [1] * (num_pipelines - 1) + [2]
+    rows = np.zeros(num_pipelines, dtype=np.int64)
+    for i in range(num_records):
+        pipeline_id = min(i * num_pipelines // num_records, num_pipelines - 1)
+        rows[pipeline_id] += 2048
+        writer.publish(pipeline_id, operator_types[pipeline_id], int(rows[pipeline_id]), int(rows[pipeline_id]) * 48)
+        time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-ns", "--namespace", type=str, action="store",
+                        help="indicate the IPC namespace of the query, such as <slot0>")
+    parser.add_argument("-t", "--tail", action="store_true", default=False,
+                        help="attach to the ring buffer of a running query instead of the local stand-in")
+    parser.add_argument("-n", "--num_records", type=int, action="store", default=10000,
+                        help="indicate the number of records published by the local stand-in")
+    parser.add_argument("-c", "--capacity", type=int, action="store", default=TELEMETRY_CAPACITY,
+                        help="indicate the capacity of the ring buffer of the local stand-in")
+    parser.add_argument("-i", "--interval", type=float, action="store", default=0.1,
+                        help="indicate how often (second) to read the ring buffer")
+    args = parser.parse_args()
+
+    writer = None
+    if not args.tail:
+        writer = LocalTelemetryWriter(args.capacity, namespace=args.namespace)
+        producer = threading.Thread(target=simulate_query, args=(writer, 4, args.num_records), daemon=True)
+        producer.start()
+    reader = TelemetryReader.attach(args.namespace, timeout=60)
+
+    all_records = list()
+    backoff = Backoff(initial=args.interval, maximum=args.interval)
+    while True:
+        records = reader.read()
+        all_records.append(records)
+        for pipeline_id in np.unique(records["pipeline_id"]):
+            latest = records[records["pipeline_id"] == pipeline_id][-1]
+            print(f"Pipeline {pipeline_id} ({OPERATOR_TYPES.get(int(latest['operator_type']), 'UNKNOWN')}): "
+                  f"{latest['rows']} rows, {latest['ht_bytes']} bytes at {latest['elapsed_ns'] / 1e9:.3f}s")
+        if writer is not None and not producer.is_alive() and reader.read_index == writer.write_index:
+            break
+        backoff.sleep()
+
+    records = np.concatenate(all_records)
+    elapsed_ns, state_size = state_size_curve(records)
+    print(f"Read {len(records)} records, lost {reader.num_lost}, "
+          f"final state {state_size[-1] if len(state_size) > 0 else 0} bytes")
+    reader.detach()
+    if writer is not None:
+        writer.remove()
+
+
+if __name__ == "__main__":
+    main()
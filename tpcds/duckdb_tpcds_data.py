@@ -1,8 +1,37 @@
 import argparse
 import duckdb
-import pyarrow.parquet as pq
+import sys
+import time
 import table_schema as schema
 
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from conversion import (LAYOUTS, clear_parquet_output, clustered_query, clustering_keys, configure_memory,
+                        convert_hive_partitioned, convert_multi_file, convert_streaming, csv_source,
+                        is_multi_file, print_conversion_stats, print_parquet_stats, print_stats_coverage,
+                        source_files, table_columns)
+
+# Default clustering keys of the layouts, on the date keys most queries join with date_dim
+CLUSTERING_KEYS = {
+    "store_sales": ["ss_sold_date_sk"],
+    "catalog_sales": ["cs_sold_date_sk"],
+    "web_sales": ["ws_sold_date_sk"],
+    "store_returns": ["sr_returned_date_sk"],
+    "catalog_returns": ["cr_returned_date_sk"],
+    "web_returns": ["wr_returned_date_sk"],
+    "inventory": ["inv_date_sk"],
+}
+
+# Fact tables written Hive-partitioned with -hp: the date key joined with date_dim, and the prefix of
+# the derived <prefix>_year and <prefix>_moy partition columns
+PARTITIONED_TABLES = {
+    "store_sales": ("ss_sold_date_sk", "ss_sold"),
+    "catalog_sales": ("cs_sold_date_sk", "cs_sold"),
+    "web_sales": ("ws_sold_date_sk", "ws_sold"),
+    "inventory": ("inv_date_sk", "inv"),
+}
+
 
 def main():
     parser = argparse.ArgumentParser()
@@ -24,12 +53,40 @@ def main():
     parser.add_argument("-rgs", "--row_group_size", type=int, action="store",
                         help="indicate scale factor of the dataset, such as 100000")
     
+    parser.add_argument("-s", "--streaming", action="store_true", default=False,
+                        help="stream the dat files into the output without loading the tables into memory")
+    
+    parser.add_argument("-ml", "--memory_limit", type=str, action="store",
+                        help="indicate the memory limit of DuckDB during conversion, such as 4GB")
+    
+    parser.add_argument("-tmp", "--tmp_folder", type=str, action="store",
+                        help="indicate the folder DuckDB spills to beyond the memory limit")
+    
+    parser.add_argument("-nf", "--num_files", type=int, action="store", default=1,
+                        help="indicate the number of parquet files a large table is split into")
+    
+    parser.add_argument("-nw", "--num_workers", type=int, action="store", default=4,
+                        help="indicate the number of chunk files converted in parallel")
+    
+    parser.add_argument("-sth", "--split_threshold", type=int, action="store", default=1024,
+                        help="indicate the size (MB) from which a single source file is split, such as 1024")
+    
+    parser.add_argument("-l", "--layout", type=str, action="store", default="none", choices=LAYOUTS,
+                        help="indicate how the rows of a table are ordered before they are written")
+    
+    parser.add_argument("-ck", "--clustering_keys", type=str, action="store", nargs="+",
+                        help="override the clustering keys of tables, such as store_sales:ss_sold_date_sk,ss_item_sk")
+    
+    parser.add_argument("-hp", "--hive_partition", action="store_true", default=False,
+                        help="write the sales and inventory fact tables partitioned by the year and month of their date")
+    
     args = parser.parse_args()
 
     table_name = args.table_name
     data_folder = args.data_folder
     output_format = args.output_format
     row_group_size = args.row_group_size
+    streaming = args.streaming
 
     if output_format == "parquet" and row_group_size is None:
         raise ValueError("Please indicate row group size for parquet")
@@ -43,24 +100,58 @@ def main():
                       "reason", "ship_mode", "store", "store_returns", "store_sales", "time_dim", 
                       "warehouse", "web_page", "web_returns", "web_sales", "web_site"]
 
+    layout = args.layout
+    table_keys = clustering_keys(CLUSTERING_KEYS, args.clustering_keys)
+
     db_conn = duckdb.connect(database=':memory:')
+    configure_memory(db_conn, args.memory_limit, args.tmp_folder)
+
+    hive_partition = args.hive_partition and output_format == "parquet"
+    if hive_partition:
+        date_dim_columns = table_columns(db_conn, "date_dim", schema.date_dim)
+        date_source = csv_source(source_files(data_folder, "date_dim", "dat"), date_dim_columns)
 
     for table in table_list:
-        print(f"Convert {table}.dat to parquet...")
+        print(f"Convert {table}.dat to {output_format}...")
 
         table_schema = getattr(schema, table)
+        convert_start = time.perf_counter()
 
-        db_conn.execute(f"CREATE TABLE {table} {table_schema};")
+        keys = table_keys.get(table)
+        table_files = source_files(data_folder, table, "dat")
+        partitioned = hive_partition and table in PARTITIONED_TABLES
+        multi_file = partitioned or is_multi_file(table_files, output_format, args.num_files, args.split_threshold)
+        if output_format == "parquet":
+            clear_parquet_output(table)
+        if partitioned:
+            date_key, partition_prefix = PARTITIONED_TABLES[table]
+            convert_hive_partitioned(db_conn, table, table_schema, table_files, table, row_group_size,
+                                     date_key, date_source, partition_prefix, keys, layout)
+        elif multi_file:
+            # one parquet file per chunk of the source, or per thread of the COPY
+            convert_multi_file(db_conn, table, table_schema, table_files, table, row_group_size,
+                               args.num_files, args.num_workers, keys, layout)
+        elif streaming or len(table_files) > 1:
+            # peak memory is bounded by the memory limit instead of the size of the table
+            convert_streaming(db_conn, table, table_schema, table_files,
+                              f"{table}.{output_format}", output_format, row_group_size, keys, layout)
+        else:
+            db_conn.execute(f"CREATE TABLE {table} {table_schema};")
 
-        db_conn.execute(f"COPY {table} FROM '{data_folder}/{table}.dat' ( DELIMITER '|' );")
+            db_conn.execute(f"COPY {table} FROM '{table_files[0]}' ( DELIMITER '|' );")
 
-        if output_format == "parquet":
-            db_conn.execute(f"COPY {table} TO '{table}.parquet' (FORMAT 'parquet', ROW_GROUP_SIZE {row_group_size});")
-            parquet_file = pq.ParquetFile(f"{table}.parquet")
-            print("Number of row groups in {}.parquet: {}".format(table, parquet_file.num_row_groups))
-        elif output_format == "csv":
-            db_conn.execute(f"COPY {table} TO '{table}.csv' WITH (HEADER 1, DELIMITER ',');;")
+            if output_format == "parquet":
+                db_conn.execute(f"COPY ({clustered_query(table, keys, layout)}) TO '{table}.parquet' (FORMAT 'parquet', ROW_GROUP_SIZE {row_group_size});")
+            elif output_format == "csv":
+                db_conn.execute(f"COPY ({clustered_query(table, keys, layout)}) TO '{table}.csv' WITH (HEADER 1, DELIMITER ',');;")
 
+        print_conversion_stats(table, convert_start)
+
+        if output_format == "parquet":
+            parquet_output = table if multi_file else f"{table}.parquet"
+            print_parquet_stats(parquet_output)
+            if keys:
+                print_stats_coverage(db_conn, parquet_output, keys)
 
 if __name__ == "__main__":
     main()
@@ -1,6 +1,20 @@
 import argparse
 import duckdb
-import pyarrow.parquet as pq
+import sys
+import time
+
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from conversion import (LAYOUTS, clear_parquet_output, clustered_query, clustering_keys, configure_memory,
+                        convert_multi_file, convert_streaming, is_multi_file, print_conversion_stats,
+                        print_parquet_stats, print_stats_coverage, source_files)
+
+# Default clustering keys of the layouts, on the columns the date-range queries filter (q1, q3, q4, q6, ...)
+CLUSTERING_KEYS = {
+    "lineitem": ["L_SHIPDATE"],
+    "orders": ["O_ORDERDATE"],
+}
 
 
 def main():
@@ -14,12 +28,29 @@ def main():
                         help="indicate the output data format", choices=["csv", "parquet"])
     parser.add_argument("-rgs", "--row_group_size", type=int, action="store",
                         help="indicate scale factor of the dataset, such as 100000")
+    parser.add_argument("-s", "--streaming", action="store_true", default=False,
+                        help="stream the tbl files into the output without loading the tables into memory")
+    parser.add_argument("-ml", "--memory_limit", type=str, action="store",
+                        help="indicate the memory limit of DuckDB during conversion, such as 4GB")
+    parser.add_argument("-tmp", "--tmp_folder", type=str, action="store",
+                        help="indicate the folder DuckDB spills to beyond the memory limit")
+    parser.add_argument("-nf", "--num_files", type=int, action="store", default=1,
+                        help="indicate the number of parquet files a large table is split into")
+    parser.add_argument("-nw", "--num_workers", type=int, action="store", default=4,
+                        help="indicate the number of chunk files converted in parallel")
+    parser.add_argument("-sth", "--split_threshold", type=int, action="store", default=1024,
+                        help="indicate the size (MB) from which a single source file is split, such as 1024")
+    parser.add_argument("-l", "--layout", type=str, action="store", default="none", choices=LAYOUTS,
+                        help="indicate how the rows of a table are ordered before they are written")
+    parser.add_argument("-ck", "--clustering_keys", type=str, action="store", nargs="+",
+                        help="override the clustering keys of tables, such as lineitem:L_SHIPDATE,L_ORDERKEY")
     args = parser.parse_args()
 
     tbl_name = args.table_name
     data_folder = args.data_folder
     output_format = args.output_format
     row_group_size = args.row_group_size
+    streaming = args.streaming
 
     if output_format == "parquet" and row_group_size is None:
         raise ValueError("Please indicate row group size for parquet")
@@ -53,19 +84,43 @@ def main():
 
     region_schema = "(R_REGIONKEY INTEGER, R_NAME VARCHAR, R_COMMENT VARCHAR)"
 
+    layout = args.layout
+    table_keys = clustering_keys(CLUSTERING_KEYS, args.clustering_keys)
+
     db_conn = duckdb.connect(database=':memory:')
+    configure_memory(db_conn, args.memory_limit, args.tmp_folder)
 
     for table in table_list:
-        print(f"Convert {table}.tbl to parquet...")
-        table_schema = table + "_schema"
-        db_conn.execute(f"CREATE TABLE {table} {locals()[table_schema]};")
-        db_conn.execute(f"COPY {table} FROM '{data_folder}/{table}.tbl' ( DELIMITER '|' );")
+        print(f"Convert {table}.tbl to {output_format}...")
+        table_schema = locals()[table + "_schema"]
+        convert_start = time.perf_counter()
+        keys = table_keys.get(table)
+        table_files = source_files(data_folder, table, "tbl")
+        multi_file = is_multi_file(table_files, output_format, args.num_files, args.split_threshold)
+        if output_format == "parquet":
+            clear_parquet_output(table)
+        if multi_file:
+            # one parquet file per chunk of the source, or per thread of the COPY
+            convert_multi_file(db_conn, table, table_schema, table_files, table, row_group_size,
+                               args.num_files, args.num_workers, keys, layout)
+        elif streaming or len(table_files) > 1:
+            # peak memory is bounded by the memory limit instead of the size of the table
+            convert_streaming(db_conn, table, table_schema, table_files,
+                              f"{table}.{output_format}", output_format, row_group_size, keys, layout)
+        else:
+            db_conn.execute(f"CREATE TABLE {table} {table_schema};")
+            db_conn.execute(f"COPY {table} FROM '{table_files[0]}' ( DELIMITER '|' );")
+            if output_format == "parquet":
+                db_conn.execute(f"COPY ({clustered_query(table, keys, layout)}) TO '{table}.parquet' (FORMAT 'parquet', ROW_GROUP_SIZE {row_group_size});")
+            elif output_format == "csv":
+                db_conn.execute(f"COPY ({clustered_query(table, keys, layout)}) TO '{table}.csv' WITH (HEADER 1, DELIMITER ',');;")
+        print_conversion_stats(table, convert_start)
+
         if output_format == "parquet":
-            db_conn.execute(f"COPY {table} TO '{table}.parquet' (FORMAT 'parquet', ROW_GROUP_SIZE {row_group_size});")
-            parquet_file = pq.ParquetFile(f"{table}.parquet")
-            print("Number of row groups in {}.parquet: {}".format(table, parquet_file.num_row_groups))
-        elif output_format == "csv":
-            db_conn.execute(f"COPY {table} TO '{table}.csv' WITH (HEADER 1, DELIMITER ',');;")
+            parquet_output = table if multi_file else f"{table}.parquet"
+            print_parquet_stats(parquet_output)
+            if keys:
+                print_stats_coverage(db_conn, parquet_output, keys)
 
 
 if __name__ == "__main__":
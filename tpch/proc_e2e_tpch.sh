@@ -7,9 +7,9 @@ SP=50
 TMP="tmp"
 DATABASE="tpch-sf$SF.db"
 DATA_FILE="../dataset/tpch/parquet-sf$SF"
-CRIU_CMD=/opt/criu/sbin/criu
+# criu_driver.py uses this criu binary, or a stub such as ../criu/criu_stub.py with RIVETER_CRIU_SUDO=0
+export RIVETER_CRIU_CMD=/opt/criu/sbin/criu
 CKPT_PATH=./criu-ckpt
-PID=0
 
 # sf-10
 #exec_times=(7.6 0.9 4 3.9 4.2 3.4 8.1 4.2 12.7 5.9 0.4 2.2 4.8 3.3 4.7 0.9 8.3 14.3 5.9 4.3 10.3 1.7)
@@ -48,46 +48,9 @@ for ((i=0 ; i < ${#queries[@]} ; ++i)); do
   st=$(echo "scale=3; $et * $sp / 100" | bc)
   echo "Suspension Time: $st"
 
-  # checkpoint process into disk
-  start_time=$(date +%s.%3N)
-
-  python3 ratchet_tpch.py -q "$qid" -d "$DATABASE" -df "$DATA_FILE" -td "$THREAD" -tmp $TMP &
-  PID=$!
-
-  sleep "$st"
-  echo "== Suspend Job at SP$SP =="
-  
-  if [ -d "$CKPT_PATH/ckpt_sf${SF}_${qid}_sp${SP}" ]; then
-    echo "Removing and Creating $CKPT_PATH/ckpt_sf${SF}_${qid}_sp${SP} folder."
-    rm -rf "$CKPT_PATH/ckpt_sf${SF}_${qid}_sp${SP}"
-    mkdir "$CKPT_PATH/ckpt_sf${SF}_${qid}_sp${SP}"
-  else
-    echo "Creating $CKPT_PATH/ckpt_sf${SF}_${qid}_sp${SP} folder."
-    mkdir "$CKPT_PATH/ckpt_sf${SF}_${qid}_sp${SP}"
-  fi
-
-  sudo "$CRIU_CMD" dump -D "$CKPT_PATH/ckpt_sf${SF}_${qid}_sp${SP}" -t "${PID}" --file-locks --shell-job
-  echo "Dumping to $CKPT_PATH/ckpt_sf${SF}_${qid}_sp${SP}"
-
-  # force data sync between buffer and disk
-  sync
-
-  # clean page cache
-  sudo sysctl -w vm.drop_caches=1
-
-  echo "== Resume Job at ${SP} =="
-  echo "Restoring from $CKPT_PATH/ckpt_sf${SF}_${qid}_sp${SP}"
-
-  # restore the process from disk and print out final results
-  output=$(sudo "$CRIU_CMD" restore -D "$CKPT_PATH/ckpt_sf${SF}_${qid}_sp${SP}" --file-locks --shell-job)
-  echo "$output"
-  # sudo "$CRIU_CMD" restore -D "$CKPT_PATH/ckpt_sf${SF}_${qid}_sp${SP}" --file-locks --shell-job
-
-  end_time=$(date +%s.%3N)
-
-  # elapsed time with millisecond resolution
-  # keep three digits after floating point.
-  elapsed=$(echo "scale=3; $end_time - $start_time" | bc)
-  eval "echo Elapsed Time: $elapsed seconds"
+  # suspend at SP, sync, drop the page cache and resume, the phase metrics are appended as one JSON line
+  echo "== Suspend and Resume Job at SP$sp =="
+  python3 ../criu_driver.py -o "proc_e2e_sf${SF}.jsonl" perf -cp "$CKPT_PATH/ckpt_sf${SF}_${qid}_sp${sp}" -dc -s "$st" \
+    -- python3 ratchet_tpch.py -q "$qid" -d "$DATABASE" -df "$DATA_FILE" -td "$THREAD" -tmp $TMP
   
 done
@@ -2,9 +2,15 @@ import duckdb
 import argparse
 import time
 import pandas as pd
+import sys
 
+from pathlib import Path
 from queries import *
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from ingestion import TABLE_MODES, print_setup_timing, setup_tables, table_modes
+from result_sink import get_result_sink
+
 
 def main():
     parser = argparse.ArgumentParser()
@@ -20,10 +26,20 @@ def main():
                         help="indicate the tmp folder for DuckDB, such as </tmp>")
     parser.add_argument("-td", "--thread", type=int, action="store", default=1,
                         help="indicate the number of threads in DuckDB")
+    parser.add_argument("-rs", "--result_sink", type=str, action="store", default="pandas",
+                        choices=["pandas", "arrow", "count"],
+                        help="indicate how to consume the query result: a pandas DataFrame, Arrow record batches, "
+                             "or only the row count and checksum")
+    parser.add_argument("-ro", "--result_output", type=str, action="store",
+                        help="indicate the Arrow IPC stream file for the result when using the arrow result sink")
     parser.add_argument("-pl", "--persistence_location", type=str, action="store",
                         help="indicate the persisted data or folder during suspension and resumption")
     parser.add_argument("-ut", "--update_table", action="store_true",
                         help="force to update table in database")
+    parser.add_argument("-tm", "--table_mode", type=str, action="store", default="table", choices=TABLE_MODES,
+                        help="indicate whether the tables are loaded into the database or queried in place as views")
+    parser.add_argument("-ptm", "--per_table_mode", type=str, action="store", nargs="+",
+                        help="override the mode of tables, such as lineitem:view orders:table")
 
     args = parser.parse_args()
 
@@ -32,7 +48,10 @@ def main():
     data_folder = args.data_folder
     tmp_folder = args.tmp_folder
     thread = args.thread
+    result_sink = get_result_sink(args.result_sink, args.result_output)
     update_table = args.update_table
+    table_mode = args.table_mode
+    per_table_mode = args.per_table_mode
 
     query = globals()[qid].query
 
@@ -47,22 +66,26 @@ def main():
 
     tpch_table_names = ["part", "supplier", "partsupp", "customer", "orders", "lineitem", "nation", "region"]
 
-    # Create or Update TPC-H Datasets
-    for t in tpch_table_names:
-        if update_table:
-            db_conn.execute(f"DROP TABLE IF EXISTS {t};")
-        db_conn.execute(f"CREATE TABLE IF NOT EXISTS {t} AS SELECT * FROM read_parquet('{data_folder}/{t}.parquet');")
+    # Create or Update TPC-H Datasets, only the tables whose parquet files changed are reloaded,
+    # and the tables in view mode are queried in place without being loaded
+    modes = table_modes(tpch_table_names, table_mode, per_table_mode)
+    setup_start = time.perf_counter()
+    setup_tables(db_conn, data_folder, modes, update_table)
+    setup_time = time.perf_counter() - setup_start
 
+    call_start = time.perf_counter()
     if isinstance(query, list):
         for idx, query in enumerate(query):
             if idx == len(query) - 1:
-                results = db_conn.execute(query).fetchdf()
+                result_sink.consume(db_conn.execute(query))
             else:
                 db_conn.execute(query)
     else:
-        results = db_conn.execute(query).fetchdf()
+        result_sink.consume(db_conn.execute(query))
+    call_time = time.perf_counter() - call_start
 
-    print(results)
+    print_setup_timing(modes, setup_time, call_time)
+    result_sink.report()
 
 
 if __name__ == "__main__":
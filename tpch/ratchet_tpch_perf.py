@@ -2,9 +2,16 @@ import duckdb
 import argparse
 import time
 import pandas as pd
+import sys
 
+from pathlib import Path
 from queries import *
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from ingestion import TABLE_MODES, mode_summary, print_setup_timing, setup_tables, table_modes
+from result_sink import get_result_sink
+from suspension_log import append_timing_record, draw_suspend_point
+
 
 def main():
     pd.set_option('display.float_format', '{:.1f}'.format)
@@ -21,12 +28,22 @@ def main():
 
     parser.add_argument("-ut", "--update_table", action="store_true",
                         help="force to update table in database")
+    parser.add_argument("-tm", "--table_mode", type=str, action="store", default="table", choices=TABLE_MODES,
+                        help="indicate whether the tables are loaded into the database or queried in place as views")
+    parser.add_argument("-ptm", "--per_table_mode", type=str, action="store", nargs="+",
+                        help="override the mode of tables, such as lineitem:view orders:table")
 
     parser.add_argument("-tmp", "--tmp_folder", type=str, action="store", required=True,
                         help="indicate the tmp folder for DuckDB, such as <exp/tmp>")
 
     parser.add_argument("-td", "--thread", type=int, action="store", default=1,
                         help="indicate the number of threads in DuckDB")
+    parser.add_argument("-rs", "--result_sink", type=str, action="store", default="pandas",
+                        choices=["pandas", "arrow", "count"],
+                        help="indicate how to consume the query result: a pandas DataFrame, Arrow record batches, "
+                             "or only the row count and checksum")
+    parser.add_argument("-ro", "--result_output", type=str, action="store",
+                        help="indicate the Arrow IPC stream file for the result when using the arrow result sink")
 
     parser.add_argument("-s", "--suspend_query", action="store_true", default=False,
                         help="whether it is a suspend query")
@@ -44,6 +61,8 @@ def main():
 
     parser.add_argument("-psr", "--partition_suspend_resume", action="store_true", default=False,
                         help="indicate whether we will use partitioned file for suspend and resume")
+    parser.add_argument("-tl", "--timing_log", type=str, action="store",
+                        help="indicate the file to append the timing and persisted size of this run")
     args = parser.parse_args()
 
     qid = args.query
@@ -51,16 +70,22 @@ def main():
     data_folder = args.data_folder
     tmp_folder = args.tmp_folder
     thread = args.thread
+    result_sink = get_result_sink(args.result_sink, args.result_output)
     suspend_query = args.suspend_query
     resume_query = args.resume_query
     update_table = args.update_table
+    table_mode = args.table_mode
+    per_table_mode = args.per_table_mode
     partition_suspend_resume = args.partition_suspend_resume
+    timing_log = args.timing_log
 
     exec_query = globals()[qid].query
 
     if suspend_query:
         suspend_start_time = args.suspend_start_time
         suspend_end_time = args.suspend_end_time
+        # the query is suspended at this point, so it is logged instead of the start of the window
+        suspend_point = draw_suspend_point(suspend_start_time, suspend_end_time)
         suspend_location = args.suspend_location
 
     if resume_query:
@@ -79,35 +104,51 @@ def main():
 
     tpch_table_names = ["part", "supplier", "partsupp", "customer", "orders", "lineitem", "nation", "region"]
 
-    # Create or Update TPC-H Datasets
-    for t in tpch_table_names:
-        if update_table:
-            db_conn.execute(f"DROP TABLE IF EXISTS {t};")
-        db_conn.execute(f"CREATE TABLE IF NOT EXISTS {t} AS SELECT * FROM read_parquet('{data_folder}/{t}.parquet');")
+    # Create or Update TPC-H Datasets, only the tables whose parquet files changed are reloaded,
+    # and the tables in view mode are queried in place without being loaded
+    modes = table_modes(tpch_table_names, table_mode, per_table_mode)
+    setup_start = time.perf_counter()
+    setup_tables(db_conn, data_folder, modes, update_table)
+    setup_time = time.perf_counter() - setup_start
 
     # start the query execution
-    results = None
+    call_start = time.perf_counter()
+    call_start_time = time.time()
     if suspend_query:
         execution = db_conn.execute_suspend(exec_query,
                                             suspend_location,
-                                            suspend_start_time,
-                                            suspend_end_time,
+                                            suspend_point,
+                                            suspend_point,
                                             partition_suspend_resume)
-        results = execution.fetchdf()
+        result_sink.consume(execution)
     elif resume_query:
         execution = db_conn.execute_resume(exec_query, resume_location, partition_suspend_resume)
-        results = execution.fetchdf()
+        result_sink.consume(execution)
     else:
         if isinstance(exec_query, list):
             for idx, query in enumerate(exec_query):
                 if idx == len(exec_query) - 1:
-                    results = db_conn.execute(query).fetchdf()
+                    result_sink.consume(db_conn.execute(query))
                 else:
                     db_conn.execute(query)
         else:
-            results = db_conn.execute(exec_query).fetchdf()
+            result_sink.consume(db_conn.execute(exec_query))
+
+    call_time = time.perf_counter() - call_start
+
+    if timing_log is not None:
+        if suspend_query:
+            append_timing_record(timing_log, qid, "suspend", thread, call_time, suspend_point,
+                                 suspend_location, partition_suspend_resume, call_start_time=call_start_time)
+        elif resume_query:
+            append_timing_record(timing_log, qid, "resume", thread, call_time,
+                                 location=resume_location, partitioned=partition_suspend_resume)
+        else:
+            append_timing_record(timing_log, qid, "query", thread, call_time,
+                                 table_mode=mode_summary(modes), setup_time=setup_time)
 
-    print(results)
+    print_setup_timing(modes, setup_time, call_time)
+    result_sink.report()
     end = time.perf_counter()
     # print("Total Runtime: {}".format(end - start))
     print("{}".format(end - start))
@@ -7,9 +7,9 @@ THREAD=1
 TMP="tmp"
 DATABASE="tpch-sf$SF.db"
 DATA_FILE="../dataset/tpch/parquet-sf$SF"
-CRIU_CMD=/opt/criu/sbin/criu
+# criu_driver.py uses this criu binary, or a stub such as ../criu/criu_stub.py with RIVETER_CRIU_SUDO=0
+export RIVETER_CRIU_CMD=/opt/criu/sbin/criu
 CKPT_PATH=./criu-ckpt
-PID=0
 
 # sf-100
 exec_times=(108 9.9 80.6 81.1 71.9 62.4 138 80.7 158.6 84.9 6.8 50.5 64 60 88.3 10.6 116.1 209.7 99.9 72.4 242.4 22.2)
@@ -58,42 +58,10 @@ for ((i=0 ; i < ${#queries[@]} ; ++i)); do
 
   echo "Termination Time: $ttp"
 
-  python3 ratchet_normal.py -q "$qid" -d "$DATABASE" -df "$DATA_FILE" -td "$THREAD" -tmp $TMP &
-  PID=$!
-
-  sleep "$ttp"
+  # suspend at the termination time, sync, drop the page cache and resume,
+  # the phase metrics are appended as one JSON line
   echo "== Suspension at $ttp =="
-  
-  if [ -d "$CKPT_PATH/ckpt_sf${SF}_${qid}_ttp${ttp_mark}" ]; then
-    echo "Removing and Creating $CKPT_PATH/ckpt_sf${SF}_${qid}_ttp${ttp_mark} folder."
-    rm -rf "$CKPT_PATH/ckpt_sf${SF}_${qid}_ttp${ttp_mark}"
-    mkdir "$CKPT_PATH/ckpt_sf${SF}_${qid}_ttp${ttp_mark}"
-  else
-    echo "Creating $CKPT_PATH/ckpt_sf${SF}_${qid}_ttp${ttp_mark} folder."
-    mkdir "$CKPT_PATH/ckpt_sf${SF}_${qid}_ttp${ttp_mark}"
-  fi
-
-  sudo "$CRIU_CMD" dump -D "$CKPT_PATH/ckpt_sf${SF}_${qid}_ttp${ttp_mark}" -t "${PID}" --file-locks --shell-job
-  echo "Dumping to $CKPT_PATH/ckpt_sf${SF}_${qid}_ttp${ttp_mark}"
-
-  # force data sync between buffer and disk
-  sync
-
-  # clean page cache
-  sudo sysctl -w vm.drop_caches=1
-
-  echo "== Resume at ${SP} =="
-  echo "Restoring from $CKPT_PATH/ckpt_sf${SF}_${qid}_ttp${ttp_mark}"
-
-  # restore the process from disk and print out final results
-  output=$(sudo "$CRIU_CMD" restore -D "$CKPT_PATH/ckpt_sf${SF}_${qid}_ttp${ttp_mark}" --file-locks --shell-job)
-  echo "$output"
-
-  end_time=$(date +%s.%3N)
-
-  # elapsed time with millisecond resolution
-  # keep three digits after floating point.
-  elapsed=$(echo "scale=3; $end_time - $start_time" | bc)
-  eval "echo Elapsed Time: $elapsed seconds"
+  python3 ../criu_driver.py -o "ttw_proc_sf${SF}_ttp${ttp_mark}.jsonl" perf -cp "$CKPT_PATH/ckpt_sf${SF}_${qid}_ttp${ttp_mark}" -dc -s "$ttp" \
+    -- python3 ratchet_normal.py -q "$qid" -d "$DATABASE" -df "$DATA_FILE" -td "$THREAD" -tmp $TMP
 done
 
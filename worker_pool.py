@@ -0,0 +1,331 @@
+import argparse
+import importlib
+import os
+import queue
+import threading
+import time
+import duckdb
+import multiprocessing as mp
+
+from multiprocessing.connection import Listener, Client
+from ingestion import load_tables
+from result_sink import CountSink
+from shm_channel import IPC_NAMESPACE_ENV, SEM_PIPELINE_BREAKER_KEYFILE, PipelineBreakerNotifier, namespaced_keyfile
+from suspension_log import draw_suspend_point
+
+POOL_ADDRESS = "/tmp/riveter_worker_pool.sock"
+POOL_AUTHKEY = b"riveter"
+# Attempts to restart a dead worker before it is dropped from the pool
+POOL_RESTART_ATTEMPTS = 2
+
+TABLE_NAMES = {
+    "vanilla": ["part", "supplier", "partsupp", "customer", "orders", "lineitem", "nation", "region"],
+    "tpch": ["part", "supplier", "partsupp", "customer", "orders", "lineitem", "nation", "region"],
+    "tpcds": ["call_center", "catalog_page", "catalog_returns", "catalog_sales", "customer",
+              "customer_address", "customer_demographics", "date_dim", "dbgen_version",
+              "household_demographics", "income_band", "inventory", "item", "promotion",
+              "reason", "ship_mode", "store", "store_returns", "store_sales", "time_dim",
+              "warehouse", "web_page", "web_returns", "web_sales", "web_site"]
+}
+
+
+def ingest_tables(db_conn, benchmark, data_folder):
+    load_tables(db_conn, data_folder, TABLE_NAMES[benchmark])
+
+
+def run_job(db_conn, benchmark, job):
+    exec_query = importlib.import_module(f"{benchmark}.queries.{job['qid']}").query
+    op = job.get("op", "query")
+
+    exec_start = time.perf_counter()
+    if op == "suspend":
+        # reported back with the response, so the client knows where the query was suspended
+        job["suspend_point"] = draw_suspend_point(job["suspend_start_time"], job["suspend_end_time"])
+        execution = db_conn.execute_suspend(exec_query,
+                                            job["suspend_location"],
+                                            job["suspend_point"],
+                                            job["suspend_point"],
+                                            job.get("partition_suspend_resume", False))
+    elif op == "resume":
+        execution = db_conn.execute_resume(exec_query,
+                                           job["resume_location"],
+                                           job.get("partition_suspend_resume", False))
+    elif op == "query":
+        if isinstance(exec_query, list):
+            for query in exec_query[:-1]:
+                db_conn.execute(query)
+            exec_query = exec_query[-1]
+        execution = db_conn.execute(exec_query)
+    else:
+        raise ValueError(f"Job operation {op} is not supported")
+    exec_end = time.perf_counter()
+
+    # only count and checksum the result, so the fetch is not dominated by building the result
+    result_sink = CountSink()
+    result_sink.consume(execution)
+    fetch_end = time.perf_counter()
+
+    return result_sink, exec_end - exec_start, fetch_end - exec_end
+
+
+def worker_loop(worker_conn, namespace, benchmark, database, data_folder, tmp_folder, thread):
+    # Every worker keeps its connection (and the loaded tables) alive across jobs, and Ratchet creates
+    # the segments of its queries in the namespace of the worker, so concurrent jobs do not collide
+    os.environ[IPC_NAMESPACE_ENV] = namespace
+    if database == "memory":
+        db_conn = duckdb.connect(database=':memory:')
+        ingest_tables(db_conn, benchmark, data_folder)
+    else:
+        # the pool ingests the tables once before the workers start, so workers only read
+        db_conn = duckdb.connect(database=database, read_only=True)
+
+    db_conn.execute(f"PRAGMA temp_directory='{tmp_folder}'")
+    db_conn.execute(f"PRAGMA threads={thread}")
+
+    worker_conn.send({"status": "ready", "worker_pid": os.getpid()})
+
+    while True:
+        try:
+            job = worker_conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+
+        try:
+            result_sink, exec_time, fetch_time = run_job(db_conn, benchmark, job)
+            response = {"status": "done", "num_rows": result_sink.num_rows, "checksum": result_sink.checksum,
+                        "exec_time": exec_time, "fetch_time": fetch_time}
+            if "suspend_point" in job:
+                response["suspend_point"] = job["suspend_point"]
+            worker_conn.send(response)
+        except Exception as e:
+            worker_conn.send({"status": "error", "error": repr(e)})
+
+    db_conn.close()
+
+
+class PoolWorker:
+    def __init__(self, worker_id, benchmark, database, data_folder, tmp_folder, thread):
+        self.worker_id = worker_id
+        self.thread = thread
+        self.namespace = f"worker{worker_id}"
+        self.args = (self.namespace, benchmark, database, data_folder, tmp_folder, thread)
+        self.conn = None
+        self.proc = None
+        self.pid = None
+        # owned by the pool, so it outlives the worker processes and Riveter only opens it
+        self.notifier = PipelineBreakerNotifier(namespaced_keyfile(SEM_PIPELINE_BREAKER_KEYFILE, self.namespace),
+                                                create=True)
+
+    def start(self):
+        self.conn, worker_conn = mp.Pipe()
+        self.proc = mp.Process(target=worker_loop, args=(worker_conn, *self.args), daemon=True)
+        self.proc.start()
+        self.pid = self.conn.recv()["worker_pid"]
+
+    def restart(self):
+        if self.proc.is_alive():
+            self.proc.kill()
+        self.proc.join()
+        self.conn.close()
+        self.start()
+
+    def stop(self):
+        if self.proc is not None and self.proc.is_alive():
+            self.conn.send(None)
+            self.proc.join()
+        self.notifier.remove()
+
+
+class WorkerPool:
+    def __init__(self, benchmark, database, data_folder, tmp_folder, thread_list, address=POOL_ADDRESS):
+        self.benchmark = benchmark
+        self.database = database
+        self.data_folder = data_folder
+        self.address = address
+
+        self.workers = [PoolWorker(i, benchmark, database, data_folder, tmp_folder, td)
+                        for i, td in enumerate(thread_list)]
+        self.idle_workers = queue.Queue()
+
+    def start(self):
+        bootstrap_start = time.perf_counter()
+        if self.database != "memory":
+            db_conn = duckdb.connect(database=self.database)
+            ingest_tables(db_conn, self.benchmark, self.data_folder)
+            db_conn.close()
+
+        for worker in self.workers:
+            worker.start()
+            self.idle_workers.put(worker)
+        print(f"[Pool] {len(self.workers)} workers are ready in {time.perf_counter() - bootstrap_start:.3f}s")
+
+    def dispatch(self, client_conn):
+        job = client_conn.recv()
+        submit_time = time.perf_counter()
+
+        if not self.workers:
+            # every worker was dropped, nothing would ever become idle
+            try:
+                client_conn.send({"status": "error", "error": "worker pool has no workers left", "worker_pid": None})
+            except OSError:
+                pass
+            client_conn.close()
+            return
+
+        worker = self.idle_workers.get()
+        dispatch_time = time.perf_counter()
+
+        worker_pid = worker.pid
+        restarted = True
+        try:
+            # drop a notification left by the previous job of this worker
+            worker.notifier.drain()
+            worker.conn.send(job)
+            try:
+                client_conn.send({"status": "running", "worker_id": worker.worker_id, "worker_pid": worker_pid,
+                                  "ipc_namespace": worker.namespace})
+            except OSError:
+                # the client is gone, the worker still finishes the job before it is idle again
+                pass
+            response = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            # the worker process is gone, e.g., after a process-level suspension or while it was idle
+            response = {"status": "error", "error": f"worker {worker_pid} exited: {e!r}"}
+            restarted = self.restart_worker(worker)
+        finally:
+            # a worker that could not be restarted is dropped, so no later job is sent to a dead process
+            if restarted:
+                self.idle_workers.put(worker)
+
+        response["worker_id"] = worker.worker_id
+        response["worker_pid"] = worker_pid
+        response["thread"] = worker.thread
+        response["queue_time"] = dispatch_time - submit_time
+        response["total_time"] = time.perf_counter() - submit_time
+        try:
+            # a job that failed before it started is answered with this response instead of the ack
+            client_conn.send(response)
+        except OSError:
+            pass
+        client_conn.close()
+
+    def restart_worker(self, worker):
+        for attempt in range(POOL_RESTART_ATTEMPTS):
+            try:
+                worker.restart()
+                return True
+            except (EOFError, OSError) as restart_error:
+                print(f"[Pool] Cannot restart worker {worker.worker_id} "
+                      f"(attempt {attempt + 1}/{POOL_RESTART_ATTEMPTS}): {restart_error!r}")
+        self.workers.remove(worker)
+        if worker.proc.is_alive():
+            worker.proc.kill()
+        worker.notifier.remove()
+        print(f"[Pool] Dropped worker {worker.worker_id}, {len(self.workers)} workers left")
+        return False
+
+    def serve_forever(self):
+        if os.path.exists(self.address):
+            os.remove(self.address)
+
+        with Listener(self.address, family="AF_UNIX", authkey=POOL_AUTHKEY) as listener:
+            print(f"[Pool] Listening on {self.address}")
+            while True:
+                client_conn = listener.accept()
+                threading.Thread(target=self.dispatch, args=(client_conn,), daemon=True).start()
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+
+class PoolJobHandle:
+    # Mirrors the parts of subprocess.Popen used by the orchestrator
+    def __init__(self, conn, worker_pid, namespace=None):
+        self.conn = conn
+        self.pid = worker_pid
+        self.namespace = namespace
+        self.returncode = None
+        self.response = None
+
+    def poll(self):
+        if self.returncode is None and self.conn.poll():
+            self._receive()
+        return self.returncode
+
+    def wait(self):
+        if self.returncode is None:
+            self._receive()
+        return self.returncode
+
+    def _receive(self):
+        try:
+            self.response = self.conn.recv()
+        except EOFError:
+            self.response = {"status": "error", "error": "worker pool closed the connection"}
+        self.conn.close()
+        self.returncode = 0 if self.response["status"] == "done" else 1
+
+
+class WorkerPoolClient:
+    def __init__(self, address=POOL_ADDRESS):
+        self.address = address
+
+    def submit(self, job):
+        conn = Client(self.address, family="AF_UNIX", authkey=POOL_AUTHKEY)
+        conn.send(job)
+        ack = conn.recv()
+        handle = PoolJobHandle(conn, ack["worker_pid"], ack.get("ipc_namespace"))
+        if ack["status"] != "running":
+            # the job never started, e.g., the worker died while it was idle
+            handle.response = ack
+            handle.returncode = 1
+            conn.close()
+        return handle
+
+    def run(self, job):
+        submit_start = time.perf_counter()
+        handle = self.submit(job)
+        handle.wait()
+        handle.response["client_time"] = time.perf_counter() - submit_start
+        return handle.response
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-b", "--benchmark", type=str, action="store", required=True,
+                        choices=["vanilla", "tpch", "tpcds"],
+                        help="indicate the benchmark for evaluation")
+    parser.add_argument("-d", "--database", type=str, action="store", default="memory",
+                        help="indicate the database location, memory or other location")
+    parser.add_argument("-df", "--data_folder", type=str, action="store", required=True,
+                        help="indicate the dataset for queries, such as <dataset/tpch/parquet-sf1>")
+    parser.add_argument("-tmp", "--tmp_folder", type=str, action="store", default="tmp",
+                        help="indicate the tmp folder for DuckDB, such as <exp/tmp>")
+    parser.add_argument("-nw", "--num_workers", type=int, action="store", default=1,
+                        help="indicate the number of pre-warmed workers")
+    parser.add_argument("-td", "--thread", type=int, action="store", nargs="+", default=[1],
+                        help="indicate the number of threads for each worker, one value for all or one per worker")
+    parser.add_argument("-a", "--address", type=str, action="store", default=POOL_ADDRESS,
+                        help="indicate the unix socket the pool listens on")
+    args = parser.parse_args()
+
+    if len(args.thread) == 1:
+        thread_list = args.thread * args.num_workers
+    elif len(args.thread) == args.num_workers:
+        thread_list = args.thread
+    else:
+        raise ValueError("Please indicate one thread number or one per worker")
+
+    pool = WorkerPool(args.benchmark, args.database, args.data_folder, args.tmp_folder, thread_list, args.address)
+    pool.start()
+    try:
+        pool.serve_forever()
+    except KeyboardInterrupt:
+        pool.stop()
+
+
+if __name__ == "__main__":
+    main()